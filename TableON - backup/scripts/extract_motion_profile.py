@@ -0,0 +1,123 @@
+import glob
+import json
+import math
+import os
+import re
+import sys
+import time
+
+# order_service_daily.log 의 TSK|STR / TSK|END 쌍에서 명령별 로봇 동작 시간 분포를 추출합니다.
+# 결과는 config/motion_profile.json 으로 저장되며, robot_service 의 MockIndyDCP3 가 시뮬레이션 시간으로 사용합니다.
+# 사용: python scripts/extract_motion_profile.py [로그 경로 glob] [출력 파일]
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+DEFAULT_LOGS = os.path.join(BASE_DIR, 'logs', 'order_service_daily.log*')
+DEFAULT_OUTPUT = os.path.join(BASE_DIR, 'config', 'motion_profile.json')
+
+# 이 시간보다 긴 구간은 수동 개입/대기 등으로 보고 제외
+MAX_DURATION_SEC = 120.0
+
+LINE_RE = re.compile(r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}),(\d{3}) \[\w+\] (.*)$')
+FAIL_RE = re.compile(r'Task (T\d+) failed')
+
+def parse_ts(date_part, ms_part):
+    return time.mktime(time.strptime(date_part, '%Y-%m-%d %H:%M:%S')) + int(ms_part) / 1000.0
+
+def log_files(pattern):
+    # 날짜 접미사가 붙은 이전 로그부터, 접미사 없는 현재 로그를 마지막에
+    files = glob.glob(pattern)
+    return sorted(files, key=lambda p: (os.path.basename(p).count('.') == 1, p))
+
+def collect_samples(files):
+    """
+    명령별 동작 시간 목록을 반환합니다.
+    STR 이후 첫 DEV| 로그(장비 동작 시작)가 있으면 거기까지를 동작 시간으로 봅니다.
+    (END는 post_device_action 이 끝난 뒤에 기록되므로)
+    """
+    samples = {}
+    for path in files:
+        open_tasks = {}  # task_id -> [cmd, start_ts, motion_end_ts]
+        last_started = None
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                m = LINE_RE.match(line.rstrip('\n'))
+                if not m:
+                    continue
+                ts = parse_ts(m.group(1), m.group(2))
+                msg = m.group(3)
+
+                if msg.startswith('TSK|STR|'):
+                    parts = msg.split('|')
+                    if len(parts) < 4 or not parts[3].isdigit():
+                        continue
+                    open_tasks[parts[2]] = [int(parts[3]), ts, None]
+                    last_started = parts[2]
+                elif msg.startswith('TSK|END|'):
+                    task_id = msg.split('|')[2]
+                    entry = open_tasks.pop(task_id, None)
+                    if entry is None:
+                        continue
+                    cmd, start, motion_end = entry
+                    duration = (motion_end or ts) - start
+                    if 0 < duration <= MAX_DURATION_SEC:
+                        samples.setdefault(cmd, []).append(duration)
+                elif msg.startswith('DEV|'):
+                    entry = open_tasks.get(last_started)
+                    if entry and entry[2] is None:
+                        entry[2] = ts
+                else:
+                    fail = FAIL_RE.search(msg)
+                    if fail:
+                        open_tasks.pop(fail.group(1), None)
+                    elif msg.startswith('SYS|ROBOT_PROGRAM_'):
+                        # 로봇 프로그램 시작/정지 → 진행 중이던 태스크는 버림
+                        open_tasks.clear()
+    return samples
+
+def summarize(values):
+    values = sorted(values)
+    n = len(values)
+    mean = sum(values) / n
+    std = math.sqrt(sum((v - mean) ** 2 for v in values) / (n - 1)) if n > 1 else 0.0
+
+    def pct(p):
+        return values[min(n - 1, int(round(p * (n - 1))))]
+
+    return {
+        'count': n,
+        'mean': round(mean, 3),
+        'std': round(std, 3),
+        'min': round(values[0], 3),
+        'p50': round(pct(0.5), 3),
+        'p90': round(pct(0.9), 3),
+        'max': round(values[-1], 3),
+    }
+
+def main():
+    pattern = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_LOGS
+    output = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_OUTPUT
+
+    files = log_files(pattern)
+    if not files:
+        print(f"[MotionProfile] No log files match: {pattern}")
+        sys.exit(1)
+
+    samples = collect_samples(files)
+    profile = {
+        '_comment': 'scripts/extract_motion_profile.py 로 생성 (명령별 로봇 동작 시간, 초)',
+        'generated_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'sources': [os.path.basename(p) for p in files],
+        'commands': {str(cmd): summarize(values) for cmd, values in sorted(samples.items())},
+    }
+
+    tmp_path = output + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(profile, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, output)
+
+    print(f"[MotionProfile] {len(files)} log files -> {output}")
+    for cmd, stat in profile['commands'].items():
+        print(f"  CMD {cmd}: n={stat['count']:4d} mean={stat['mean']:6.2f}s std={stat['std']:5.2f}s p90={stat['p90']:6.2f}s")
+
+if __name__ == "__main__":
+    main()
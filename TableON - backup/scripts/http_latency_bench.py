@@ -0,0 +1,99 @@
+import argparse
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+
+import requests
+
+# Flask 개발 서버와 waitress(http_server.serve 와 같은 설정)의 응답 지연을 비교합니다.
+# recipe_service 의 app 을 두 서버로 동시에 띄우고 같은 요청을 보냅니다. (하드웨어/다른 서비스 불필요)
+# 사용: python scripts/http_latency_bench.py [-n 요청 수] [-c 동시 연결 수] [--path /getRecipe/3]
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(BASE_DIR, 'src', 'services'))
+
+import recipe_service
+from http_server import load_http_config
+
+DEV_PORT = 18200
+WAITRESS_PORT = 18201
+
+def start_dev(app, port):
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def start_waitress(app, port, conf):
+    from waitress.server import create_server
+    server = create_server(app, host='127.0.0.1', port=port, threads=conf['threads'],
+                           connection_limit=conf['connection_limit'], channel_timeout=conf['channel_timeout'],
+                           backlog=conf['backlog'])
+    threading.Thread(target=server.run, daemon=True).start()
+    return server
+
+def sequential(url, n, keep_alive):
+    session = requests.Session() if keep_alive else requests
+    samples = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        session.get(url, timeout=5).raise_for_status()
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    return samples, None
+
+def concurrent(url, n, clients):
+    samples, lock = [], threading.Lock()
+    per_client = max(1, n // clients)
+
+    def worker():
+        session = requests.Session()
+        local = []
+        for _ in range(per_client):
+            t0 = time.perf_counter()
+            session.get(url, timeout=10).raise_for_status()
+            local.append((time.perf_counter() - t0) * 1000.0)
+        with lock:
+            samples.extend(local)
+
+    threads = [threading.Thread(target=worker) for _ in range(clients)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return samples, len(samples) / (time.perf_counter() - t0)
+
+def report(name, samples, rps=None):
+    samples = sorted(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    extra = f" {rps:7.0f} req/s" if rps else ""
+    print(f"  {name:28s} n={len(samples):5d} mean={statistics.mean(samples):6.2f}ms "
+          f"p50={samples[len(samples) // 2]:6.2f}ms p99={p99:7.2f}ms{extra}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=1000)
+    parser.add_argument('-c', type=int, default=16)
+    parser.add_argument('--path', default='/getRecipe/3')
+    args = parser.parse_args()
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)  # 요청별 접근 로그 출력 생략
+    recipe_service.load_from_file()
+    conf = load_http_config('recipe_service')
+    start_dev(recipe_service.app, DEV_PORT)
+    start_waitress(recipe_service.app, WAITRESS_PORT, conf)
+    time.sleep(0.5)
+
+    for name, port in (("dev server", DEV_PORT), (f"waitress (threads={conf['threads']})", WAITRESS_PORT)):
+        url = f"http://127.0.0.1:{port}{args.path}"
+        sequential(url, 20, True)  # 워밍업
+        print(f"[Bench] {name} {url}")
+        report("sequential, new connection", *sequential(url, args.n, False))
+        report("sequential, keep-alive", *sequential(url, args.n, True))
+        report(f"concurrent x{args.c}, keep-alive", *concurrent(url, args.n, args.c))
+
+if __name__ == "__main__":
+    main()
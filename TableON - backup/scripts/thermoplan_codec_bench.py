@@ -0,0 +1,148 @@
+import os
+import random
+import sys
+import time
+
+# Thermoplan 코덱 검증 + 벤치마크
+# 기존 바이트 단위 구현(아래 legacy_*)과 thermoplan_codec 결과를 랜덤 입력으로 비교한 뒤 속도를 측정합니다.
+# 사용: python scripts/thermoplan_codec_bench.py [iterations]
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'devices', 'coffee_machine'))
+import thermoplan_codec as codec
+
+try:
+    import thermoplanAPI as api_pb2
+except ImportError:
+    api_pb2 = None
+
+# --- 기존 구현 (thermoplan.py 에서 옮겨온 코드) ---
+def legacy_crc16(message):
+    polynom = 0xC86C
+    crc = 0xFFFF
+    for byte in message:
+        crc ^= (byte << 8)
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = (crc << 1) ^ polynom
+            else:
+                crc <<= 1
+            crc &= 0xFFFF
+    return crc
+
+def legacy_escape(data):
+    transformed_data = bytearray()
+    for byte in data:
+        if byte == 0x10:
+            transformed_data.extend([0x10, 0x30])
+        elif byte == 0x02:
+            transformed_data.extend([0x10, 0x22])
+        elif byte == 0x03:
+            transformed_data.extend([0x10, 0x23])
+        else:
+            transformed_data.append(byte)
+    return bytes(transformed_data)
+
+def legacy_unescape(data):
+    i = 0
+    restored_data = bytearray()
+    while i < len(data):
+        if data[i] == 0x10 and i + 1 < len(data):
+            if data[i+1] == 0x30: restored_data.append(0x10)
+            elif data[i+1] == 0x22: restored_data.append(0x02)
+            elif data[i+1] == 0x23: restored_data.append(0x03)
+            else: restored_data.extend(data[i:i+2])
+            i += 1
+        else:
+            restored_data.append(data[i])
+        i += 1
+    return bytes(restored_data)
+
+def legacy_encode(payload):
+    message = bytearray(payload)
+    crc = legacy_crc16(message)
+    message.append((crc >> 8) & 0xFF)
+    message.append(crc & 0xFF)
+    return bytes([0x02]) + legacy_escape(message) + bytes([0x03])
+
+# --- 입력 생성 ---
+def random_payload(rng, max_len=64):
+    # 특수 바이트(0x02, 0x03, 0x10)가 자주 섞이도록 가중치를 줌
+    length = rng.randint(0, max_len)
+    out = bytearray()
+    for _ in range(length):
+        if rng.random() < 0.3:
+            out.append(rng.choice((0x02, 0x03, 0x10, 0x22, 0x23, 0x30)))
+        else:
+            out.append(rng.randint(0, 255))
+    return bytes(out)
+
+def fuzz(iterations, seed=1234):
+    rng = random.Random(seed)
+    for n in range(iterations):
+        data = random_payload(rng)
+        assert codec.crc16(data) == legacy_crc16(data), f"crc mismatch: {data.hex()}"
+        assert codec.escape(data) == legacy_escape(data), f"escape mismatch: {data.hex()}"
+        # 복원은 임의 바이트열(잘못된 이스케이프 포함)에 대해서도 기존과 같아야 함
+        assert codec.unescape(data) == legacy_unescape(data), f"unescape mismatch: {data.hex()}"
+        assert codec.encode_frame(data) == legacy_encode(data), f"frame mismatch: {data.hex()}"
+        payload, status = codec.decode_frame(codec.encode_frame(data)[1:-1])
+        assert payload == data, f"round trip failed ({status}): {data.hex()}"
+    print(f"[Fuzz] crc/escape/unescape/frame OK ({iterations} cases)")
+
+    if api_pb2 is None:
+        print("[Fuzz] thermoplanAPI not available, skip sequence header check")
+        return
+    kinds = ('force_rinse', 'get_product_list', 'get_active_events',
+             'get_available_product_ids', 'get_sw_version', 'get_nsf_compliant_cleaning')
+    cache = codec.RequestCache()
+    for n in range(iterations):
+        kind = rng.choice(kinds)
+        seq = rng.choice((0, 1, 127, 128, 16383, 16384, rng.randint(1, 2**31 - 1)))
+        request = api_pb2.ApiMessage()
+        request.sequence_id = seq
+        getattr(request, kind).SetInParent()
+
+        def build(kind=kind):
+            body = api_pb2.ApiMessage()
+            getattr(body, kind).SetInParent()
+            return body.SerializeToString()
+
+        assert cache.frame(kind, seq, build) == legacy_encode(request.SerializeToString()), f"{kind} seq={seq}"
+    print(f"[Fuzz] cached request frames OK ({iterations} cases)")
+
+def bench(label, func, inputs, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for data in inputs:
+            func(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    per_call = best / len(inputs) * 1e6
+    print(f"  {label:<24} {per_call:8.2f} us/call")
+    return per_call
+
+def run_bench(count=2000, seed=42):
+    rng = random.Random(seed)
+    inputs = [random_payload(rng, 48) for _ in range(count)]
+    framed = [codec.encode_frame(d)[1:-1] for d in inputs]
+
+    print(f"[Bench] {count} payloads (0~48 bytes)")
+    pairs = (
+        ("crc16", legacy_crc16, codec.crc16, inputs),
+        ("escape", legacy_escape, codec.escape, inputs),
+        ("unescape", legacy_unescape, codec.unescape, framed),
+        ("encode_frame", legacy_encode, codec.encode_frame, inputs),
+    )
+    for name, old, new, data in pairs:
+        t_old = bench(f"{name} (legacy)", old, data)
+        t_new = bench(f"{name} (codec)", new, data)
+        print(f"  -> x{t_old / t_new:.1f}")
+
+if __name__ == "__main__":
+    iterations = 5000
+    if len(sys.argv) > 1:
+        iterations = int(sys.argv[1])
+
+    fuzz(iterations)
+    run_bench()
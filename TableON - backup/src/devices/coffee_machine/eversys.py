@@ -2,13 +2,29 @@
 import serial
 import os
 import time
+import threading
 from . import eversysAPIList # eversysAPIList를 상대 경로로 임포트
 
+# 짝/홀 프레임 토글 상태 저장 파일 (eversys.py와 동일한 위치)
+PN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'PN.txt')
+
 class EversysCoffeeMachine:
     def __init__(self, port, baudrate):
         self.port = port
         self.baudrate = baudrate
-        print(f"[Coffee] Eversys machine initialized at {self.port}")
+
+        # 시리얼 세션 (첫 명령 시 열고 오류 전까지 유지)
+        self.ser = None
+        self.serial_lock = threading.Lock()
+
+        # 짝/홀 토글 상태는 메모리에서 관리하고 파일 저장은 백그라운드에서 처리
+        self.pn_lock = threading.Lock()
+        self.pn = self._load_pn()
+        self.pn_dirty = threading.Event()
+        self.pn_thread = threading.Thread(target=self._pn_writer_loop, daemon=True)
+        self.pn_thread.start()
+
+        print(f"[Coffee] Eversys machine initialized at {self.port} (PN={self.pn})")
 
     def make_coffee(self, product_num, duration):
         """Eversys 머신으로 커피를 제조합니다."""
@@ -21,22 +37,56 @@ class EversysCoffeeMachine:
             print(f"[Coffee][ERR] Eversys API call failed: {e}")
             return False, str(e)
 
-    def _send_api(self, product_num):
-        """Eversys API 데이터를 시리얼 포트로 전송합니다."""
-        # PN.txt 파일 경로를 현재 파일(eversys.py)과 동일한 위치로 고정
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        pn_path = os.path.join(base_dir, 'PN.txt')
-
-        if not os.path.exists(pn_path):
-            with open(pn_path, 'w', encoding='utf-8') as f:
-                f.write('0')
-        with open(pn_path, 'r+', encoding='utf-8') as pnFile:
-            raw = pnFile.read().strip()
-            PN = int(raw) if raw.isdigit() else 0
-            pnFile.seek(0); pnFile.write('1' if PN == 0 else '0'); pnFile.truncate()
-
-        apiData = eversysAPIList.getAPI(int(product_num)-1, PN)
-        
+    # =============================================
+    # --- 짝/홀(PN) 토글 상태 ---
+    # =============================================
+
+    def _load_pn(self):
+        """시작 시 1회 PN.txt에서 다음에 사용할 짝/홀 값을 읽습니다."""
+        try:
+            with open(PN_PATH, 'r', encoding='utf-8') as f:
+                raw = f.read().strip()
+            return int(raw) if raw in ('0', '1') else 0
+        except FileNotFoundError:
+            return 0
+        except Exception as e:
+            print(f"[Coffee][WARN] Failed to read PN.txt: {e}")
+            return 0
+
+    def _next_pn(self):
+        """현재 짝/홀 값을 반환하고 토글 (파일 저장은 백그라운드 스레드에 요청)"""
+        with self.pn_lock:
+            pn = self.pn
+            self.pn = 1 if pn == 0 else 0
+        self.pn_dirty.set()
+        return pn
+
+    def _save_pn(self):
+        """임시 파일에 쓴 뒤 교체 (중간에 꺼져도 파일이 깨지지 않음)"""
+        with self.pn_lock:
+            pn = self.pn
+        tmp_path = PN_PATH + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(str(pn))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, PN_PATH)
+
+    def _pn_writer_loop(self):
+        while True:
+            self.pn_dirty.wait()
+            self.pn_dirty.clear()
+            try:
+                self._save_pn()
+            except Exception as e:
+                print(f"[Coffee][WARN] Failed to persist PN.txt: {e}")
+                time.sleep(1.0)
+
+    # =============================================
+    # --- 시리얼 세션 ---
+    # =============================================
+
+    def _open_serial(self):
         ser = serial.Serial()
         ser.port = self.port
         ser.baudrate = self.baudrate
@@ -44,12 +94,51 @@ class EversysCoffeeMachine:
         ser.parity = serial.PARITY_NONE
         ser.stopbits = serial.STOPBITS_ONE
         ser.timeout = 0.3
-        
+        ser.write_timeout = 1.0
+        ser.open()
+        print(f"[Eversys] Serial session opened on {self.port}")
+        return ser
+
+    def _close_serial(self):
+        if self.ser:
+            try:
+                self.ser.close()
+            except:
+                pass
+            self.ser = None
+
+    def close(self):
+        """세션 종료 및 PN 상태 저장 (서비스 종료 시 호출)"""
+        with self.serial_lock:
+            self._close_serial()
         try:
-            ser.open()
-            ser.write(apiData)
-        finally:
-            ser.close()
+            self._save_pn()
+        except Exception as e:
+            print(f"[Coffee][WARN] Failed to persist PN.txt: {e}")
+
+    def _write_frame(self, apiData: bytes):
+        """열린 세션으로 프레임 전송. 전송 바이트 수 확인 + flush로 송신 완료까지 확인"""
+        MAX_RETRIES = 2
+        with self.serial_lock:
+            for attempt in range(MAX_RETRIES):
+                try:
+                    if not (self.ser and self.ser.is_open):
+                        self.ser = self._open_serial()
+                    written = self.ser.write(apiData)
+                    self.ser.flush()
+                    if written != len(apiData):
+                        raise serial.SerialException(f"Short write: {written}/{len(apiData)} bytes")
+                    return
+                except (serial.SerialException, OSError) as e:
+                    print(f"[Eversys] Serial error (attempt {attempt + 1}/{MAX_RETRIES}): {e}")
+                    self._close_serial()
+                    if attempt == MAX_RETRIES - 1:
+                        raise
+
+    def _send_api(self, product_num):
+        """Eversys API 데이터를 시리얼 포트로 전송합니다."""
+        apiData = eversysAPIList.FRAMES[self._next_pn()][int(product_num) - 1]
+        self._write_frame(apiData)
         print(f'[Eversys] API sent, product={product_num}')
 
     def execute_rinse(self):
@@ -60,17 +149,17 @@ class EversysCoffeeMachine:
             # 17: rinse left
             # 18: rinse left milk outlet
             # 19: rinse screen left
-            
+
             # 여기서는 기본적으로 'rinse left' (인덱스 17)를 수행합니다.
             # 필요에 따라 다른 린싱 모드를 선택할 수 있도록 수정 가능합니다.
-            RINSE_INDEX = 17 
-            
+            RINSE_INDEX = 17
+
             self._send_api(RINSE_INDEX + 1) # _send_api는 (product_num - 1)을 하므로 +1 해서 전달
-            
+
             # 린싱 소요 시간 대기 (약 10초로 가정, 필요시 조정)
             time.sleep(10)
-            
+
             return True, "Eversys rinse started"
         except Exception as e:
             print(f"[Coffee][ERR] Eversys rinse failed: {e}")
-            return False, str(e)
\ No newline at end of file
+            return False, str(e)
@@ -132,6 +132,12 @@ bytearray()
 ]
 
 
+# 전송용 불변 프레임 (모듈 로드 시 1회 생성): FRAMES[PN][apicode]
+FRAMES = (
+  tuple(bytes(frame) for frame in apiPNEven),
+  tuple(bytes(frame) for frame in apiPNOdd),
+)
+
 def getAPI(apicode, PN):
   apiData = bytearray()
   if int(PN) == 0:
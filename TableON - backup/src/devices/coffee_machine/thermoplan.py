@@ -1,5 +1,6 @@
 # devices/coffee_machine/thermoplan.py
 import json
+import queue
 import serial
 import time
 import threading
@@ -8,27 +9,42 @@ import os
 try:
     # 생성된 protobuf 모듈을 임포트합니다.
     import thermoplanAPI as api_pb2
+    import thermoplan_codec as codec
 except ImportError:
     # VSCode와 같은 환경에서 모듈을 직접 찾지 못할 경우를 대비하여
     # 현재 파일의 디렉토리를 sys.path에 추가합니다.
     import sys
     sys.path.append(os.path.dirname(__file__))
     import thermoplanAPI as api_pb2
-
-# --- 프로토콜 상수 (coffee.py 참조) ---
-STX = 0x02  # Start of Text
-ETX = 0x03  # End of Text
-DLE = 0x10  # Data Link Escape (참고용)
+    import thermoplan_codec as codec
+
+# --- 프로토콜 상수 (thermoplan_codec 참조) ---
+STX = codec.STX  # Start of Text
+ETX = codec.ETX  # End of Text
+DLE = codec.DLE  # Data Link Escape
+
+# 요청 없이 머신이 보내는 이벤트 메시지 (sequence_id 매칭 대상이 아님)
+EVENT_FIELDS = (
+    'error_event',
+    'product_finished',
+    'product_availability_changed',
+    'rinsing_upcoming',
+    'rinse_started',
+)
 
 class ThermoplanCoffeeMachine:
     """
     Thermoplan 커피 머신과의 시리얼 통신을 관리하는 클래스.
-    통신 시점에 포트를 열고 닫는 방식으로 안정성을 확보합니다.
+    포트를 한 번 열어 세션을 유지하고, 수신 스레드가 STX/ETX 프레임을 디코딩하여
+    sequence_id 기준으로 대기 중인 요청에 응답을 전달합니다.
     """
+    # 머신이 제품 시작/완료 이벤트를 보내줌 (device_service 추출 완료 감지용)
+    supports_product_events = True
+
     def __init__(self, port, baudrate=115200):
         """
         커피 머신 핸들러를 초기화합니다.
-        시리얼 포트는 통신 시점에 열고 닫습니다.
+        시리얼 포트는 첫 명령 시점에 열리고, 오류가 나기 전까지 유지됩니다.
         """
         self.port = port
         self.baudrate = baudrate
@@ -36,6 +52,25 @@ class ThermoplanCoffeeMachine:
         self.lock = threading.Lock()
         self.product_map = {}
 
+        # 시리얼 세션
+        self.ser = None
+        self.session_lock = threading.Lock()  # 포트 열기/닫기
+        self.write_lock = threading.Lock()    # 프레임 쓰기 직렬화
+        self.reader_thread = None
+
+        # sequence_id -> {'event': Event, 'response': ApiMessage}
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+
+        # 요청 없이 수신된 이벤트 (product_finished, error_event 등)
+        self.event_queue = queue.Queue(maxsize=100)
+
+        # 상수 요청(린스, 제품 목록 등) 직렬화 캐시
+        self.request_cache = codec.RequestCache()
+
+        # 제품 시작/완료 알림 콜백: listener(event_type, info)
+        self.event_listener = None
+
         try:
             # config.json 파일의 절대경로
             config_path = '/home/TableON/config/config.json' # 경로를 변수로 먼저 선언
@@ -48,163 +83,209 @@ class ThermoplanCoffeeMachine:
             print(f"[Coffee][FATAL] Could not load or parse config.json from '{config_path}': {e}")
             # self.product_map은 빈 dict {}로 유지됩니다.
 
+    def set_event_listener(self, listener):
+        """제품 이벤트(product_started, product_finished) 수신 콜백 등록"""
+        self.event_listener = listener
+
+    def _emit_product_event(self, event_type, info):
+        if not self.event_listener:
+            return
+        try:
+            self.event_listener(event_type, info)
+        except Exception as e:
+            print(f"[Coffee][WARN] Event listener error: {e}")
+
     def _get_next_sequence_id(self):
         """호출 시마다 1씩 증가하는 스레드 안전한 시퀀스 ID를 반환합니다."""
         with self.lock:
             self.sequence_id += 1
             return self.sequence_id
 
+    # =============================================
+    # --- 시리얼 세션 관리 ---
+    # =============================================
+
+    def _ensure_session(self):
+        """세션이 없으면 포트를 열고 수신 스레드를 시작합니다."""
+        with self.session_lock:
+            if self.ser and self.ser.is_open:
+                return self.ser
+
+            # RTS/DTR 비활성화로 I/O 에러 방지, read는 짧은 타임아웃으로 블로킹 대기
+            ser = serial.Serial(
+                self.port,
+                self.baudrate,
+                timeout=0.1,
+                rtscts=False,
+                dsrdtr=False
+            )
+            ser.reset_input_buffer()
+            self.ser = ser
+
+            self.reader_thread = threading.Thread(target=self._reader_loop, args=(ser,), daemon=True)
+            self.reader_thread.start()
+            print(f"[Coffee] Serial session opened on {self.port}")
+            return ser
+
+    def _close_session(self, reason="closed"):
+        """세션을 닫고 응답 대기 중인 요청을 모두 깨웁니다."""
+        with self.session_lock:
+            ser, self.ser = self.ser, None
+        if ser:
+            try:
+                ser.close()
+            except:
+                pass
+            print(f"[Coffee] Serial session closed: {reason}")
+
+        with self.pending_lock:
+            entries = list(self.pending.values())
+            self.pending.clear()
+        for entry in entries:
+            entry['error'] = reason
+            entry['event'].set()
+
+    def close(self):
+        """세션 종료 (서비스 종료 시 호출)"""
+        self._close_session("closed by user")
+
+    def _reader_loop(self, ser):
+        """
+        수신 스레드: 들어온 바이트를 모아 STX~ETX 프레임 단위로 잘라 디스패치합니다.
+        STX/ETX는 페이로드 안에서 항상 이스케이프되므로 구분자 검색만으로 프레임을 나눌 수 있습니다.
+        """
+        buffer = bytearray()
+        while True:
+            try:
+                chunk = ser.read(ser.in_waiting or 1)
+            except (serial.SerialException, OSError, TypeError) as e:
+                if self.ser is ser:
+                    print(f"[Coffee][ERR] Serial read failed: {e}")
+                    self._close_session(str(e))
+                return
+
+            if not chunk:
+                if self.ser is not ser:
+                    return
+                continue
+
+            buffer += chunk
+            while True:
+                end = buffer.find(ETX)
+                if end < 0:
+                    # 아직 ETX가 오지 않음 → 마지막 STX부터 보관
+                    start = buffer.rfind(STX)
+                    if start < 0:
+                        buffer.clear()
+                    elif start > 0:
+                        del buffer[:start]
+                    break
+
+                start = buffer.rfind(STX, 0, end)
+                if start >= 0:
+                    self._dispatch_frame(bytes(buffer[start + 1:end]))
+                del buffer[:end + 1]
+
+    def _dispatch_frame(self, framed_data: bytes):
+        """디코딩된 메시지를 sequence_id로 매칭하거나 이벤트 큐에 넣습니다."""
+        message, status = self._decode_frame(framed_data)
+        if message is None:
+            print(f"[Coffee][WARN] Dropped frame: {status}")
+            return
+
+        kind = message.WhichOneof('api_message')
+        if kind in EVENT_FIELDS:
+            if kind == 'product_finished':
+                finished = message.product_finished
+                self._emit_product_event('product_finished', {
+                    'product_id': finished.product_id,
+                    'success': finished.success,
+                })
+            try:
+                self.event_queue.put_nowait(message)
+            except queue.Full:
+                # 아무도 소비하지 않으면 가장 오래된 이벤트를 버림
+                try:
+                    self.event_queue.get_nowait()
+                except queue.Empty:
+                    pass
+                self.event_queue.put_nowait(message)
+            return
+
+        with self.pending_lock:
+            entry = self.pending.pop(message.sequence_id, None)
+            if entry is None and message.sequence_id == 0 and self.pending:
+                # sequence_id를 돌려주지 않는 응답(0) → 가장 오래된 요청에 전달
+                # (0이 아닌데 매칭되지 않으면 타임아웃된 요청의 늦은 응답이므로 버림)
+                entry = self.pending.pop(min(self.pending))
+        if entry is None:
+            print(f"[Coffee][WARN] Unmatched response (seq={message.sequence_id}, type={kind}), dropped")
+            return
+        entry['response'] = message
+        entry['event'].set()
+
     def _execute_command(self, request_message: api_pb2.ApiMessage, response_timeout=5.0):
+        """요청 메시지를 직렬화하여 전송하고 응답을 기다립니다."""
+        frame = self._encode_request(request_message)
+        return self._execute_frame(request_message.sequence_id, frame, response_timeout)
+
+    def _execute_frame(self, seq, frame, response_timeout=5.0):
         """
-        시리얼 포트를 열고, 명령을 보내고, 응답을 받고, 포트를 닫는 전체 과정을 관리합니다.
-        이 함수는 스레드에 안전합니다.
+        요청 프레임을 열린 세션으로 보내고, 같은 sequence_id의 응답이 올 때까지 대기합니다.
+        여러 스레드가 동시에 요청해도 응답은 sequence_id로 구분됩니다.
         """
         MAX_RETRIES = 3
-        
+
         for attempt in range(MAX_RETRIES):
-            with self.lock:
-                ser = None
-                try:
-                    # 1. 시리얼 포트 열기 (RTS/DTR 비활성화로 I/O 에러 방지)
-                    ser = serial.Serial(
-                        self.port, 
-                        self.baudrate, 
-                        timeout=1,
-                        rtscts=False,
-                        dsrdtr=False
-                    )
-                    
-                    # 2. 요청 전송
-                    ok, msg = self._send_request(ser, request_message)
-                    if not ok:
-                        return None, msg
-
-                    # 3. 응답 수신
-                    return self._receive_response(ser, timeout=response_timeout)
-
-                except (serial.SerialException, OSError) as e:
-                    print(f"[Coffee] Serial error (attempt {attempt + 1}/{MAX_RETRIES}): {e}")
-                    if attempt < MAX_RETRIES - 1:
-                        time.sleep(0.5)  # 재시도 전 대기
-                        continue
-                    print(f"[Coffee][FATAL] All retries failed")
-                    return None, str(e)
-                finally:
-                    # 4. 시리얼 포트 닫기
-                    if ser and ser.is_open:
-                        try:
-                            ser.close()
-                        except:
-                            pass
-        
+            entry = {'event': threading.Event(), 'response': None, 'error': None}
+            with self.pending_lock:
+                self.pending[seq] = entry
+
+            try:
+                ser = self._ensure_session()
+                with self.write_lock:
+                    ser.write(frame)
+            except (serial.SerialException, OSError) as e:
+                with self.pending_lock:
+                    self.pending.pop(seq, None)
+                print(f"[Coffee] Serial error (attempt {attempt + 1}/{MAX_RETRIES}): {e}")
+                self._close_session(str(e))
+                if attempt < MAX_RETRIES - 1:
+                    time.sleep(0.5)  # 재시도 전 대기
+                    continue
+                print(f"[Coffee][FATAL] All retries failed")
+                return None, str(e)
+
+            if not entry['event'].wait(response_timeout):
+                with self.pending_lock:
+                    self.pending.pop(seq, None)
+                return None, "Response timeout"
+
+            if entry['response'] is not None:
+                return entry['response'], "Success"
+
+            # 응답 대기 중 세션이 끊김 → 새 세션으로 재시도
+            print(f"[Coffee] Session lost while waiting (attempt {attempt + 1}/{MAX_RETRIES}): {entry['error']}")
+            if attempt < MAX_RETRIES - 1:
+                time.sleep(0.5)
+                continue
+            return None, entry['error'] or "Session lost"
+
         return None, "Max retries exceeded"
 
     # =============================================
     # --- 핵심 통신 로직 (내부 헬퍼 함수) ---
     # =============================================
 
-    def _crc16(self, message: bytes) -> int:
-        """CRC-16 계산"""
-        polynom = 0xC86C
-        crc = 0xFFFF
-        for byte in message:
-            crc ^= (byte << 8)
-            for _ in range(8):
-                if crc & 0x8000:
-                    crc = (crc << 1) ^ polynom
-                else:
-                    crc <<= 1
-                crc &= 0xFFFF
-        return crc
-
-    def _apply_custom_transformation(self, data: bytes) -> bytes:
-        """이스케이프 처리"""
-        transformed_data = bytearray()
-        for byte in data:
-            if byte == 0x10:
-                transformed_data.extend([0x10, 0x30])
-            elif byte == 0x02:
-                transformed_data.extend([0x10, 0x22])
-            elif byte == 0x03:
-                transformed_data.extend([0x10, 0x23])
-            else:
-                transformed_data.append(byte)
-        return bytes(transformed_data)
-
-    def _finalize_message(self, data: bytes) -> bytes:
-        """STX, ETX 추가"""
-        return bytes([STX]) + data + bytes([ETX])
-
-    def _send_request(self, ser: serial.Serial, request: api_pb2.ApiMessage):
-        """Protobuf 요청을 전송 가능한 바이트 스트림으로 변환하여 전송"""
-        ser.reset_input_buffer()
-        
-        message = bytearray(request.SerializeToString())
-        crc = self._crc16(message)
-        message.append((crc >> 8) & 0xFF)
-        message.append(crc & 0xFF)
+    def _encode_request(self, request: api_pb2.ApiMessage) -> bytes:
+        """Protobuf 요청을 전송 가능한 바이트 스트림으로 변환 (CRC/이스케이프는 codec 사용)"""
+        return codec.encode_frame(request.SerializeToString())
 
-        transformed = self._apply_custom_transformation(message)
-        final_message = self._finalize_message(transformed)
-
-        try:
-            ser.write(final_message)
-            return True, "Command sent"
-        except serial.SerialException as e:
-            print(f"[Coffee][ERR] Failed to write to serial port: {e}")
-            return False, str(e)
-
-    def _reverse_custom_transformation(self, data: bytes) -> bytes:
-        """이스케이프된 값 복원"""
-        i = 0
-        restored_data = bytearray()
-        while i < len(data):
-            if data[i] == 0x10 and i + 1 < len(data):
-                if data[i+1] == 0x30: restored_data.append(0x10)
-                elif data[i+1] == 0x22: restored_data.append(0x02)
-                elif data[i+1] == 0x23: restored_data.append(0x03)
-                else: restored_data.extend(data[i:i+2])
-                i += 1
-            else:
-                restored_data.append(data[i])
-            i += 1
-        return bytes(restored_data)
-
-    def _receive_response(self, ser: serial.Serial, timeout=5.0):
-        """머신으로부터 응답을 수신하고 파싱"""
-        raw_response = bytearray()
-        start_time = time.time()
-        
-        stx_found = False
-        while time.time() - start_time < timeout:
-            if ser.in_waiting > 0:
-                byte = ser.read(1)
-                if byte == bytes([STX]):
-                    stx_found = True
-                    break
-        if not stx_found: return None, "STX not found"
-
-        in_escape = False
-        while time.time() - start_time < timeout:
-            if ser.in_waiting > 0:
-                byte = ser.read(1)
-                raw_response.extend(byte)
-                if byte == bytes([ETX]) and not in_escape: break
-                in_escape = byte == bytes([DLE]) and not in_escape
-        
-        if not raw_response.endswith(bytes([ETX])): return None, "No ETX or timeout"
-
-        framed_data = raw_response[:-1]
-        transformed_data = self._reverse_custom_transformation(framed_data)
-
-        if len(transformed_data) < 2: return None, "Response too short"
-
-        received_crc = (transformed_data[-2] << 8) | transformed_data[-1]
-        payload = transformed_data[:-2]
-        calculated_crc = self._crc16(payload)
-
-        if received_crc != calculated_crc:
-            return None, f"CRC mismatch! Recv: {received_crc:04x}, Calc: {calculated_crc:04x}"
+    def _decode_frame(self, framed_data: bytes):
+        """STX/ETX를 뗀 프레임을 복원하고 CRC 검증 후 파싱"""
+        payload, status = codec.decode_frame(framed_data)
+        if payload is None:
+            return None, status
 
         try:
             response_message = api_pb2.ApiMessage()
@@ -213,6 +294,19 @@ class ThermoplanCoffeeMachine:
         except Exception as e:
             return None, f"Protobuf parsing error: {e}"
 
+    @staticmethod
+    def _build_constant_body(kind):
+        """파라미터 없는 요청의 본문(sequence_id 제외) 직렬화"""
+        request = api_pb2.ApiMessage()
+        getattr(request, kind).SetInParent()
+        return request.SerializeToString()
+
+    def _execute_constant(self, kind, response_timeout=5.0):
+        """캐시된 본문에 sequence_id만 붙여 상수 요청을 전송"""
+        seq = self._get_next_sequence_id()
+        frame = self.request_cache.frame(kind, seq, lambda: self._build_constant_body(kind))
+        return self._execute_frame(seq, frame, response_timeout)
+
     # =============================================
     # --- 공개 API 메소드 ---
     # =============================================
@@ -243,6 +337,8 @@ class ThermoplanCoffeeMachine:
         if not response.HasField("product_started"):
             return False, f"Received unexpected response type: {response}"
 
+        self._emit_product_event('product_started', {'product_id': product_id_str})
+
         print(f"[Thermoplan] Waiting for extraction duration: {duration}s")
         time.sleep(duration)
         
@@ -251,10 +347,7 @@ class ThermoplanCoffeeMachine:
 
     def execute_rinse(self):
         """강제 헹굼"""
-        request = self._create_base_request()
-        request.force_rinse.SetInParent()
-
-        response, status = self._execute_command(request, response_timeout=10.0)
+        response, status = self._execute_constant('force_rinse', response_timeout=10.0)
         if not response:
             return False, f"No valid response after rinse command: {status}"
 
@@ -277,24 +370,16 @@ class ThermoplanCoffeeMachine:
 
     def get_product_list(self):
         """사용 가능한 제품 목록 요청"""
-        request = self._create_base_request()
-        request.get_product_list.SetInParent()
-        return self._execute_command(request)
+        return self._execute_constant('get_product_list')
 
     def get_available_product_ids(self):
-        request = self._create_base_request()
-        request.get_available_product_ids.SetInParent()
-        return self._execute_command(request)
+        return self._execute_constant('get_available_product_ids')
 
     def get_active_events(self):
-        request = self._create_base_request()
-        request.get_active_events.SetInParent()
-        return self._execute_command(request)
+        return self._execute_constant('get_active_events')
 
     def force_rinse(self):
-        request = self._create_base_request()
-        request.force_rinse.SetInParent()
-        return self._execute_command(request)
+        return self._execute_constant('force_rinse')
 
     def postpone_rinse(self, milliseconds: int):
         request = self._create_base_request()
@@ -303,14 +388,10 @@ class ThermoplanCoffeeMachine:
         return self._execute_command(request)
 
     def get_sw_version(self):
-        request = self._create_base_request()
-        request.get_sw_version.SetInParent()
-        return self._execute_command(request)
+        return self._execute_constant('get_sw_version')
 
     def get_nsf_compliant_cleaning(self):
-        request = self._create_base_request()
-        request.get_nsf_compliant_cleaning.SetInParent()
-        return self._execute_command(request)
+        return self._execute_constant('get_nsf_compliant_cleaning')
 
 
 if __name__ == '__main__':
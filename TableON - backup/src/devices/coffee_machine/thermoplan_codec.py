@@ -0,0 +1,161 @@
+# devices/coffee_machine/thermoplan_codec.py
+"""
+Thermoplan RS232 프레이밍 코덱
+- CRC-16 (poly 0xC86C, init 0xFFFF): 256 엔트리 테이블 방식
+- DLE 이스케이프/복원: 바이트 단위 루프 대신 bytes.replace / split 사용
+- 상수 요청(린스, 제품 목록, 활성 이벤트 등)의 직렬화 본문 캐시
+protobuf에 의존하지 않으므로 드라이버 밖(벤치마크, 테스트 도구)에서도 그대로 사용할 수 있습니다.
+"""
+import threading
+
+STX = 0x02  # Start of Text
+ETX = 0x03  # End of Text
+DLE = 0x10  # Data Link Escape
+
+_STX_BYTES = bytes([STX])
+_ETX_BYTES = bytes([ETX])
+_DLE_BYTES = bytes([DLE])
+_SPECIAL_BYTES = bytes([DLE, STX, ETX])
+
+# 이스케이프 코드 (DLE 다음 바이트) -> 원래 바이트
+_UNESCAPE_MAP = {0x30: bytes([DLE]), 0x22: bytes([STX]), 0x23: bytes([ETX])}
+
+CRC_POLYNOM = 0xC86C
+CRC_INIT = 0xFFFF
+
+
+def _build_crc_table(polynom=CRC_POLYNOM):
+    """상위 바이트 기준 CRC-16 테이블 생성 (모듈 로드 시 1회)"""
+    table = []
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = (crc << 1) ^ polynom
+            else:
+                crc <<= 1
+            crc &= 0xFFFF
+        table.append(crc)
+    return tuple(table)
+
+CRC_TABLE = _build_crc_table()
+
+
+def crc16(data, crc=CRC_INIT) -> int:
+    """CRC-16 계산 (테이블 방식, 바이트당 1회 조회)"""
+    table = CRC_TABLE
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFF) ^ table[(crc >> 8) ^ byte]
+    return crc
+
+
+def escape(data) -> bytes:
+    """DLE/STX/ETX 이스케이프 처리 (DLE를 먼저 치환해야 이중 이스케이프가 생기지 않음)"""
+    data = bytes(data)
+    # 특수 바이트가 없으면 그대로 반환 (대부분의 요청이 여기에 해당)
+    if len(data.translate(None, _SPECIAL_BYTES)) == len(data):
+        return data
+    return (data.replace(b'\x10', b'\x10\x30')
+                .replace(b'\x02', b'\x10\x22')
+                .replace(b'\x03', b'\x10\x23'))
+
+
+def unescape(data) -> bytes:
+    """
+    이스케이프된 값 복원.
+    DLE 다음 바이트가 알 수 없는 코드면 두 바이트를 그대로 두고, 끝에 남은 DLE도 그대로 둡니다.
+    (기존 바이트 단위 구현과 동일한 결과)
+    """
+    data = bytes(data)
+    if DLE not in data:
+        return data
+
+    parts = data.split(_DLE_BYTES)
+    out = [parts[0]]
+    last = len(parts) - 1
+    i = 1
+    while i <= last:
+        part = parts[i]
+        if part:
+            restored = _UNESCAPE_MAP.get(part[0])
+            if restored is not None:
+                out.append(restored)
+                out.append(part[1:])
+            else:
+                out.append(_DLE_BYTES)
+                out.append(part)
+        elif i == last:
+            # 끝에 홀로 남은 DLE
+            out.append(_DLE_BYTES)
+        else:
+            # DLE DLE: 두 번째 DLE는 알 수 없는 코드로 취급되어 그대로 남고,
+            # 다음 조각은 이스케이프 코드 없이 이어짐
+            out.append(_DLE_BYTES + _DLE_BYTES)
+            out.append(parts[i + 1])
+            i += 1
+        i += 1
+    return b''.join(out)
+
+
+def encode_frame(payload) -> bytes:
+    """페이로드 + CRC(빅엔디안 2바이트) → 이스케이프 → STX/ETX"""
+    payload = bytes(payload)
+    crc = crc16(payload)
+    return _STX_BYTES + escape(payload + bytes([(crc >> 8) & 0xFF, crc & 0xFF])) + _ETX_BYTES
+
+
+def decode_frame(framed_data):
+    """
+    STX/ETX를 뗀 프레임을 복원하고 CRC를 검증합니다.
+    반환: (payload, "Success") 또는 (None, 에러 메시지)
+    """
+    transformed_data = unescape(framed_data)
+
+    if len(transformed_data) < 2: return None, "Response too short"
+
+    received_crc = (transformed_data[-2] << 8) | transformed_data[-1]
+    payload = transformed_data[:-2]
+    calculated_crc = crc16(payload)
+
+    if received_crc != calculated_crc:
+        return None, f"CRC mismatch! Recv: {received_crc:04x}, Calc: {calculated_crc:04x}"
+    return payload, "Success"
+
+
+def sequence_header(sequence_id: int) -> bytes:
+    """
+    ApiMessage.sequence_id (field 2, varint) 인코딩.
+    protobuf는 필드 번호 순서로 직렬화하므로 이 헤더 + 나머지 본문 = 전체 직렬화 결과입니다.
+    proto3 기본값(0)은 직렬화되지 않습니다.
+    """
+    if sequence_id <= 0:
+        return b''
+    out = bytearray(b'\x10')
+    value = sequence_id
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+class RequestCache:
+    """
+    상수 요청의 직렬화 본문(sequence_id 제외)을 한 번만 만들어 두는 캐시.
+    요청마다 sequence_id 헤더만 붙여 프레임을 만듭니다.
+    """
+    def __init__(self):
+        self._bodies = {}
+        self._lock = threading.Lock()
+
+    def body(self, kind, build_body) -> bytes:
+        cached = self._bodies.get(kind)
+        if cached is None:
+            with self._lock:
+                cached = self._bodies.get(kind)
+                if cached is None:
+                    cached = self._bodies[kind] = bytes(build_body())
+        return cached
+
+    def frame(self, kind, sequence_id, build_body) -> bytes:
+        return encode_frame(sequence_header(sequence_id) + self.body(kind, build_body))
@@ -0,0 +1,141 @@
+# devices/ice_machine/dispense_session.py
+"""
+제빙기 공용 시리얼 세션 + 토출 명령 큐
+- 포트는 첫 명령 시 열고 오류가 나기 전까지 유지 (write 바이트 수 확인 + flush)
+- 토출 명령은 전용 스레드에서 순서대로 실행하고, 호출측에는 예상 완료 시각이 담긴 ticket을 즉시 반환
+- ticket['sent']: 명령 전송(토출 시작) 완료, ticket['done']: 토출 구간 종료
+"""
+import queue
+import threading
+import time
+
+import serial
+
+class DispenseSession:
+    def __init__(self, name, port, baudrate):
+        self.name = name
+        self.port = port
+        self.baudrate = baudrate
+        self.ser = None
+        self.serial_lock = threading.Lock()
+
+        self.queue = queue.Queue()
+        self.ticket_counter = 0
+        self.busy_until = 0.0   # 현재 진행 중인 토출의 예상 종료 시각
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    # =============================================
+    # --- 시리얼 세션 ---
+    # =============================================
+
+    def _open_serial(self):
+        ser = serial.Serial(
+            port=self.port,
+            baudrate=self.baudrate,
+            bytesize=serial.EIGHTBITS,
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_ONE,
+            timeout=0.3,
+            write_timeout=1.0
+        )
+        print(f"[{self.name}] Serial session opened on {self.port}")
+        return ser
+
+    def _close_serial(self):
+        if self.ser:
+            try:
+                self.ser.close()
+            except:
+                pass
+            self.ser = None
+
+    def close(self):
+        with self.serial_lock:
+            self._close_serial()
+
+    def write(self, data: bytes):
+        """열린 세션으로 전송. 오류 시 포트를 다시 열어 1회 재시도"""
+        MAX_RETRIES = 2
+        with self.serial_lock:
+            for attempt in range(MAX_RETRIES):
+                try:
+                    if not (self.ser and self.ser.is_open):
+                        self.ser = self._open_serial()
+                    written = self.ser.write(data)
+                    self.ser.flush()
+                    if written != len(data):
+                        raise serial.SerialException(f"Short write: {written}/{len(data)} bytes")
+                    return
+                except (serial.SerialException, OSError) as e:
+                    print(f"[{self.name}] Serial error (attempt {attempt + 1}/{MAX_RETRIES}): {e}")
+                    self._close_serial()
+                    if attempt == MAX_RETRIES - 1:
+                        raise
+
+    # =============================================
+    # --- 토출 명령 큐 ---
+    # =============================================
+
+    def submit(self, start, duration, window=None, on_done=None):
+        """
+        토출 명령 등록 (즉시 반환).
+        start(): 명령 전송 (예외 시 실패), window(ticket): 토출 구간 처리 (없으면 duration만큼 대기)
+        on_done(ticket): 토출 구간 종료 시 세션 스레드에서 호출
+        """
+        now = time.time()
+        with self.lock:
+            self.ticket_counter += 1
+            # 앞선 토출이 끝난 뒤 시작하므로 대기 중인 명령의 종료 시각부터 계산
+            begin = max(now, self.busy_until)
+            self.busy_until = begin + duration
+            ticket = {
+                'id': self.ticket_counter,
+                'duration': duration,
+                'submitted_at': now,
+                'estimated_done_at': self.busy_until,
+                'ok': None,
+                'message': None,
+                'sent': threading.Event(),
+                'done': threading.Event(),
+            }
+        self.queue.put((ticket, start, window, on_done))
+        return ticket
+
+    def _loop(self):
+        while True:
+            ticket, start, window, on_done = self.queue.get()
+            try:
+                start()
+                ticket['ok'], ticket['message'] = True, "sent"
+                # 실제 전송 시각 기준으로 예상 종료 시각 갱신
+                ticket['estimated_done_at'] = time.time() + ticket['duration']
+                with self.lock:
+                    if self.queue.empty():
+                        self.busy_until = ticket['estimated_done_at']
+            except Exception as e:
+                print(f"[{self.name}][ERR] Dispense command failed: {e}")
+                ticket['ok'], ticket['message'] = False, str(e)
+                ticket['estimated_done_at'] = time.time()
+            ticket['sent'].set()
+
+            if ticket['ok']:
+                try:
+                    if window:
+                        window(ticket)
+                    else:
+                        remaining = ticket['estimated_done_at'] - time.time()
+                        if remaining > 0:
+                            time.sleep(remaining)
+                except Exception as e:
+                    print(f"[{self.name}][ERR] Dispense window failed: {e}")
+                    ticket['ok'], ticket['message'] = False, str(e)
+
+            ticket['done_at'] = time.time()
+            ticket['done'].set()
+            if on_done:
+                try:
+                    on_done(ticket)
+                except Exception as e:
+                    print(f"[{self.name}][WARN] on_done callback error: {e}")
@@ -1,9 +1,17 @@
 # devices/ice_machine/nakajo.py
-import serial
 import time
 import requests
+from .dispense_session import DispenseSession
+
+# 시리얼 준비 명령 후 게이트를 열기 전까지 대기 / 게이트 닫은 후 여유 시간
+PREPARE_SEC = 0.3
+GATE_CLOSE_SETTLE_SEC = 0.2
+DISPENSE_TIMEOUT_MARGIN_SEC = 10.0
 
 class NakajoIceMachine:
+    # 게이트(DO 5:3200)를 드라이버가 io_service 펄스로 여닫으므로 device_service의 버튼 펄스가 필요 없음
+    needs_button_press = False
+
     def __init__(self, port, baudrate, io_url):
         self.port = port
         self.baudrate = baudrate
@@ -11,58 +19,82 @@ class NakajoIceMachine:
         # Nakajo 제어를 위한 IO 보드 주소 (필요 시 config.json으로 이동 가능)
         self.unit_ice_switch = 5
         self.addr_ice_switch = 3200
+        self.http = requests.Session()
+        self.session = DispenseSession('Nakajo', port, baudrate)
         print(f"[Ice] Nakajo machine initialized at port {self.port}")
 
-    def make_ice_water(self, ice_sec, water_sec):
-        """Nakajo 장비로 얼음과 물을 배출합니다."""
+    def dispense_async(self, ice_sec, water_sec, on_done=None):
+        """
+        토출 명령을 큐에 넣고 즉시 ticket을 반환합니다.
+        시리얼 준비 명령 → 게이트 펄스(ice/water 중 큰 값, 닫힘은 io_service가 처리) 순서로 세션 스레드에서 실행됩니다.
+        """
         print(f"[Ice] Making ice/water with Nakajo: ice={ice_sec}, water={water_sec}")
-        try:
+        api = self._build_frame(ice_sec, water_sec)
+        gate_open_duration = max(float(ice_sec), float(water_sec))
+
+        def _start():
             # 1. 시리얼 통신으로 제빙기에 얼음/물 준비 명령
-            self._send_api(ice_sec, water_sec)
-            time.sleep(0.3)
+            self.session.write(api)
+            print(f'[Nakajo] API sent: ice={ice_sec}, water={water_sec}')
+            time.sleep(PREPARE_SEC)
+
+        def _window(ticket):
+            # 2. IO서버 펄스로 게이트 열림 → duration 후 닫힘
+            #    닫힘을 io_service가 처리하므로 device_service가 중간에 죽어도 게이트가 열린 채로 남지 않음
+            if not self._pulse_gate(gate_open_duration):
+                raise RuntimeError("Failed to pulse gate")
+            time.sleep(GATE_CLOSE_SETTLE_SEC)
 
-            # 2. IO서버를 통해 게이트를 열어 배출
-            gate_open_duration = max(float(ice_sec), float(water_sec))
-            self._open_gate(gate_open_duration)
-            time.sleep(0.2)
-            
+        return self.session.submit(_start, gate_open_duration, window=_window, on_done=on_done)
+
+    def make_ice_water(self, ice_sec, water_sec):
+        """Nakajo 장비로 얼음과 물을 배출합니다. (게이트가 닫힐 때까지 대기)"""
+        try:
+            ticket = self.dispense_async(ice_sec, water_sec)
+            timeout = ticket['estimated_done_at'] - time.time() + DISPENSE_TIMEOUT_MARGIN_SEC
+            if not ticket['done'].wait(timeout):
+                return False, "Nakajo dispense timeout"
+            if not ticket['ok']:
+                return False, ticket['message']
             return True, "Nakajo water/ice done"
         except Exception as e:
             print(f"[Ice][ERR] Nakajo operation failed: {e}")
             return False, str(e)
 
-    def _send_api(self, ice_time, water_time):
-        """Nakajo 제빙기에 시리얼 명령을 전송합니다."""
-        # Nakajo 프로토콜에 맞는 바이트 배열 생성
+    def close(self):
+        """시리얼 세션 종료 (서비스 종료 시 호출)"""
+        self.session.close()
+
+    def _build_frame(self, ice_time, water_time):
+        """Nakajo 프로토콜에 맞는 바이트 배열 생성"""
         api = bytearray(b'\x02\x01\xb0\x00\x00\x00\x03')
         api[3] = int(ice_time) * 16
         api[4] = int(water_time) * 16
         api[5] = self._xor_checksum(api[1], api[2], api[3], api[4])
-
-        ser = serial.Serial(
-            port=self.port,
-            baudrate=self.baudrate,
-            bytesize=serial.EIGHTBITS,
-            parity=serial.PARITY_NONE,
-            stopbits=serial.STOPBITS_ONE,
-            timeout=0.3
-        )
-        try:
-            ser.write(api)
-        finally:
-            ser.close()
-        print(f'[Nakajo] API sent: ice={ice_time}, water={water_time}')
+        return bytes(api)
 
     def _xor_checksum(self, b1, b2, b3, b4):
         """API 전송에 필요한 체크섬을 계산합니다."""
         return (b1 ^ b2 ^ b3 ^ b4) & 0xFF
 
-    def _open_gate(self, duration):
-        """IO 서버를 호출하여 얼음/물 배출 게이트를 엽니다."""
+    def _pulse_gate(self, duration):
+        """IO 서버를 호출하여 얼음/물 배출 게이트를 duration초 동안 엽니다. (닫힐 때까지 블록)"""
         try:
             url = f"{self.io_url}/coil/pulse/{self.unit_ice_switch}/{self.addr_ice_switch}/{duration}"
-            r = requests.get(url, timeout=180.0)
+            r = self.http.get(url, timeout=duration + DISPENSE_TIMEOUT_MARGIN_SEC)
+            return r.status_code == 200
+        except Exception as e:
+            print(f'[Ice][ERR] Failed to pulse gate via IO server: {e}')
+            # 응답을 못 받은 경우에도 게이트가 닫히도록 한 번 더 닫힘 요청
+            self._set_gate(0)
+            return False
+
+    def _set_gate(self, value):
+        """IO 서버를 호출하여 얼음/물 배출 게이트를 열거나(1) 닫습니다(0)."""
+        try:
+            url = f"{self.io_url}/coil/write/{self.unit_ice_switch}/{self.addr_ice_switch}/{value}"
+            r = self.http.get(url, timeout=5.0)
             return r.status_code == 200
         except Exception as e:
-            print(f'[Ice][ERR] Failed to open gate via IO server: {e}')
-            return False
\ No newline at end of file
+            print(f'[Ice][ERR] Failed to set gate via IO server: {e}')
+            return False
@@ -4,6 +4,7 @@ import requests
 import time
 import json
 import os
+import sys
 from datetime import datetime
 import openpyxl
 from openpyxl.utils import get_column_letter
@@ -17,6 +18,19 @@ LOG_DIR = os.path.join(BASE_DIR, '..', '..', '..', 'logs') # 로그 저장 디
 LAST_DATETIME_FILE = os.path.join(BASE_DIR, 'easypos_last_datetime.txt') # 키오스크별 파일 분리
 ORDER_SERVER_URL = 'http://localhost:8100' # 주문 서버 URL 고정
 
+sys.path.append(os.path.join(BASE_DIR, '..', '..', 'services'))
+from recipe_client import RecipeClient
+
+# 메뉴 정보 캐시 (레시피 버전이 바뀔 때만 다시 로드)
+menu_cache = {'menu': {}}
+
+def on_menu(recipes, version):
+    """레시피 버전이 바뀌면 메뉴 정보 교체"""
+    menu_cache['menu'] = {r['menu_code']: r['menu_name'] for r in recipes}
+    print(f"[INFO] 레시피 버전 {version}, 메뉴 {len(menu_cache['menu'])}개")
+
+menu_client = RecipeClient(on_menu, 'Kiosk')
+
 # --- 함수 정의 ---
 
 def log_orders_to_excel(orders_list):
@@ -74,14 +88,21 @@ def load_db_config():
         return None
 
 def get_menu_info():
-    """레시피 파일에서 메뉴 코드와 메뉴 이름을 매핑한 딕셔너리를 반환합니다."""
+    """캐시된 메뉴 코드 → 메뉴 이름 딕셔너리를 반환합니다. (비어 있으면 다시 로드)"""
+    if not menu_cache['menu']:
+        load_menu_info()
+    return menu_cache['menu']
+
+def load_menu_info():
+    """레시피 서버에서 로드 (응답이 없으면 레시피 파일)"""
+    if menu_client.sync():
+        return
     try:
         with open(RECIPE_PATH, 'r', encoding='utf-8') as f:
             recipes = json.load(f)
-        return {r['menu_code']: r['menu_name'] for r in recipes}
+        menu_cache['menu'] = {r['menu_code']: r['menu_name'] for r in recipes}
     except Exception as e:
         print(f"[ERROR] 레시피 파일 처리 실패: {e}")
-        return {}
 
 def get_last_processed_time():
     """마지막 처리 시간을 파일에서 읽어옵니다."""
@@ -173,6 +194,9 @@ if __name__ == "__main__":
         print("[FATAL] EasyPOS DB 설정을 찾을 수 없어 프로그램을 종료합니다.")
         exit(1)
 
+    load_menu_info()
+    menu_client.watch()
+
     while True:
         try:
             menu_info = get_menu_info()
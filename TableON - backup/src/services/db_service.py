@@ -151,4 +151,5 @@ def log_event():
 # --------------------------------------------------------------------------- #
 if __name__ == '__main__':
     # 서비스 포트 맵핑 규칙에 따라 8800 포트 사용
-    app.run(host='0.0.0.0', port=8800, debug=False)
+    from http_server import serve
+    serve(app, 'db_service', 8800)
@@ -1,6 +1,7 @@
 from flask import Flask, jsonify, request
 import time, requests, json, importlib, sys, os
-import threading
+import threading, heapq
+from collections import OrderedDict
 
 # 프로젝트의 루트 경로(src의 부모)를 python 경로에 추가
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
@@ -15,6 +16,29 @@ coffee_status = 0
 CONFIG_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'config', 'config.json')
 SIMULATION_MODE = False
 
+# ---- 커피 추출 사이클 (제품 시작/완료 이벤트 추적) ----
+# ref(요청 측 식별자) -> {'state': requested|started|finished|failed, 'product_id', 'requested_at', 'started_at', 'finished_at'}
+COFFEE_CYCLE_MAX = 50
+coffee_cycles = OrderedDict()
+coffee_cycle_cond = threading.Condition()
+
+# ---- 장비 작업(Job) ----
+# job_id -> {'id', 'device', 'kind', 'params', 'status': queued|running|done|failed, 'result', 'created_at', 'started_at', 'finished_at'}
+JOB_HISTORY_MAX = 200
+JOB_SYNC_TIMEOUT = 200.0  # 동기/long-poll 엔드포인트 최대 대기 (기존 호출측 타임아웃 180s 이상, http_server channel_timeout 미만)
+ICE_SEND_TIMEOUT = 10.0   # 제빙기 명령 전송 확인 최대 대기
+jobs = OrderedDict()
+jobs_cond = threading.Condition()
+job_counter = 0
+device_workers = {}
+device_workers_lock = threading.Lock()
+
+# 작업 우선순위 (작을수록 먼저 실행): 제품 추출 > 린스 등 관리 작업
+PRIORITY_PRODUCT = 0
+PRIORITY_HOUSEKEEPING = 10
+# 마지막 제품 작업 이후 이 시간(초) 동안 관리 작업을 미룸 (config: coffee_machine.rinse_defer_window)
+RINSE_DEFER_WINDOW = 5.0
+
 # ---- 고정 IO 맵 (상수 정의) ----
 # 카드번호/값 → 실제 주소: 값 N → 3200+N
 # 예: 5/1 → Unit 5, Addr 3201
@@ -40,12 +64,23 @@ ADDR_SYRUP_2_BASE = 3204
 
 # --- Mock Handlers ---
 class MockCoffeeMachine:
+    supports_product_events = True
+    BREW_TIME = 1.0  # Simulated brew time (order_service SIM_COFFEE_WAIT_SECONDS 보다 짧게 → 완료 이벤트 경로로 끝남)
+
     def __init__(self, port, baudrate):
         print(f"[MOCK] CoffeeMachine initialized on {port}")
+        self.event_listener = None
+
+    def set_event_listener(self, listener):
+        self.event_listener = listener
 
     def make_coffee(self, product_id, duration):
         print(f"[MOCK] Making Coffee: ID={product_id}, Duration={duration}s")
-        time.sleep(2) # Simulate brew time (shortened)
+        if self.event_listener:
+            self.event_listener('product_started', {'product_id': str(product_id)})
+        time.sleep(self.BREW_TIME)
+        if self.event_listener:
+            self.event_listener('product_finished', {'product_id': str(product_id), 'success': True})
         return True, "Mock Success"
 
     def execute_rinse(self):
@@ -54,6 +89,8 @@ class MockCoffeeMachine:
         return True, "Mock Rinse Success"
 
 class MockIceMachine:
+    needs_button_press = True
+
     def __init__(self, port, baudrate, io_url):
         print(f"[MOCK] IceMachine initialized on {port}")
     
@@ -62,10 +99,25 @@ class MockIceMachine:
         time.sleep(max(ice_time, water_time)) 
         return True, "Mock Dispense Success"
 
+    def dispense_async(self, ice_time, water_time, on_done=None):
+        print(f"[MOCK] Dispensing Ice({ice_time}s) & Water({water_time}s) (async)")
+        duration = max(ice_time, water_time)
+        ticket = {'ok': True, 'message': 'sent', 'estimated_done_at': time.time() + duration,
+                  'sent': threading.Event(), 'done': threading.Event()}
+        ticket['sent'].set()
+
+        def _finish():
+            ticket['done_at'] = time.time()
+            ticket['done'].set()
+            if on_done:
+                on_done(ticket)
+        threading.Timer(duration, _finish).start()
+        return ticket
+
 # --- 장비 동적 로더 ---
 def load_device_handlers():
     """config.json을 읽어 설정에 맞는 장비 핸들러(커피, 제빙기)를 로드합니다."""
-    global coffee_machine_handler, ice_machine_handler, SIMULATION_MODE
+    global coffee_machine_handler, ice_machine_handler, SIMULATION_MODE, RINSE_DEFER_WINDOW
     
     try:
         with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
@@ -76,6 +128,8 @@ def load_device_handlers():
 
         # 1. 커피 머신 로드
         coffee_config = config.get('coffee_machine', {})
+        RINSE_DEFER_WINDOW = float(coffee_config.get('rinse_defer_window', RINSE_DEFER_WINDOW))
+        print(f"[SYSTEM] Rinse defer window: {RINSE_DEFER_WINDOW}s")
         if coffee_config:
             brand = coffee_config.get('brand')
             port = coffee_config.get('port')
@@ -129,6 +183,61 @@ def load_device_handlers():
     except Exception as e:
         print(f"[SYSTEM][FATAL] Failed to load device handlers: {e}")
 
+    if coffee_machine_handler and hasattr(coffee_machine_handler, 'set_event_listener'):
+        coffee_machine_handler.set_event_listener(on_coffee_event)
+        print("[SYSTEM] Coffee product events enabled")
+
+# ---- 커피 추출 사이클 ----
+def _coffee_events_supported():
+    return bool(getattr(coffee_machine_handler, 'supports_product_events', False))
+
+def _register_coffee_cycle(ref, product_id):
+    with coffee_cycle_cond:
+        coffee_cycles[ref] = {
+            'state': 'requested',
+            'product_id': product_id,
+            'requested_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+        }
+        while len(coffee_cycles) > COFFEE_CYCLE_MAX:
+            coffee_cycles.popitem(last=False)
+        coffee_cycle_cond.notify_all()
+
+def _fail_coffee_cycle(ref):
+    with coffee_cycle_cond:
+        cycle = coffee_cycles.get(ref)
+        if cycle and cycle['state'] in ('requested', 'started'):
+            cycle['state'] = 'failed'
+            cycle['finished_at'] = time.time()
+        coffee_cycle_cond.notify_all()
+
+def on_coffee_event(event_type, info):
+    """
+    드라이버 이벤트 콜백 (드라이버 수신 스레드에서 호출됨).
+    머신은 한 번에 한 잔만 추출하므로 가장 오래된 진행 중 사이클에 매칭합니다.
+    """
+    now = time.time()
+    with coffee_cycle_cond:
+        if event_type == 'product_started':
+            cycle = next((c for c in coffee_cycles.values() if c['state'] == 'requested'), None)
+            if cycle:
+                cycle['state'] = 'started'
+                cycle['started_at'] = now
+        elif event_type == 'product_finished':
+            cycle = next((c for c in coffee_cycles.values() if c['state'] in ('requested', 'started')), None)
+            if cycle:
+                cycle['state'] = 'finished' if info.get('success', True) else 'failed'
+                cycle['finished_at'] = now
+        else:
+            cycle = None
+        coffee_cycle_cond.notify_all()
+
+    if cycle:
+        print(f"[Device Service] Coffee event: {event_type} {info} -> {cycle['state']}")
+    else:
+        print(f"[Device Service][WARN] Unmatched coffee event: {event_type} {info}")
+
 # ---- 공용 IO 함수 ----
 def _io_pulse(unit, addr, duration):
     if SIMULATION_MODE:
@@ -147,12 +256,276 @@ def _io_pulse_index(unit, base, index, duration):
     addr = base + (index - 1)
     return _io_pulse(unit, addr, duration)
 
+# ---- 장비 작업 큐 ----
+class DeviceWorker:
+    """
+    장비별 우선순위 작업 큐 + 전용 스레드 (같은 장비의 명령은 하나씩 실행).
+    - 제품 작업이 관리 작업(린스)보다 먼저 실행되고, 같은 우선순위는 들어온 순서대로 실행
+    - 관리 작업은 마지막 제품 작업 후 defer_window초 동안 보류 (연속 주문 사이에 끼어들지 않음)
+    """
+    def __init__(self, name, defer_window=0.0):
+        self.name = name
+        self.defer_window = defer_window
+        self.pending = []   # heap: (priority, seq, job, func)
+        self.seq = 0
+        self.cond = threading.Condition()
+        self.last_product_at = 0.0
+        self.product_since_housekeeping = True  # 마지막 린스 이후 제품 작업이 있었는지
+        self.current = None                     # 실행 중인 작업
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def find_pending(self, kind):
+        """대기 중이거나 실행 중인 같은 종류의 작업 (cond 보유 상태에서 호출)"""
+        # 실행 중인 작업과 합치는 건 그 뒤에 제품 작업이 대기 중이지 않을 때만
+        if self.current and self.current['kind'] == kind and \
+                not any(entry[0] == PRIORITY_PRODUCT for entry in self.pending):
+            return self.current
+        return next((entry[2] for entry in self.pending if entry[2]['kind'] == kind), None)
+
+    def push(self, job, func, priority):
+        """작업 추가 (cond 보유 상태에서 호출)"""
+        self.seq += 1
+        heapq.heappush(self.pending, (priority, self.seq, job, func))
+        if priority == PRIORITY_PRODUCT:
+            self.last_product_at = time.time()
+        self.cond.notify_all()
+
+    def cancel_pending(self):
+        """대기 중인 작업을 모두 꺼내서 반환 (실행 중인 작업은 장비 호출이 끝날 때까지 유지)"""
+        with self.cond:
+            cancelled = [entry[2] for entry in sorted(self.pending)]
+            self.pending.clear()
+            self.cond.notify_all()
+        return cancelled
+
+    def stop(self):
+        """워커 종료 (실행 중인 작업은 끝까지 진행, 대기 작업은 cancel_pending으로 먼저 정리)"""
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+
+    def _next(self):
+        with self.cond:
+            while self.running:
+                if not self.pending:
+                    self.cond.wait()
+                    continue
+                priority = self.pending[0][0]
+                if priority != PRIORITY_PRODUCT and self.defer_window > 0:
+                    hold = self.last_product_at + self.defer_window - time.time()
+                    if hold > 0:
+                        self.cond.wait(hold)
+                        continue
+                entry = heapq.heappop(self.pending)
+                self.current = entry[2]
+                return entry
+            return None
+
+    def _loop(self):
+        while True:
+            entry = self._next()
+            if entry is None:
+                return
+            priority, _, job, func = entry
+            _update_job(job, status='running', started_at=time.time())
+            extra = {}
+            try:
+                # func() -> (ok, msg) 또는 (ok, msg, 작업에 추가할 필드)
+                result = func()
+                ok, msg = result[0], result[1]
+                if len(result) > 2:
+                    extra = result[2]
+            except Exception as e:
+                print(f"[Device Service][ERR] Job {job['id']} ({job['kind']}) exception: {e}")
+                ok, msg = False, f"FAIL: {e}"
+
+            with self.cond:
+                self.current = None
+                if priority == PRIORITY_PRODUCT:
+                    self.last_product_at = time.time()
+                    self.product_since_housekeeping = True
+                elif ok:
+                    self.product_since_housekeeping = False
+            _update_job(job, status='done' if ok else 'failed', result=msg, finished_at=time.time(), **extra)
+            print(f"[Device Service] Job {job['id']} ({job['kind']}) -> {job['status']}: {msg}")
+
+def _get_worker(device):
+    with device_workers_lock:
+        worker = device_workers.get(device)
+        if worker is None:
+            worker = device_workers[device] = DeviceWorker(device, RINSE_DEFER_WINDOW)
+        return worker
+
+def _update_job(job, **fields):
+    with jobs_cond:
+        job.update(fields)
+        jobs_cond.notify_all()
+
+def _new_job(device, kind, params, status='queued', result=None):
+    global job_counter
+    now = time.time()
+    with jobs_cond:
+        job_counter += 1
+        job = {
+            'id': f"{int(now * 1000)}-{job_counter}",
+            'device': device,
+            'kind': kind,
+            'params': params,
+            'status': status,
+            'result': result,
+            'created_at': now,
+            'started_at': None,
+            'finished_at': now if status in ('done', 'failed') else None,
+        }
+        jobs[job['id']] = job
+        # 완료된 오래된 작업부터 정리 (대기/실행 중인 작업은 유지)
+        if len(jobs) > JOB_HISTORY_MAX:
+            for old_id in [j['id'] for j in jobs.values() if j['status'] in ('done', 'failed')][:len(jobs) - JOB_HISTORY_MAX]:
+                del jobs[old_id]
+    return job
+
+def submit_job(device, kind, params, func, priority=PRIORITY_PRODUCT, coalesce=False):
+    """
+    작업을 등록하고 장비 워커 큐에 넣습니다. func() -> (ok, 응답 메시지)
+    coalesce=True (린스 등): 같은 종류가 이미 대기 중이면 그 작업을 반환하고,
+    마지막 실행 이후 제품 작업이 없었다면 실행하지 않고 완료 처리합니다.
+    """
+    worker = _get_worker(device)
+    with worker.cond:
+        if coalesce:
+            existing = worker.find_pending(kind)
+            if existing:
+                print(f"[Device Service] {kind} merged into job {existing['id']} ({existing['status']})")
+                return existing
+            if not worker.product_since_housekeeping:
+                print(f"[Device Service] {kind} skipped: no product since last {kind}")
+                return _new_job(device, kind, dict(params, skipped=True), status='done', result='OK')
+        job = _new_job(device, kind, params)
+        worker.push(job, func, priority)
+    return job
+
+def wait_job(job_id, timeout):
+    """작업이 끝날 때까지 최대 timeout초 대기. 없는 작업이면 None"""
+    deadline = time.time() + max(0.0, timeout)
+    with jobs_cond:
+        job = jobs.get(job_id)
+        while job and job['status'] in ('queued', 'running'):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            jobs_cond.wait(remaining)
+        return dict(job) if job else None
+
+def _job_response(job, async_job):
+    """/jobs/... 는 작업 ID를 바로 반환, 기존 동기 엔드포인트는 완료까지 대기 후 기존과 같은 응답"""
+    if async_job:
+        with jobs_cond:
+            return jsonify(dict(job)), 202
+
+    result = wait_job(job['id'], JOB_SYNC_TIMEOUT)
+    if result['status'] == 'done':
+        return result['result'] or 'OK', 200
+    if result['status'] == 'failed':
+        return result['result'] or 'FAIL', 500
+    return 'FAIL: timeout', 504
+
+# ---- 작업 실행 함수 (장비 워커 스레드에서 호출) ----
+def _run_coffee(product_id, duration, ref):
+    global coffee_status
+    print(f"[Device Service] Calling coffee_machine_handler.make_coffee({product_id}, {duration})")
+    coffee_status = 1
+    ok = False
+    try:
+        ok, msg = coffee_machine_handler.make_coffee(product_id, duration)
+        print(f"[Device Service] Coffee result: ok={ok}, msg={msg}")
+        return ok, ("OK" if ok else f"FAIL: {msg}")
+    finally:
+        coffee_status = 0
+        if ref and not ok:
+            _fail_coffee_cycle(ref)
+
+def _run_coffee_rinse():
+    global coffee_status
+    coffee_status = 1
+    try:
+        ok, msg = coffee_machine_handler.execute_rinse()
+        return ok, ("OK" if ok else f"FAIL: {msg}")
+    finally:
+        coffee_status = 0
+
+def _run_water_ice(ice, water):
+    """
+    제빙기 토출 시작. 작업은 명령 전송(+버튼)이 끝나면 완료되고,
+    토출 구간 종료는 작업의 dispense_done 필드로 알립니다 (/ice/waitDone/<job_id>/<timeout>).
+    """
+    if hasattr(ice_machine_handler, 'dispense_async'):
+        job = _get_worker('ice').current
+        _update_job(job, dispense_done=False)
+
+        def _on_done(ticket):
+            _update_job(job, dispense_done=True, dispense_ok=ticket['ok'], dispensed_at=ticket.get('done_at'))
+
+        # 1. 시리얼 통신으로 양 전송 (드라이버 세션 큐, 전송 확인까지만 대기)
+        ticket = ice_machine_handler.dispense_async(ice, water, on_done=_on_done)
+        if not ticket['sent'].wait(ICE_SEND_TIMEOUT):
+            return False, 'FAIL: Ice command timeout'
+        if not ticket['ok']:
+            return False, ticket['message']
+        extra = {'estimated_done_at': ticket['estimated_done_at']}
+    else:
+        # 1. 시리얼 통신으로 양 전송
+        ok, message = ice_machine_handler.make_ice_water(ice, water)
+        if not ok:
+            return False, message
+        extra = {'estimated_done_at': time.time(), 'dispense_done': True, 'dispense_ok': True}
+
+    # 2. 버튼 누름 (DO 5:3200) - 게이트를 드라이버가 직접 여닫는 장비(Nakajo)는 제외
+    # 토출 시간 = max(ice, water) + 0.5 (Safety margin)
+    #press_duration = max(ice, water) + 0.5
+    press_duration = 0.5
+
+    if press_duration > 0 and getattr(ice_machine_handler, 'needs_button_press', True):
+        btn_ok = _io_pulse(UNIT_ICEMACHINE_BTN, ADDR_ICEMACHINE_BTN, press_duration)
+        if not btn_ok:
+             return False, 'FAIL: Button trigger failed'
+
+    return True, 'OK', extra
+
+def _run_hotwater(duration):
+    # 1. 시작 pulse
+    ok_start = _io_pulse(UNIT_HOTWATER, ADDR_HOTWATER, 0.5)
+    if not ok_start:
+        return False, 'FAIL: start pulse'
+
+    # # 2. 온수 추출 시간 대기
+    # time.sleep(duration)
+
+    # # 3. 종료 pulse
+    # ok_stop = _io_pulse(UNIT_HOTWATER, ADDR_HOTWATER, 0.5)
+    # if not ok_stop:
+    #     return False, 'FAIL: stop pulse'
+
+    return True, 'OK'
+
+def _run_pulse(unit, addr, duration):
+    ok = _io_pulse(unit, addr, duration)
+    return ok, ('OK' if ok else 'FAIL')
+
+def _run_syrup(base, idx, duration):
+    ok = _io_pulse_index(UNIT_SYRUP, base, idx, duration)
+    return ok, ('OK' if ok else 'FAIL')
+
 # ---- API Endpoints ----
+# 각 명령은 기존 동기 URL과 /jobs/ 접두사의 비동기 URL을 함께 제공합니다.
+# 비동기 URL은 작업 ID를 즉시 반환하고, /job/<id> 또는 /job/<id>/wait/<timeout>으로 결과를 확인합니다.
 
 @app.route('/coffee/<int:product_id>/<string:duration>', methods=['GET'])
-def coffee(product_id, duration):
+@app.route('/jobs/coffee/<int:product_id>/<string:duration>', methods=['GET', 'POST'], defaults={'async_job': True})
+def coffee(product_id, duration, async_job=False):
+    """커피 추출. ?ref=<id>를 주면 /coffee/waitDone/<id>/...로 완료를 기다릴 수 있습니다."""
     print(f"[Device Service] Received coffee request: product_id={product_id}, duration={duration}")
-    global coffee_status
     if not coffee_machine_handler:
         print("[Device Service] ERROR: Coffee machine not initialized!")
         return "Coffee machine not initialized", 503
@@ -167,46 +540,71 @@ def coffee(product_id, duration):
         print(f"[Device Service] ERROR: Invalid product_id: {product_id}")
         return 'BAD_PARAM', 400
 
-    print(f"[Device Service] Calling coffee_machine_handler.make_coffee({product_id}, {duration})")
-    coffee_status = 1
+    ref = request.args.get('ref')
+    if ref:
+        _register_coffee_cycle(ref, product_id)
+
+    job = submit_job('coffee', 'coffee', {'product_id': product_id, 'duration': duration, 'ref': ref},
+                     lambda: _run_coffee(product_id, duration, ref))
+    return _job_response(job, async_job)
+
+@app.route('/coffee/waitDone/<string:ref>/<string:timeout>', methods=['GET'])
+def coffee_wait_done(ref, timeout):
+    """
+    ref 사이클의 추출 완료(product_finished)까지 최대 timeout초 대기 (long-poll).
+    state: finished | failed | pending(타임아웃) | unsupported(이벤트 미지원 드라이버)
+    """
     try:
-        ok, msg = coffee_machine_handler.make_coffee(product_id, duration)
-        print(f"[Device Service] Coffee result: ok={ok}, msg={msg}")
-        
-        if ok:
-            return "OK", 200
-        else:
-            return f"FAIL: {msg}", 500
-    finally:
-        coffee_status = 0
+        timeout = min(float(timeout), JOB_SYNC_TIMEOUT)
+    except (ValueError, TypeError):
+        return 'BAD_PARAM: timeout must be a number', 400
+
+    if not _coffee_events_supported():
+        return jsonify({'ref': ref, 'state': 'unsupported'})
+
+    deadline = time.time() + max(0.0, timeout)
+    with coffee_cycle_cond:
+        while True:
+            cycle = coffee_cycles.get(ref)
+            # 커피 요청이 아직 도착하지 않았을 수도 있으므로 사이클이 없어도 대기
+            if cycle and cycle['state'] in ('finished', 'failed'):
+                break
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            coffee_cycle_cond.wait(remaining)
+        result = dict(cycle) if cycle else {'state': 'pending'}
+
+    if result['state'] in ('requested', 'started'):
+        result['state'] = 'pending'
+    result['ref'] = ref
+    return jsonify(result)
+
+@app.route('/coffee/events', methods=['GET'])
+def coffee_events():
+    """최근 커피 추출 사이클 목록 (디버그용)"""
+    with coffee_cycle_cond:
+        cycles = [dict(c, ref=ref) for ref, c in coffee_cycles.items()]
+    return jsonify({'supported': _coffee_events_supported(), 'cycles': cycles})
 
 @app.route('/coffee/rinse', methods=['GET'])
-def coffee_rinse():
+@app.route('/jobs/coffee/rinse', methods=['GET', 'POST'], defaults={'async_job': True})
+def coffee_rinse(async_job=False):
     """커피 머신 강제 헹굼을 시작합니다."""
-    global coffee_machine_handler, coffee_status
     if not coffee_machine_handler:
         return "Coffee machine not initialized", 503
 
     print("[Device Service] Received force rinse request.")
-    coffee_status = 1
-    try:
-        ok, msg = coffee_machine_handler.execute_rinse()
-        if ok:
-            return "OK", 200
-        else:
-            return f"FAIL: {msg}", 500
-    except Exception as e:
-        print(f"[Device Service][ERR] Exception during rinse: {e}")
-        return f"FAIL: {e}", 500
-    finally:
-        coffee_status = 0
+    job = submit_job('coffee', 'rinse', {}, _run_coffee_rinse, priority=PRIORITY_HOUSEKEEPING, coalesce=True)
+    return _job_response(job, async_job)
 
 @app.route('/coffee/status', methods=['GET'])
 def coffee_status_api():
     return jsonify({'status': coffee_status})
 
 @app.route('/waterice/<string:ice>/<string:water>', methods=['GET'])
-def water_ice(ice, water):
+@app.route('/jobs/waterice/<string:ice>/<string:water>', methods=['GET', 'POST'], defaults={'async_job': True})
+def water_ice(ice, water, async_job=False):
     print("=================== waterice : ", ice," / ",water, " ===============================")
     if not ice_machine_handler:
         return "Ice machine not initialized", 503
@@ -217,59 +615,37 @@ def water_ice(ice, water):
     except (ValueError, TypeError):
         return 'BAD_PARAM: ice/water must be numbers', 400
 
-    # 1. 시리얼 통신으로 양 전송
-    ok, message = ice_machine_handler.make_ice_water(ice, water)
-    if not ok:
-        return (message, 500)
-
-    # 2. 버튼 누름 (DO 5:3200) 
-    # 토출 시간 = max(ice, water) + 0.5 (Safety margin)
-    #press_duration = max(ice, water) + 0.5
-    press_duration = 0.5
-
-    if press_duration > 0:
-        btn_ok = _io_pulse(UNIT_ICEMACHINE_BTN, ADDR_ICEMACHINE_BTN, press_duration)
-        if not btn_ok:
-             return ('FAIL: Button trigger failed', 500)
-
-    return ('OK', 200)
+    job = submit_job('ice', 'waterice', {'ice': ice, 'water': water}, lambda: _run_water_ice(ice, water))
+    return _job_response(job, async_job)
 
 @app.route('/hotwater/<string:duration>', methods=['GET'])
-def hotwater(duration):
+@app.route('/jobs/hotwater/<string:duration>', methods=['GET', 'POST'], defaults={'async_job': True})
+def hotwater(duration, async_job=False):
     try:
         duration = float(duration)
     except (ValueError, TypeError):
         return 'BAD_PARAM: duration must be a number', 400
     if duration <= 0: return 'BAD_PARAM', 400
 
-    # 1. 시작 pulse
-    ok_start = _io_pulse(UNIT_HOTWATER, ADDR_HOTWATER, 0.5)
-    if not ok_start:
-        return ('FAIL: start pulse', 500)
-
-    # # 2. 온수 추출 시간 대기
-    # time.sleep(duration)
-
-    # # 3. 종료 pulse
-    # ok_stop = _io_pulse(UNIT_HOTWATER, ADDR_HOTWATER, 0.5)
-    # if not ok_stop:
-    #     return ('FAIL: stop pulse', 500)
-
-    return ('OK', 200)
+    job = submit_job('hotwater', 'hotwater', {'duration': duration}, lambda: _run_hotwater(duration))
+    return _job_response(job, async_job)
 
 @app.route('/sparkling/<string:duration>', methods=['GET'])
-def sparkling(duration):
+@app.route('/jobs/sparkling/<string:duration>', methods=['GET', 'POST'], defaults={'async_job': True})
+def sparkling(duration, async_job=False):
     print("=================== sparkling : ", duration, "===============================")
     try:
         duration = float(duration)
     except (ValueError, TypeError):
         return 'BAD_PARAM: duration must be a number', 400
     if duration <= 0: return 'BAD_PARAM', 400
-    ok = _io_pulse(UNIT_SPARKLING, ADDR_SPARKLING, duration)
-    return ('OK', 200) if ok else ('FAIL', 500)
+    job = submit_job('sparkling', 'sparkling', {'duration': duration},
+                     lambda: _run_pulse(UNIT_SPARKLING, ADDR_SPARKLING, duration))
+    return _job_response(job, async_job)
 
 @app.route('/syrup/<int:code>/<string:duration>', methods=['GET'])
-def syrup(code, duration):
+@app.route('/jobs/syrup/<int:code>/<string:duration>', methods=['GET', 'POST'], defaults={'async_job': True})
+def syrup(code, duration, async_job=False):
     # code: 1~8 (Syrup ID)
     # 1~4 -> Syrup 1 Unit (ADDR_SYRUP_1_BASE)
     # 5~8 -> Syrup 2 Unit (ADDR_SYRUP_2_BASE)
@@ -289,10 +665,101 @@ def syrup(code, duration):
         base = ADDR_SYRUP_2_BASE
         idx = code - 4
 
-    ok = _io_pulse_index(UNIT_SYRUP, base, idx, duration)
-    return ('OK', 200) if ok else ('FAIL', 500)
+    job = submit_job('syrup', 'syrup', {'code': code, 'duration': duration},
+                     lambda: _run_syrup(base, idx, duration))
+    return _job_response(job, async_job)
+
+@app.route('/ice/waitDone/<string:job_id>/<string:timeout>', methods=['GET'])
+def ice_wait_done(job_id, timeout):
+    """제빙기 작업의 토출 구간 종료(dispense_done)까지 최대 timeout초 대기 (long-poll)"""
+    try:
+        timeout = min(float(timeout), JOB_SYNC_TIMEOUT)
+    except (ValueError, TypeError):
+        return 'BAD_PARAM: timeout must be a number', 400
+
+    deadline = time.time() + max(0.0, timeout)
+    with jobs_cond:
+        job = jobs.get(job_id)
+        while job and job['status'] != 'failed' and not job.get('dispense_done'):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            jobs_cond.wait(remaining)
+        if not job:
+            return jsonify({'error': 'job not found'}), 404
+        return jsonify(dict(job))
+
+# ---- Job API ----
+@app.route('/job/<string:job_id>', methods=['GET'])
+def job_status(job_id):
+    with jobs_cond:
+        job = jobs.get(job_id)
+        if not job:
+            return jsonify({'error': 'job not found'}), 404
+        return jsonify(dict(job))
+
+@app.route('/job/<string:job_id>/wait/<string:timeout>', methods=['GET'])
+def job_wait(job_id, timeout):
+    """작업 완료까지 최대 timeout초 대기 (long-poll). 타임아웃 시 현재 상태 반환"""
+    try:
+        timeout = min(float(timeout), JOB_SYNC_TIMEOUT)
+    except (ValueError, TypeError):
+        return 'BAD_PARAM: timeout must be a number', 400
+    job = wait_job(job_id, timeout)
+    if not job:
+        return jsonify({'error': 'job not found'}), 404
+    return jsonify(job)
+
+def cancel_all_jobs():
+    """모든 장비 워커의 대기 작업을 취소(failed)하고 (취소된 ID, 실행 중인 ID) 반환"""
+    with device_workers_lock:
+        workers = list(device_workers.values())
+    now = time.time()
+    cancelled = []
+    for worker in workers:
+        for job in worker.cancel_pending():
+            _update_job(job, status='failed', result='FAIL: cancelled by stopAll', finished_at=now)
+            cancelled.append(job['id'])
+    running = [w.current['id'] for w in workers if w.current]
+    print(f"[Device Service] STOP ALL: cancelled {len(cancelled)} queued job(s), running={running}")
+    return cancelled, running
+
+@app.route('/stopAll', methods=['GET'])
+def stop_all():
+    """비상 정지: 모든 장비 워커의 대기 작업을 취소(failed)합니다."""
+    cancelled, running = cancel_all_jobs()
+    return jsonify({'cancelled': cancelled, 'running': running})
+
+@app.route('/jobs', methods=['GET'])
+def job_list():
+    """최근 작업 목록 (?device=coffee 등으로 필터)"""
+    device = request.args.get('device')
+    with jobs_cond:
+        result = [dict(j) for j in jobs.values() if not device or j['device'] == device]
+    return jsonify(result)
+
+def shutdown():
+    """서버 종료 시: 대기 작업 취소, 실행 중인 작업이 끝나면 워커 종료, 장비 시리얼 세션 닫기"""
+    cancel_all_jobs()
+    with device_workers_lock:
+        workers = list(device_workers.values())
+    for worker in workers:
+        worker.stop()
+    deadline = time.time() + 5.0
+    for worker in workers:
+        worker.thread.join(timeout=max(0.0, deadline - time.time()))
+        if worker.thread.is_alive():
+            print(f"[Device Service][WARN] {worker.name} job still running at shutdown")
+    for handler in (coffee_machine_handler, ice_machine_handler):
+        if handler and hasattr(handler, 'close'):
+            try:
+                handler.close()
+            except Exception as e:
+                print(f"[Device Service][WARN] Failed to close {type(handler).__name__}: {e}")
+    print("[Device Service] Stopped")
 
 if __name__ == '__main__':
     # Flask 앱 실행 전 장비 핸들러 로드
     load_device_handlers()
-    app.run(host='0.0.0.0', port=8500, threaded=True)
+    from http_server import serve
+    serve(app, 'device_service', 8500, on_shutdown=shutdown)
@@ -16,4 +16,5 @@ def web():
    return render_template('DID2.html')
 
 if __name__ == '__main__':
-  app.run(host='0.0.0.0', port=9100, debug=False)
\ No newline at end of file
+  from http_server import serve
+  serve(app, 'did_service', 9100)
\ No newline at end of file
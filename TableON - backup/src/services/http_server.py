@@ -0,0 +1,82 @@
+import json
+import os
+import signal
+import threading
+
+# 서비스 공용 HTTP 실행기
+# config.json 의 http_server.mode 에 따라 waitress(운영) 또는 Flask 개발 서버로 app 을 실행합니다.
+# SIGTERM/SIGINT 수신 시 서비스가 등록한 종료 함수(on_shutdown)를 실행한 뒤 서버를 닫습니다.
+# 사용: serve(app, 'order_service', 8100, on_shutdown=shutdown)
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'config', 'config.json')
+
+DEFAULTS = {
+    'mode': 'waitress',
+    'threads': 8,              # 요청 처리 스레드 수 (롱폴링 연결이 스레드를 점유하므로 여유 있게)
+    'connection_limit': 200,
+    'channel_timeout': 120,    # keep-alive 유휴 연결 유지 시간 (롱폴링보다 길게)
+    'backlog': 1024,
+    'shutdown_timeout': 10,    # 종료 함수 최대 대기 시간
+}
+
+def load_http_config(name):
+    conf = dict(DEFAULTS)
+    try:
+        with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
+            http = json.load(f).get('http_server', {})
+        conf.update({k: v for k, v in http.items() if k != 'services'})
+        conf.update(http.get('services', {}).get(name, {}))
+    except Exception as e:
+        print(f"[HTTP] Config load failed, using defaults: {e}")
+    return conf
+
+def _run_shutdown(name, on_shutdown, timeout):
+    if not on_shutdown:
+        return
+    t = threading.Thread(target=on_shutdown, daemon=True)
+    t.start()
+    t.join(timeout)
+    if t.is_alive():
+        print(f"[HTTP] {name}: shutdown hook still running after {timeout}s, exiting anyway")
+
+def _raise_exit(signum, frame):
+    raise SystemExit(0)
+
+def serve(app, name, port, on_shutdown=None, host='0.0.0.0'):
+    """app 실행 (종료 신호까지 블록). on_shutdown: 서버 종료 직전에 호출 (스케줄러/저장 스레드 정리)"""
+    conf = load_http_config(name)
+    mode = conf['mode']
+    server = None
+    if mode == 'waitress':
+        try:
+            from waitress.server import create_server
+        except ImportError:
+            print(f"[HTTP] {name}: waitress not installed, falling back to dev server")
+            mode = 'dev'
+
+    # SIGTERM(main_controller 의 terminate)도 Ctrl+C 와 같이 정상 종료 경로로
+    signal.signal(signal.SIGTERM, _raise_exit)
+    signal.signal(signal.SIGINT, _raise_exit)
+    try:
+        if mode == 'waitress':
+            server = create_server(
+                app, host=host, port=port, ident=name,
+                threads=conf['threads'],
+                connection_limit=conf['connection_limit'],
+                channel_timeout=conf['channel_timeout'],
+                backlog=conf['backlog'],
+            )
+            print(f"[HTTP] {name} serving on {host}:{port} (waitress, threads={conf['threads']}, "
+                  f"channel_timeout={conf['channel_timeout']}s)")
+            server.run()
+        else:
+            print(f"[HTTP] {name} serving on {host}:{port} (Flask dev server)")
+            app.run(host=host, port=port, debug=False, threaded=True, use_reloader=False)
+    except SystemExit:
+        pass
+    finally:
+        print(f"[HTTP] {name} shutting down...")
+        _run_shutdown(name, on_shutdown, conf['shutdown_timeout'])
+        if server:
+            server.close()
+        print(f"[HTTP] {name} stopped")
@@ -9,6 +9,7 @@ from flask import Flask, jsonify, request
 import threading, time
 import json, os
 import serial  # Added for Arduino
+import requests
 
 app = Flask(__name__)
 
@@ -19,74 +20,137 @@ client = None
 lock = threading.Lock()
 arduino_readers = {}
 
+# ===== Arduino 센서 감시 (빠른 로컬 폴링 → 변경 시 pickup_service로 이벤트 전송) =====
+PICKUP_SERVICE_URL = "http://localhost:8600"
+ARDUINO_WATCH_INTERVAL = 0.3   # 기본 감시 주기 (초), config arduino.pickup_N.watch_interval
+ARDUINO_BOOT_SEC = 2.0         # 감시용 포트를 연 뒤 첫 요청 전 대기 (열 때 DTR로 리셋된 경우 부트로더 대기)
+ARDUINO_REOPEN_SEC = 2.0       # 감시용 포트 오류 후 다시 열기까지 대기
+
 # [Simulation State] Unit:Addr -> Value (0 or 1)
 mock_sensor_state = {} 
 
 class ArduinoReader:
-    def __init__(self, pickup_id, port, baudrate, simulation=False):
+    def __init__(self, pickup_id, port, baudrate, simulation=False, slots=4):
         self.pickup_id = pickup_id
         self.port = port
         self.baudrate = baudrate
         self.simulation = simulation
+        self.slots = slots
         self.lock = threading.Lock()
         
         # Simulation State
-        self.mock_data = [0, 0, 0, 0]
+        self.mock_data = [0] * slots
+
+        # 감시 스레드가 마지막으로 읽은 값 (/arduino/sensor 조회 시 재사용)
+        self.last_data = None
+        self.last_read_at = 0
+        self.watch_interval = None
+        self.watch_ser = None     # 감시 스레드 전용 시리얼 핸들 (열린 채로 유지)
+        self.running = False
 
         print(f"[Arduino-{self.pickup_id}] Initialized (Port: {self.port}, Sim: {self.simulation})")
 
+    def start_watch(self, interval):
+        self.watch_interval = interval
+        self.running = True
+        threading.Thread(target=self._watch_loop, daemon=True).start()
+
+    def stop_watch(self):
+        self.running = False
+        with self.lock:
+            self._close_watch_serial()
+
+    def _watch_loop(self):
+        """센서 값을 짧은 주기로 읽고, 바뀌었을 때만 pickup_service에 전송"""
+        sent = None
+        while self.running:
+            data = list(self.mock_data) if self.simulation else self._read_watch()
+            if data is not None:
+                self.last_data, self.last_read_at = data, time.time()
+                if data != sent:
+                    try:
+                        url = f"{PICKUP_SERVICE_URL}/sensorEvent/{self.pickup_id}/" + "/".join(str(v) for v in data)
+                        requests.get(url, timeout=1.0)
+                        sent = data
+                    except Exception:
+                        pass  # 다음 주기에 재전송
+            time.sleep(self.watch_interval if data is not None or self.watch_ser else ARDUINO_REOPEN_SEC)
+
+    def read_cached(self):
+        """감시 중이면 최근 값 반환 (시리얼 동시 접근 방지), 아니면 직접 읽기"""
+        if self.watch_interval and self.last_data is not None \
+                and time.time() - self.last_read_at < max(2.0, self.watch_interval * 3):
+            return list(self.last_data)
+        if self.running and not self.simulation:
+            return None  # 감시 스레드가 포트를 잡고 있으므로 다시 열지 않음 (재연결 중)
+        return self.get_data()
+
+    def _open_serial(self):
+        """포트 열기 (열기 전에 DTR을 내려서 Arduino 리셋 최소화)"""
+        ser = serial.Serial(timeout=1.0, dsrdtr=False, rtscts=False)
+        ser.port = self.port
+        ser.baudrate = self.baudrate
+        ser.dtr = False
+        ser.open()
+        return ser
+
+    def _request(self, ser):
+        """'S' 전송 -> 한 줄 응답 파싱 (실패 시 None)"""
+        ser.reset_input_buffer()
+        ser.write(b'S')
+        line = ser.readline()
+        if not line:
+            return None
+        # Data format: "1,0,1,0" (슬롯 수만큼)
+        parts = line.decode(errors='ignore').strip().split(',')
+        if len(parts) >= self.slots and all(p.strip().isdigit() for p in parts[:self.slots]):
+            # 값 반전: 1->0, 0->1 (센서: 1=비어있음 → 0=비어있음)
+            return [1 - int(p) for p in parts[:self.slots]]
+        return None
+
+    def _close_watch_serial(self):
+        if self.watch_ser:
+            try:
+                self.watch_ser.close()
+            except:
+                pass
+            self.watch_ser = None
+
+    def _read_watch(self):
+        """감시 스레드 전용: 한 번 연 포트를 유지하면서 읽기 (오류 시에만 닫고 다시 열기)"""
+        with self.lock:
+            try:
+                if self.watch_ser is None:
+                    self.watch_ser = self._open_serial()
+                    print(f"[Arduino-{self.pickup_id}] Watch port opened")
+                    time.sleep(ARDUINO_BOOT_SEC)
+                return self._request(self.watch_ser)
+            except Exception as e:
+                print(f"[Arduino-{self.pickup_id}] Watch IO Error: {e}")
+                self._close_watch_serial()
+                return None
+
     def get_data(self):
-        """요청 시 'S' 전송 -> 응답 수신 (매번 연결/해제 방식)"""
+        """요청 시 'S' 전송 -> 응답 수신 (감시하지 않는 리더용: 매번 연결/해제 방식)"""
         if self.simulation:
             return list(self.mock_data)
 
         with self.lock:
             ser = None
             try:
-                # 1. 연결 (DTR 비활성화로 Arduino 리셋 방지)
-                ser = serial.Serial(
-                    self.port, 
-                    self.baudrate, 
-                    timeout=1.0,
-                    dsrdtr=False,
-                    rtscts=False
-                )
-                ser.dtr = False
+                ser = self._open_serial()
                 time.sleep(0.1)  # 짧은 안정화 대기
-                
-                # 2. 버퍼 비우기
-                ser.reset_input_buffer()
                 ser.reset_output_buffer()
-                
-                # 3. 요청 전송 ('S')
-                ser.write(b'S')
-                
-                # 4. 응답 대기 (ReadLine)
-                line = ser.readline()
-                
-                # 5. 연결 해제
-                ser.close()
-                
-                if not line:
-                    return None
-                
-                line_str = line.decode(errors='ignore').strip()
-                # Data format: "1,0,1,0"
-                parts = line_str.split(',')
-                if len(parts) >= 4:
-                    # 값 반전: 1->0, 0->1 (센서: 1=비어있음 → 0=비어있음)
-                    raw = [int(p) for p in parts[:4]]
-                    inverted = [1 - v for v in raw]
-                    return inverted
-                
+                return self._request(ser)
             except Exception as e:
                 print(f"[Arduino-{self.pickup_id}] IO Error: {e}")
+            finally:
                 if ser:
                     try:
                         ser.close()
                     except:
                         pass
-        
+
         return None # 실패
 
     def send_led_command(self, index, command):
@@ -104,16 +168,32 @@ class ArduinoReader:
             except: pass
 
 # --- Simulation Control: Arduino ---
-@app.route('/sim/setArduino/<int:pickup_id>/<int:v1>/<int:v2>/<int:v3>/<int:v4>', methods=['GET'])
-def sim_set_arduino(pickup_id, v1, v2, v3, v4):
+@app.route('/sim/setArduino/<int:pickup_id>/<path:values>', methods=['GET'])
+def sim_set_arduino(pickup_id, values):
+    """센서 값 전체 설정 (values: 1/0/1/1..., 리더의 슬롯 수만큼)"""
     if not SIMULATION_MODE:
         return jsonify({'error': 'Simulation Mode Only'}), 403
     
     reader = arduino_readers.get(pickup_id)
-    if reader:
-        reader.set_mock_data([v1, v2, v3, v4])
-        return jsonify({'message': 'OK', 'id': pickup_id, 'data': [v1, v2, v3, v4]})
-    return jsonify({'error': 'Reader not found'}), 404
+    if not reader:
+        return jsonify({'error': 'Reader not found'}), 404
+    try:
+        data = [int(v) for v in values.split('/') if v != '']
+    except ValueError:
+        return jsonify({'error': 'values must be integers'}), 400
+    if len(data) != reader.slots:
+        return jsonify({'error': f'expected {reader.slots} values'}), 400
+    reader.set_mock_data(data)
+    return jsonify({'message': 'OK', 'id': pickup_id, 'data': data})
+
+def _zone_slot_counts(config):
+    """zones.<name>.arduino(리더 키) -> capacity (pickup_service load_zones 와 같은 규칙, 기본 키 pickup_<순번>)"""
+    counts = {}
+    for i, (name, conf) in enumerate(config.get('zones', {}).items(), start=1):
+        reader = conf.get('arduino', f'pickup_{i}')
+        if reader:
+            counts[str(reader)] = int(conf.get('capacity', 4))
+    return counts
 
 def load_config():
     global SIMULATION_MODE, client, arduino_readers
@@ -131,12 +211,19 @@ def load_config():
             
         # 2. Arduino Init
         arduino_conf = config.get('arduino', {})
-        # pickup_1 -> ID 1, pickup_2 -> ID 2
+        # 센서 수는 이 리더를 쓰는 구역의 capacity (pickup_service와 같은 값), 구역이 없으면 slots (기본 4)
+        zone_slots = _zone_slot_counts(config)
+        # pickup_1 -> ID 1, pickup_2 -> ID 2, ...
         for key, val in arduino_conf.items():
-            if key == 'pickup_1':
-                arduino_readers[1] = ArduinoReader(1, val['port'], val['baudrate'], SIMULATION_MODE)
-            elif key == 'pickup_2':
-                arduino_readers[2] = ArduinoReader(2, val['port'], val['baudrate'], SIMULATION_MODE)
+            if key.startswith('pickup_') and key[len('pickup_'):].isdigit():
+                pickup_id = int(key[len('pickup_'):])
+                slots = zone_slots.get(key, val.get('slots', 4))
+                if 'slots' in val and val['slots'] != slots:
+                    print(f"[IO][WARN] arduino.{key}.slots={val['slots']} differs from zone capacity {slots}, using {slots}")
+                arduino_readers[pickup_id] = ArduinoReader(pickup_id, val['port'], val['baudrate'], SIMULATION_MODE,
+                                                           slots)
+        for key, reader in arduino_readers.items():
+            reader.start_watch(arduino_conf.get(f'pickup_{key}', {}).get('watch_interval', ARDUINO_WATCH_INTERVAL))
 
     except Exception as e:
         print(f"[IO] Config/Init Error: {e}")
@@ -307,7 +394,7 @@ def health():
 def arduino_sensor(pickup_id):
     reader = arduino_readers.get(pickup_id)
     if reader:
-        data = reader.get_data()
+        data = reader.read_cached()
         if data is not None:
             return jsonify(data)
         else:
@@ -318,6 +405,19 @@ def arduino_sensor(pickup_id):
         return jsonify([0, 0, 0, 0])
     return jsonify({'error': 'Not Found'}), 404
 
+# --- Arduino Sensor Set (Mock Only, 슬롯 수 가변: /arduino/sensor/setAll/1/0/1/1/1/0) ---
+@app.route('/arduino/sensor/setAll/<int:pickup_id>/<path:values>', methods=['GET'])
+def arduino_sensor_set_all(pickup_id, values):
+    if not SIMULATION_MODE:
+        return jsonify({'error': 'Simulation Mode Only'}), 403
+
+    reader = arduino_readers.get(pickup_id)
+    if reader:
+        data = [int(v) for v in values.split('/') if v != '']
+        reader.set_mock_data(data)
+        return jsonify({'message': 'Mock Data Updated', 'data': data})
+    return jsonify({'error': 'Reader Not Found'}), 404
+
 # --- Arduino Sensor Set (Mock Only) ---
 @app.route('/arduino/sensor/set/<int:pickup_id>/<int:v1>/<int:v2>/<int:v3>/<int:v4>', methods=['GET'])
 def arduino_sensor_set(pickup_id, v1, v2, v3, v4):
@@ -444,10 +544,8 @@ def sim_get_all_sensors():
     
     # Arduino Mock Data
     arduino = {}
-    for pid in [1, 2]:
-        reader = arduino_readers.get(pid)
-        if reader:
-            arduino[f'pickup_{pid}'] = reader.get_data()
+    for pid, reader in sorted(arduino_readers.items()):
+        arduino[f'pickup_{pid}'] = reader.get_data()
             
     return jsonify({
         'modbus': {
@@ -485,7 +583,7 @@ def sim_set_coop_jig(slot, state):
 
 @app.route('/sim/setPickup/<int:zone>/<int:slot>/<int:state>', methods=['GET'])
 def sim_set_pickup_helper(zone, slot, state):
-    """Pickup Zone Sensor (Zone 0, 1, 2)"""
+    """Pickup Zone Sensor (Zone 0: 작업자 픽업, 1..N: Arduino 리더)"""
     # Zone 0: Worker Pickup (Unit 4, Addr 4~7)
     if zone == 0:
         if not (1 <= slot <= 4): return jsonify({'error': 'Invalid slot'}), 400
@@ -494,17 +592,16 @@ def sim_set_pickup_helper(zone, slot, state):
         mock_sensor_state[f"4:{addr}"] = 1 if state else 0
         return jsonify({'message': 'OK', 'zone': 0, 'slot': slot, 'state': state})
 
-    if zone not in [1, 2]: return jsonify({'error': 'Invalid zone'}), 400
-    if not (1 <= slot <= 4): return jsonify({'error': 'Invalid slot'}), 400
-    
+    # Zone 1..N: Arduino 리더 ID (슬롯 수는 config.json zones capacity)
     reader = arduino_readers.get(zone)
-    if reader:
-        # 현재 값 읽어서 해당 슬롯만 변경
-        current = reader.get_data() # [s1, s2, s3]
-        current[slot-1] = 1 if state else 0
-        reader.set_mock_data(current)
-        return jsonify({'message': 'OK', 'zone': zone, 'data': current})
-    return jsonify({'error': 'Reader not found'}), 404
+    if not reader: return jsonify({'error': 'Invalid zone'}), 400
+    if not (1 <= slot <= reader.slots): return jsonify({'error': 'Invalid slot'}), 400
+
+    # 현재 값 읽어서 해당 슬롯만 변경
+    current = reader.get_data() # [s1, s2, ...]
+    current[slot-1] = 1 if state else 0
+    reader.set_mock_data(current)
+    return jsonify({'message': 'OK', 'zone': zone, 'data': current})
 
 def _print_sim_state():
     """현재 시뮬레이션 센서 상태를 보기 좋게 출력 (Thread-Safe with internal Copy)"""
@@ -515,10 +612,8 @@ def _print_sim_state():
     worker = [mock_sensor_state.get(f"4:{i}", 0) for i in range(4, 8)]
     
     arduino_data = {}
-    for pid in [1, 2]:
-        reader = arduino_readers.get(pid)
-        if reader:
-            arduino_data[pid] = reader.get_data() # get_data uses its own lock
+    for pid, reader in sorted(arduino_readers.items()):
+        arduino_data[pid] = reader.get_data() # get_data uses its own lock
 
     # Print without locks
     print("\n=== [SIMULATION SENSOR STATE] ===")
@@ -559,5 +654,18 @@ if ENABLE_COMPAT:
             return jsonify({'error': 'read fail'}), 500
         return jsonify(bits)
 
+def shutdown():
+    """서버 종료 시: Arduino 감시 스레드 종료(포트 닫기), Modbus 클라이언트 닫기"""
+    for reader in arduino_readers.values():
+        reader.stop_watch()
+    if client:
+        with lock:
+            try:
+                client.close()
+            except Exception as e:
+                print(f"[IO][WARN] Modbus close failed: {e}")
+    print("[IO] Stopped")
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8400, debug=False, threaded=True)
+    from http_server import serve
+    serve(app, 'io_service', 8400, on_shutdown=shutdown)
@@ -11,11 +11,13 @@ import openpyxl
 from openpyxl.utils import get_column_letter
 
 from enum import Enum, auto
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, NamedTuple
+import itertools
 from queue import Queue, Empty
 
 import logging
 from logging.handlers import TimedRotatingFileHandler
+from recipe_client import RecipeClient
 
 # --- Logger Setup ---
 LOG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'logs')
@@ -52,17 +54,44 @@ RECIPE_PATH = os.path.join(CONFIG_DIR, 'recipe.json')
 SIMULATION_MODE = False
 COFFEE_BRAND = ""
 PICKUP_MODE = "sensor"  # "sensor" or "rotate"
+ROBOT_CONFIG = {}  # config.json 'robot' 맵 (robot_1, robot_2, ..., handover)
+PICKUP_SLOTS = 4   # 로봇이 서빙하는 픽업대(Zone 1)의 슬롯 수 (config.json zones 첫 항목 capacity)
+
+# 제빙기 예상 종료 시각 이후 추가로 기다릴 최대 시간
+ICE_WAIT_MARGIN_SECONDS = 3.0
+# 시뮬레이션 coffee_wait 최대 대기 (device_service MockCoffeeMachine.BREW_TIME 보다 길게 해서 완료 이벤트 경로를 확인)
+SIM_COFFEE_WAIT_SECONDS = 1.5
+
+# 픽업 슬롯 선예약 (CMD_PICKUP_MOVE 동작 중 pickup_service에 예약)
+PICKUP_LEASE_SECONDS = 120      # 예약 유지 시간 (서빙되면 소진, 실패 시 해제)
+PICKUP_RETRY_SECONDS = 2.0      # 빈 슬롯이 없을 때 재시도 주기
+
+# 픽업 용량 기반 컵 배출 보류 (sensor 모드)
+PICKUP_FORECAST_INTERVAL = 2.0          # pickup_service 예측 조회 주기 (슬롯 상태가 바뀌면 즉시 재조회)
+PICKUP_FORECAST_STALE_SECONDS = 5.0     # 이보다 오래된 예측이면 보류하지 않음
+PICKUP_HOLD_RINSE_IDLE_SECONDS = 10 * 60  # 보류 중 커피머신이 이 시간 이상 쉬었으면 린스
 
 # --- 써모플랜 보일러 온도 보상 로직 설정 ---
 IDLE_TIME_THRESHOLD_SECONDS = 5 * 60  # 5분
 EXTRA_DURATION_SECONDS = 20
 
+# --- 주문 ETA (동작 시간 모델) ---
+MOTION_PROFILE_PATH = os.path.join(CONFIG_DIR, 'motion_profile.json')  # scripts/extract_motion_profile.py 로 생성
+ETA_EWMA_ALPHA = 0.2              # 새 관측값 반영 비율
+ETA_DEFAULT_CMD_SECONDS = 5.0     # 프로파일/관측값이 없는 명령의 예상 시간
+ETA_MAX_SAMPLE_SECONDS = 120.0    # 이보다 긴 관측값은 수동 개입 등으로 보고 제외
+ETA_PUSH_MIN_CHANGE_SECONDS = 2.0 # DID로 보낼 ETA가 이 이상 바뀌었을 때만 전송
+# 레시피 시간(params.time)에 비례하는 장비 동작 (나머지는 고정 시간으로 학습)
+ETA_TIMED_ACTIONS = ('sleep', 'ice_wait', 'coffee_wait', 'hot_water', 'syrup', 'sparkling')
+
 try:
     with open(os.path.join(CONFIG_DIR, 'config.json'), 'r', encoding='utf-8') as f:
         config_data = json.load(f)
         SIMULATION_MODE = config_data.get('simulation_mode', False)
         COFFEE_BRAND = config_data.get('coffee_machine', {}).get('brand', '')
         PICKUP_MODE = config_data.get('pickup_mode', 'rotate')
+        ROBOT_CONFIG = config_data.get('robot', {})
+        PICKUP_SLOTS = int(next(iter(config_data.get('zones', {}).values()), {}).get('capacity', PICKUP_SLOTS))
         print(f"[Config] Simulation Mode: {SIMULATION_MODE}")
         print(f"[Config] Coffee Brand: {COFFEE_BRAND}")
         print(f"[Config] Pickup Mode: {PICKUP_MODE}")
@@ -126,6 +155,27 @@ CMD_DESC = {
     CMD_BREATHING:   "BREATHING (대기)"
 }
 
+# --- 다중 로봇: 명령별 스테이션 (공유 스테이션은 한 번에 한 로봇만 사용) ---
+# HOME 등 스테이션이 없는 명령은 로봇 고유 동작으로 취급
+CMD_STATION = {
+    CMD_CUP_MOVE: 'cup',
+    CMD_WI_MOVE: 'ice', CMD_WI_DONE: 'ice',
+    CMD_COFFEE_MOVE: 'coffee', CMD_COFFEE_DONE: 'coffee', CMD_COFFEE_PLACE: 'coffee', CMD_COFFEE_PICK: 'coffee',
+    CMD_HOT_MOVE: 'hot', CMD_HOT_DONE: 'hot',
+    CMD_PICKUP_MOVE: 'pickup', CMD_PICKUP_PLACE: 'pickup',
+    CMD_SYRUP_MOVE: 'syrup', CMD_SYRUP_DONE: 'syrup',
+}
+ALL_STATIONS = ('cup', 'ice', 'hot', 'coffee', 'syrup', 'pickup', 'handover')
+
+# 로봇 간 컵 전달 (config.json robot.handover: {"place_cmd": .., "pick_cmd": ..}) - 한 로봇이 모든 스테이션에 닿지 않을 때만 사용
+HANDOVER_CONFIG = ROBOT_CONFIG.get('handover', {})
+CMD_HANDOVER_PLACE = HANDOVER_CONFIG.get('place_cmd', 0)
+CMD_HANDOVER_PICK = HANDOVER_CONFIG.get('pick_cmd', 0)
+if CMD_HANDOVER_PLACE and CMD_HANDOVER_PICK:
+    CMD_STATION[CMD_HANDOVER_PLACE] = CMD_STATION[CMD_HANDOVER_PICK] = 'handover'
+    CMD_DESC[CMD_HANDOVER_PLACE] = "전달대 컵 내려놓기"
+    CMD_DESC[CMD_HANDOVER_PICK] = "전달대 컵 집기"
+
 # System Modes (무인 모드만 사용)
 MODE_MANUAL   = 0
 MODE_AUTO     = 1
@@ -200,7 +250,8 @@ class RobotInterface:
 
     def get_status(self) -> Optional[Dict]:
         try:
-            res = requests.get(f"{self.base_url}/status/{self.robot_id}", timeout=10)
+            # robot_service가 스냅샷으로 즉시 응답하므로 짧은 타임아웃
+            res = requests.get(f"{self.base_url}/status/{self.robot_id}", timeout=3)
             if res.status_code == 200:
                 return res.json()
         except:
@@ -252,43 +303,119 @@ class RobotInterface:
         return False
 
 
+class RobotLane:
+    """스케줄러가 관리하는 로봇 1대 (접근 가능한 스테이션, 실행 상태, Atomic Sequence 체인)"""
+    def __init__(self, robot_id: str, config: Dict):
+        self.robot_id = robot_id
+        self.name = config.get('name', robot_id)
+        self.robot = RobotInterface(robot_id)
+        stations = config.get('stations')
+        self.stations = set(stations) if stations else set(ALL_STATIONS)
+        self.busy = False
+        self.chained_task = None  # Atomic Sequence: 다음에 반드시 실행할 태스크
+        self.current_task = None
+
+    def can_reach(self, task) -> bool:
+        station = CMD_STATION.get(task.cmd_code)
+        return station is None or station in self.stations
+
+    def status(self) -> Dict:
+        return {
+            'name': self.name,
+            'busy': self.busy,
+            'current_task': self.current_task.task_id if self.current_task else None,
+            'chained_task': self.chained_task,
+            'stations': sorted(self.stations)
+        }
+
+
 class DeviceInterface:
     def __init__(self):
         self.base_url = DEVICE_SERVICE_URL
 
-    def make_coffee(self, product_id, duration):
-        """커피 추출 명령 전송 (응답 대기 없음)"""
-        def _send():
-            try:
-                requests.get(f"{self.base_url}/coffee/{product_id}/{duration}", timeout=180)
-            except Exception as e:
-                print(f"[Device] Coffee Error: {e}")
-        threading.Thread(target=_send, daemon=True).start()
-        print(f"[Device] Coffee command sent: product_id={product_id}, duration={duration}")
-        return True
+    def submit_job(self, path, params=None):
+        """device_service 작업 큐에 명령 등록 (즉시 반환). 반환: job_id 또는 None"""
+        try:
+            res = requests.post(f"{self.base_url}/jobs/{path}", params=params, timeout=5)
+            if res.status_code == 202:
+                return res.json().get('id')
+            print(f"[Device] Job rejected ({path}): {res.status_code} {res.text}")
+        except Exception as e:
+            print(f"[Device] Job Submit Error ({path}): {e}")
+        return None
+
+    def get_job(self, job_id):
+        """작업 상태 조회"""
+        try:
+            res = requests.get(f"{self.base_url}/job/{job_id}", timeout=5)
+            if res.status_code == 200:
+                return res.json()
+        except Exception as e:
+            print(f"[Device] Job Status Error: {e}")
+        return None
 
-    def make_coffee_async(self, product_id, duration):
+    def wait_job(self, job_id, timeout):
+        """작업 완료까지 최대 timeout초 대기 후 작업 상태 반환"""
+        try:
+            res = requests.get(f"{self.base_url}/job/{job_id}/wait/{timeout:.1f}", timeout=timeout + 5.0)
+            if res.status_code == 200:
+                return res.json()
+        except Exception as e:
+            print(f"[Device] Job Wait Error: {e}")
+        return None
+
+    def make_coffee(self, product_id, duration, ref=None):
+        """커피 추출 작업 등록 (응답 대기 없음). ref로 wait_coffee_done에서 완료를 기다릴 수 있음"""
+        job_id = self.submit_job(f"coffee/{product_id}/{duration}", {'ref': ref} if ref else None)
+        print(f"[Device] Coffee job submitted: product_id={product_id}, duration={duration}, ref={ref}, job={job_id}")
+        return job_id is not None
+
+    def make_coffee_async(self, product_id, duration, ref=None):
         """비동기 커피 추출 시작 (병렬 처리용) - make_coffee와 동일"""
-        self.make_coffee(product_id, duration)
+        self.make_coffee(product_id, duration, ref)
+
+    def wait_coffee_done(self, ref, timeout):
+        """
+        커피머신의 추출 완료 이벤트를 최대 timeout초 대기.
+        반환: 'finished' | 'failed' | 'pending'(타임아웃) | 'unsupported' | None(통신 실패)
+        """
+        try:
+            res = requests.get(f"{self.base_url}/coffee/waitDone/{ref}/{timeout:.1f}", timeout=timeout + 5.0)
+            if res.status_code == 200:
+                return res.json().get('state')
+        except Exception as e:
+            print(f"[Device] Coffee Wait Error: {e}")
+        return None
 
     def execute_rinse(self):
-        """린스 명령 전송 (응답 대기 없음)"""
-        def _send():
-            try:
-                requests.get(f"{self.base_url}/coffee/rinse", timeout=60)
-            except Exception as e:
-                print(f"[Device] Rinse Error: {e}")
-        threading.Thread(target=_send, daemon=True).start()
-        print("[Device] Rinse command sent")
-        return True
+        """린스 작업 등록 (응답 대기 없음)"""
+        job_id = self.submit_job("coffee/rinse")
+        print(f"[Device] Rinse job submitted: job={job_id}")
+        return job_id is not None
 
     def dispense_ice_water(self, ice_time, water_time):
+        """
+        제빙기 토출 시작 (명령 전송까지만 대기).
+        반환: 작업 정보(dict, id/estimated_done_at 포함) 또는 None(실패)
+        """
+        job_id = self.submit_job(f"waterice/{ice_time}/{water_time}")
+        if not job_id:
+            return None
+        job = self.wait_job(job_id, 30.0)
+        if not job or job.get('status') != 'done':
+            print(f"[Device] Ice/Water Error: {job.get('result') if job else 'no response'}")
+            return None
+        return job
+
+    def wait_ice_done(self, job_id, timeout):
+        """제빙기 토출 구간 종료까지 최대 timeout초 대기. 반환: True(종료) / False(미종료) / None(통신 실패)"""
         try:
-            res = requests.get(f"{self.base_url}/waterice/{ice_time}/{water_time}", timeout=180)
-            return res.status_code == 200
+            res = requests.get(f"{self.base_url}/ice/waitDone/{job_id}/{timeout:.1f}", timeout=timeout + 5.0)
+            if res.status_code == 200:
+                return bool(res.json().get('dispense_done'))
         except Exception as e:
-            print(f"[Device] Ice/Water Error: {e}")
-            return False
+            print(f"[Device] Ice Wait Error: {e}")
+        return None
 
     def dispense_syrup(self, code, duration):
         try:
@@ -317,10 +444,11 @@ class DeviceInterface:
     def stop_all_devices(self):
         """Emergency Stop for Devices"""
         try:
-            requests.get(f"{self.base_url}/stopAll", timeout=10)
-            print("[Device] Sent STOP ALL command")
-        except:
-            pass
+            res = requests.get(f"{self.base_url}/stopAll", timeout=10)
+            cancelled = res.json().get('cancelled', []) if res.status_code == 200 else []
+            print(f"[Device] Sent STOP ALL command (cancelled {len(cancelled)} queued job(s))")
+        except Exception as e:
+            print(f"[Device] STOP ALL Error: {e}")
 
 
 # ---------------------------------------------------------
@@ -361,33 +489,226 @@ class Task:
         
         # Pickup slot management
         self.assigned_slot = 0
+        self.pickup_place_task = None  # CMD_PICKUP_MOVE: 슬롯을 미리 예약해 줄 서빙(120) 태스크
+        self.slot_token = None         # pickup_service 예약 토큰
+        self.slot_prefetch_thread = None       # 선예약 스레드 (서빙 시작 시 종료까지 대기)
+        self.slot_prefetch_cancelled = False   # 서빙 시작/취소/비상 정지 → 선예약 결과를 쓰지 않음
         
         # 병렬 처리 관련
         self.parallel_check_point = False  # 커피 메뉴에서 병렬 처리 기회 확인 지점
         self.is_coffee_wait = False  # 커피 추출 대기 태스크
 
+        # 다중 로봇: 지정 로봇 (None이면 주문을 잡은 로봇 또는 빈 로봇)
+        self.robot_id = None
+
+        # ETA 계산용
+        self.started_at = 0
+
+
+class MotionTimeModel:
+    """
+    명령별 로봇 동작 시간 / 장비 동작 시간 온라인 모델 (EWMA)
+    - 로봇 명령: TSK|STR 부터 post 장비 동작 시작(없으면 END)까지. motion_profile.json 으로 초기값 설정
+    - 장비 동작: 레시피 시간이 있으면 (실제/레시피) 비율, 없으면 실제 시간(초)
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cmd_times = {}       # cmd -> 예상 동작 시간(초)
+        self.device_ratios = {}   # 장비 동작 종류 -> 실제/레시피 시간 비율
+        self.device_times = {}    # 장비 동작 종류 -> 예상 시간(초, 레시피 시간이 없는 동작)
+        self.samples = {}         # 'cmd:110' / 'dev:syrup' -> 관측 횟수
+        self.load_profile()
+
+    def load_profile(self):
+        try:
+            with open(MOTION_PROFILE_PATH, 'r', encoding='utf-8') as f:
+                commands = json.load(f).get('commands', {})
+            for cmd, stat in commands.items():
+                # 평균은 수동 개입 등 이상치 영향이 커서 중앙값 사용
+                self.cmd_times[int(cmd)] = float(stat.get('p50', stat.get('mean', ETA_DEFAULT_CMD_SECONDS)))
+            print(f"[ETA] Loaded motion profile: {len(self.cmd_times)} commands")
+        except Exception as e:
+            print(f"[ETA] Motion profile not loaded ({e}). Using {ETA_DEFAULT_CMD_SECONDS}s per command")
+
+    def _ewma(self, table, key, value):
+        old = table.get(key)
+        table[key] = value if old is None else old + ETA_EWMA_ALPHA * (value - old)
+
+    def observe_cmd(self, cmd, seconds):
+        if seconds <= 0 or seconds > ETA_MAX_SAMPLE_SECONDS:
+            return
+        with self.lock:
+            self._ewma(self.cmd_times, cmd, seconds)
+            self.samples[f"cmd:{cmd}"] = self.samples.get(f"cmd:{cmd}", 0) + 1
+
+    def observe_device(self, kind, planned, seconds):
+        if seconds < 0 or seconds > ETA_MAX_SAMPLE_SECONDS:
+            return
+        with self.lock:
+            if planned and planned > 0:
+                self._ewma(self.device_ratios, kind, seconds / planned)
+            else:
+                self._ewma(self.device_times, kind, seconds)
+            self.samples[f"dev:{kind}"] = self.samples.get(f"dev:{kind}", 0) + 1
+
+    def cmd_time(self, cmd):
+        return self.cmd_times.get(cmd, ETA_DEFAULT_CMD_SECONDS)
+
+    def device_time(self, kind, planned=0):
+        if planned and planned > 0:
+            return planned * self.device_ratios.get(kind, 1.0)
+        return self.device_times.get(kind, 0.0)
+
+    def _action_time(self, action):
+        if not action:
+            return 0.0
+        act_type = action.get('type')
+        planned = action.get('params', {}).get('time', 0) if act_type in ETA_TIMED_ACTIONS else 0
+        return self.device_time(act_type, float(planned or 0))
+
+    def task_time(self, task):
+        """태스크 1개의 예상 로봇 점유 시간 (pre 동작 + 명령 + post 동작)"""
+        return self.step_time(task.cmd_code, task.pre_device_action, task.post_device_action)
+
+    def step_time(self, cmd, pre_action=None, post_action=None):
+        return self._action_time(pre_action) + self.cmd_time(cmd) + self._action_time(post_action)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'cmd_times': {str(k): round(v, 2) for k, v in sorted(self.cmd_times.items())},
+                'device_ratios': {k: round(v, 3) for k, v in self.device_ratios.items()},
+                'device_times': {k: round(v, 2) for k, v in self.device_times.items()},
+                'samples': dict(self.samples)
+            }
+
+
+class PlanStep(NamedTuple):
+    """플랜 템플릿의 한 단계 (의존/체인은 단계 index, -1: 없음)"""
+    cmd_code: int
+    params: tuple                 # ((레지스터, 값), ...)
+    deps: tuple                   # 선행 단계 index
+    chained: int                  # 이어서 바로 실행할 단계 (Atomic Sequence)
+    pre_action: Optional[dict]    # 템플릿 공유 (읽기 전용)
+    post_action: Optional[dict]
+    ref_step: int                 # 커피 ref를 만드는 기준 단계 (주문마다 order_uuid-task_id)
+    skippable: bool
+    parallel_check_point: bool
+    is_coffee_wait: bool
+    notify_pickup: bool
+    pickup_place: int             # CMD_PICKUP_MOVE: 선예약 대상 서빙 단계
+
+
+class PlanTemplate:
+    """
+    레시피 1개를 컴파일한 태스크 그래프. 레시피 버전이 바뀌면 다시 컴파일합니다.
+    주문마다 instantiate()로 Task 목록을 만듭니다. (단계 구성/의존성/장비 동작은 공유)
+    """
+    def __init__(self, menu_code, version, steps):
+        self.menu_code = menu_code
+        self.version = version
+        self.steps = steps
+
+    @classmethod
+    def compile(cls, recipe, version, tasks: List[Task]) -> 'PlanTemplate':
+        index = {t.task_id: i for i, t in enumerate(tasks)}
+
+        def ref_step(t):
+            for action in (t.pre_device_action, t.post_device_action):
+                ref = (action or {}).get('params', {}).get('ref')
+                if ref:
+                    return index[ref.rsplit('-', 1)[-1]]
+            return -1
+
+        steps = tuple(PlanStep(
+            cmd_code=t.cmd_code,
+            params=tuple(t.params.items()),
+            deps=tuple(index[d] for d in t.dependencies),
+            chained=index.get(t.chained_next_task_id, -1),
+            pre_action=t.pre_device_action,
+            post_action=t.post_device_action,
+            ref_step=ref_step(t),
+            skippable=t.skippable,
+            parallel_check_point=t.parallel_check_point,
+            is_coffee_wait=t.is_coffee_wait,
+            notify_pickup=t.notify_pickup is not None,
+            pickup_place=index[t.pickup_place_task.task_id] if t.pickup_place_task else -1,
+        ) for t in tasks)
+        return cls(recipe.get('menu_code'), version, steps)
+
+    def instantiate(self, new_id, order: Dict, order_uuid: str) -> List[Task]:
+        ids = [new_id() for _ in self.steps]
+        tasks = []
+        for i, st in enumerate(self.steps):
+            t = Task(ids[i], st.cmd_code, dict(st.params), dependencies=[ids[d] for d in st.deps],
+                     order_uuid=order_uuid, skippable=st.skippable)
+            t.pre_device_action = self._bind(st.pre_action, st.ref_step, ids, order_uuid)
+            t.post_device_action = self._bind(st.post_action, st.ref_step, ids, order_uuid)
+            t.parallel_check_point = st.parallel_check_point
+            t.is_coffee_wait = st.is_coffee_wait
+            if st.chained >= 0:
+                t.chained_next_task_id = ids[st.chained]
+            if st.notify_pickup:
+                t.notify_pickup = {'zone': 1, 'order_no': order.get('order_no', 0), 'menu_code': self.menu_code}
+            tasks.append(t)
+        for i, st in enumerate(self.steps):
+            if st.pickup_place >= 0:
+                tasks[i].pickup_place_task = tasks[st.pickup_place]
+        return tasks
+
+    @staticmethod
+    def _bind(action, ref_step, ids, order_uuid):
+        """커피 ref가 있는 동작만 주문별로 복사, 나머지는 템플릿 dict 공유"""
+        if not action or 'ref' not in action.get('params', {}):
+            return action
+        return {'type': action['type'], 'params': dict(action['params'], ref=f"{order_uuid}-{ids[ref_step]}")}
+
+    def duration(self, model: 'MotionTimeModel') -> float:
+        """임계 경로 예상 시간 (단계별 예상 시간, 건너뛸 수 있는 마지막 HOME 제외)"""
+        finish = []
+        for st in self.steps:
+            start = max((finish[d] for d in st.deps), default=0.0)
+            finish.append(start + (0.0 if st.skippable else model.step_time(st.cmd_code, st.pre_action, st.post_action)))
+        return max(finish, default=0.0)
+
 
 class TaskPlanner:
     """단일 로봇용 태스크 플래너"""
     def __init__(self):
         self.task_counter = 0
         self.recipes = {}
+        self.templates = {}      # menu_code -> PlanTemplate (레시피 교체 시 비움)
+        self.template_lock = threading.Lock()
+        self.recipe_client = RecipeClient(lambda recipes, version: self._apply_recipes(recipes), 'Planner')
         self.load_recipes()
+        self.recipe_client.watch()
+
+    @property
+    def recipe_version(self):
+        """recipe_service 버전 (0: 파일에서 로드)"""
+        return self.recipe_client.version
 
     def load_recipes(self):
+        """recipe_service에서 로드 (응답이 없으면 recipe.json)"""
+        if self.recipe_client.sync():
+            return
         try:
             with open(RECIPE_PATH, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                if isinstance(data, list):
-                    self.recipes = {item['menu_code']: item for item in data}
-                else:
-                    self.recipes = data
-            print(f"[Planner] Loaded {len(self.recipes)} recipes.")
+                self._apply_recipes(json.load(f))
+        except Exception as e:
+            print(f"[Planner] Failed to load recipes: {e}")
+
+    def _apply_recipes(self, data):
+        try:
+            if isinstance(data, list):
+                recipes = {item['menu_code']: item for item in data}
+            else:
+                recipes = data
             
             # Simulation: Override Durations
             if SIMULATION_MODE:
                 print("[Planner] Simulation Mode: Overriding recipe durations to 1.5s")
-                for code, r in self.recipes.items():
+                for code, r in recipes.items():
                     r['water_ext_time'] = 1.5 if r.get('water_ext_time', 0) > 0 else 0
                     r['ice_ext_time'] = 1.5 if r.get('ice_ext_time', 0) > 0 else 0
                     r['hotwater_ext_time'] = 1.5 if r.get('hotwater_ext_time', 0) > 0 else 0
@@ -399,6 +720,10 @@ class TaskPlanner:
                              if isinstance(s, dict) and 'time' in s:
                                  s['time'] = 1.5
 
+            with self.template_lock:
+                self.recipes = recipes  # 통째로 교체 (조회 중인 스레드는 이전 dict를 그대로 사용)
+                self.templates = {}
+            print(f"[Planner] Loaded {len(self.recipes)} recipes.")
         except Exception as e:
             print(f"[Planner] Failed to load recipes: {e}")
 
@@ -406,6 +731,27 @@ class TaskPlanner:
         self.task_counter += 1
         return f"T{self.task_counter}"
 
+    def get_template(self, menu_code: int) -> Optional[PlanTemplate]:
+        """메뉴의 플랜 템플릿 (없으면 현재 레시피로 컴파일)"""
+        template = self.templates.get(menu_code)
+        if template:
+            return template
+        with self.template_lock:
+            recipe = self.recipes.get(menu_code)
+            if not recipe:
+                return None
+            ids = itertools.count(1)
+            tasks = self._plan_order_unified(recipe, None, {}, None, new_id=lambda: f"S{next(ids)}")
+            template = PlanTemplate.compile(recipe, self.recipe_version, tasks)
+            self.templates[menu_code] = template
+        print(f"[Planner] Compiled plan template for menu {menu_code}: {len(template.steps)} steps (recipe v{template.version})")
+        return template
+
+    def menu_time(self, menu_code: int, model: 'MotionTimeModel') -> Optional[float]:
+        """메뉴 1잔의 예상 제조 시간 (템플릿 임계 경로)"""
+        template = self.get_template(menu_code)
+        return template.duration(model) if template else None
+
     def get_recipe(self, menu_code: int) -> Optional[Dict]:
         return self.recipes.get(menu_code)
 
@@ -439,8 +785,11 @@ class TaskPlanner:
             print("[Planner] Manual Mode - Skipping planning")
             return []
             
-        # 통합 플래닝 - recipe 값 기반으로 동적 생성
-        tasks = self._plan_order_unified(recipe, order_type, order, order_uuid)
+        # 메뉴별 플랜 템플릿에서 태스크 생성 (레시피 기반 그래프는 메뉴당 1회 컴파일)
+        template = self.get_template(menu_code)
+        if not template:
+            return []
+        tasks = template.instantiate(self._new_id, order, order_uuid)
 
         # Inject Meta Info
         for t in tasks:
@@ -449,28 +798,31 @@ class TaskPlanner:
 
         return tasks
 
-    def _plan_serve_sequence(self, tasks, order_type, last_task_id, order, recipe, order_uuid):
+    def _plan_serve_sequence(self, tasks, order_type, last_task_id, order, recipe, order_uuid, new_id=None):
         """서빙 시퀀스 (Move -> Place -> Notify -> Home) - 픽업대 1개"""
+        new_id = new_id or self._new_id
         # Move Task
-        t_move = Task(self._new_id(), CMD_PICKUP_MOVE, {}, dependencies=[last_task_id], order_uuid=order_uuid)
+        t_move = Task(new_id(), CMD_PICKUP_MOVE, {}, dependencies=[last_task_id], order_uuid=order_uuid)
         tasks.append(t_move)
         
         # Place Task
-        t_serve = Task(self._new_id(), CMD_PICKUP_PLACE, {}, dependencies=[t_move.task_id], order_uuid=order_uuid)
+        t_serve = Task(new_id(), CMD_PICKUP_PLACE, {}, dependencies=[t_move.task_id], order_uuid=order_uuid)
         t_move.chained_next_task_id = t_serve.task_id
         t_serve.notify_pickup = {'zone': 1, 'order_no': order.get('order_no', 0), 'menu_code': recipe.get('menu_code', 0)}
+        t_move.pickup_place_task = t_serve
         tasks.append(t_serve)
         
         # Home (Optional)
-        t_home = Task(self._new_id(), CMD_HOME, {}, dependencies=[t_serve.task_id], order_uuid=order_uuid, skippable=True)
+        t_home = Task(new_id(), CMD_HOME, {}, dependencies=[t_serve.task_id], order_uuid=order_uuid, skippable=True)
         tasks.append(t_home)
         
         return t_home.task_id
 
-    def _plan_syrup_sequence(self, tasks, recipe, prev_task_id, order_uuid=None):
+    def _plan_syrup_sequence(self, tasks, recipe, prev_task_id, order_uuid=None, new_id=None):
         """시럽 스테이션 시퀀스 (121→122)
         시럽이 여러 개인 경우 순차 처리
         """
+        new_id = new_id or self._new_id
         syrups = recipe.get('syrups', [])
         
         if not syrups:
@@ -484,13 +836,13 @@ class TaskPlanner:
             syrup_time = syrup.get('time', 3)
             
             # 시럽 스테이션 이동 (121)
-            t_move = Task(self._new_id(), CMD_SYRUP_MOVE, {REG_SYRUP_IDX: syrup_id}, 
+            t_move = Task(new_id(), CMD_SYRUP_MOVE, {REG_SYRUP_IDX: syrup_id}, 
                          dependencies=[last_task_id], order_uuid=order_uuid)
             t_move.post_device_action = {'type': 'syrup', 'params': {'code': syrup_id, 'time': syrup_time}}
             tasks.append(t_move)
             
             # 시럽 완료 (122)
-            t_done = Task(self._new_id(), CMD_SYRUP_DONE, {}, 
+            t_done = Task(new_id(), CMD_SYRUP_DONE, {}, 
                          dependencies=[t_move.task_id], order_uuid=order_uuid)
             t_move.chained_next_task_id = t_done.task_id
             tasks.append(t_done)
@@ -501,15 +853,17 @@ class TaskPlanner:
     # =========================================================
     # 통합 플래닝 (recipe 값 기반 동적 생성)
     # =========================================================
-    def _plan_order_unified(self, recipe, order_type, order, order_uuid):
+    def _plan_order_unified(self, recipe, order_type, order, order_uuid, new_id=None):
         """통합 플래닝 - recipe 값에 따라 필요한 단계만 동적으로 생성
+        (get_template 에서 메뉴당 1회 호출되어 PlanTemplate 으로 컴파일됨)
         
         순서: 컵 → 제빙기(필요시) → 온수기(필요시) → 커피머신(필요시, 병렬체크) → 시럽(필요시) → 서빙
         """
+        new_id = new_id or self._new_id
         tasks = []
         
         # ===== 1. 컵 배출 (무조건) =====
-        t_cup = Task(self._new_id(), CMD_CUP_MOVE, {REG_CUP_IDX: recipe['cup_num']}, order_uuid=order_uuid)
+        t_cup = Task(new_id(), CMD_CUP_MOVE, {REG_CUP_IDX: recipe['cup_num']}, order_uuid=order_uuid)
         tasks.append(t_cup)
         last_task_id = t_cup.task_id
         
@@ -519,7 +873,7 @@ class TaskPlanner:
         sparkling_time = recipe.get('sparkling_ext_time', 0)
         
         if ice_time > 0 or water_time > 0 or sparkling_time > 0:
-            t_wi_move = Task(self._new_id(), CMD_WI_MOVE, {}, dependencies=[last_task_id], order_uuid=order_uuid)
+            t_wi_move = Task(new_id(), CMD_WI_MOVE, {}, dependencies=[last_task_id], order_uuid=order_uuid)
             t_wi_move.post_device_action = {
                 'type': 'ice_water_sparkling',
                 'params': {'ice': ice_time, 'water': water_time, 'sparkling': sparkling_time}
@@ -529,8 +883,9 @@ class TaskPlanner:
             # 얼음/물/탄산수 중 가장 큰 시간만큼 대기
             max_wait_time = max(ice_time, water_time, sparkling_time)
             
-            t_wi_done = Task(self._new_id(), CMD_WI_DONE, {}, dependencies=[t_wi_move.task_id], order_uuid=order_uuid)
-            t_wi_done.pre_device_action = {'type': 'sleep', 'params': {'time': max_wait_time}}  # CMD 112 전에 대기
+            t_wi_done = Task(new_id(), CMD_WI_DONE, {}, dependencies=[t_wi_move.task_id], order_uuid=order_uuid)
+            # CMD 112 전에 토출 종료 대기 (제빙기 예상 종료 시각 기준, 레시피 시간은 예상값이 없을 때 사용)
+            t_wi_done.pre_device_action = {'type': 'ice_wait', 'params': {'time': max_wait_time}}
             t_wi_move.chained_next_task_id = t_wi_done.task_id
             tasks.append(t_wi_done)
             last_task_id = t_wi_done.task_id
@@ -539,11 +894,11 @@ class TaskPlanner:
         hot_time = recipe.get('hotwater_ext_time', 0)
         
         if hot_time > 0:
-            t_hot_move = Task(self._new_id(), CMD_HOT_MOVE, {}, dependencies=[last_task_id], order_uuid=order_uuid)
+            t_hot_move = Task(new_id(), CMD_HOT_MOVE, {}, dependencies=[last_task_id], order_uuid=order_uuid)
             t_hot_move.post_device_action = {'type': 'hot_water', 'params': {'time': hot_time}}  # 버튼 누름
             tasks.append(t_hot_move)
             
-            t_hot_done = Task(self._new_id(), CMD_HOT_DONE, {}, dependencies=[t_hot_move.task_id], order_uuid=order_uuid)
+            t_hot_done = Task(new_id(), CMD_HOT_DONE, {}, dependencies=[t_hot_move.task_id], order_uuid=order_uuid)
             t_hot_done.pre_device_action = {'type': 'sleep', 'params': {'time': hot_time}}  # CMD 118 전에 대기
             t_hot_move.chained_next_task_id = t_hot_done.task_id
             tasks.append(t_hot_done)
@@ -555,12 +910,14 @@ class TaskPlanner:
         if coffee_time > 0:
             coffee_product_id = recipe.get('coffee_product_id', 1)
             
-            t_coffee_move = Task(self._new_id(), CMD_COFFEE_MOVE, {}, dependencies=[last_task_id], order_uuid=order_uuid)
+            t_coffee_move = Task(new_id(), CMD_COFFEE_MOVE, {}, dependencies=[last_task_id], order_uuid=order_uuid)
             t_coffee_move.parallel_check_point = True
             
             # product_id == 1 (블랙 커피): 미리 그라인딩 시작 (pre_device_action)
             # product_id != 1 (우유 메뉴): 도착 후 추출 (post_device_action)
-            coffee_action = {'type': 'coffee', 'params': {'id': coffee_product_id, 'time': 0.5}}
+            # ref: 추출 완료 이벤트를 기다릴 때 사용하는 사이클 식별자
+            coffee_ref = f"{order_uuid}-{t_coffee_move.task_id}"
+            coffee_action = {'type': 'coffee', 'params': {'id': coffee_product_id, 'time': 0.5, 'ref': coffee_ref}}
             if coffee_product_id == 1:
                 t_coffee_move.pre_device_action = coffee_action
             else:
@@ -568,42 +925,46 @@ class TaskPlanner:
             
             tasks.append(t_coffee_move)
             
-            t_coffee_done = Task(self._new_id(), CMD_COFFEE_DONE, {}, dependencies=[t_coffee_move.task_id], order_uuid=order_uuid)
+            t_coffee_done = Task(new_id(), CMD_COFFEE_DONE, {}, dependencies=[t_coffee_move.task_id], order_uuid=order_uuid)
             t_coffee_done.is_coffee_wait = True
-            t_coffee_done.pre_device_action = {'type': 'sleep', 'params': {'time': coffee_time}}  # CMD 114 보내기 전에 대기
+            # CMD 114 보내기 전에 추출 완료 이벤트 대기 (레시피 시간은 최대 대기 시간)
+            t_coffee_done.pre_device_action = {'type': 'coffee_wait', 'params': {'time': coffee_time, 'ref': coffee_ref}}
             t_coffee_done.post_device_action = {'type': 'rinse'}  # CMD 114 완료 후 린스 강제 실행
             t_coffee_move.chained_next_task_id = t_coffee_done.task_id
             tasks.append(t_coffee_done)
             last_task_id = t_coffee_done.task_id
         
         # ===== 5. 시럽 스테이션 (시럽 필요시) - 서빙 직전 마지막 =====
-        last_task_id = self._plan_syrup_sequence(tasks, recipe, last_task_id, order_uuid)
+        last_task_id = self._plan_syrup_sequence(tasks, recipe, last_task_id, order_uuid, new_id)
         
         # ===== 6. 서빙 (무조건) =====
-        self._plan_serve_sequence(tasks, order_type, last_task_id, order, recipe, order_uuid)
+        self._plan_serve_sequence(tasks, order_type, last_task_id, order, recipe, order_uuid, new_id)
         
         return tasks
     
 # ---------------------------------------------------------
-# Scheduler (단일 로봇 + 병렬 처리)
+# Scheduler (로봇 N대 + 단일 로봇 병렬 처리)
 # ---------------------------------------------------------
 
 class TaskScheduler:
     def __init__(self):
         self.tasks: List[Task] = []
-        self.robot = RobotInterface('robot_1')  # 단일 로봇
+        self.lanes: List[RobotLane] = self._load_lanes()
+        self.robot = self.lanes[0].robot  # 기본 로봇 (병렬 처리, 비상 정지)
         self.devices = DeviceInterface()
+
+        # 다중 로봇 조정
+        self.dispatch_lock = threading.Lock()
+        self.station_owner = {}            # 공유 스테이션 -> 사용 중인 robot_id
+        self.order_robot = {}              # order_uuid -> 컵을 들고 있는 robot_id
         
         # 픽업 슬롯 순환 (1→2→3→4→1...)
         self.next_pickup_slot = 1
-        self.max_pickup_slots = 4
+        self.max_pickup_slots = PICKUP_SLOTS
         
         self.running = False
         self.thread = None
         
-        self.robot_busy = False
-        self.robot_chained_task = None  # Atomic Sequence
-        
         # 병렬 처리 상태
         self.parallel_mode = False
         self.parallel_completed = False
@@ -612,6 +973,19 @@ class TaskScheduler:
         self.paused_coffee_order = None    # 일시 중지된 커피 주문 정보 (사본)
         self.coffee_start_time = 0         # 커피 추출 시작 시간
         self.coffee_duration = 0           # 커피 추출 시간
+        self.ice_job = None                # 마지막 제빙기 토출 작업 (id, estimated_done_at)
+
+        # 주문 ETA
+        self.eta_model = MotionTimeModel()
+        self.eta_lock = threading.Lock()
+        self.order_etas = {}               # order_uuid -> {'eta_at', 'position'}
+        self.queue_free_at = 0             # 새 주문을 시작할 수 있는 가장 빠른 예상 시각 (로봇 중 먼저 비는 시각)
+        self.eta_updated_at = 0
+        self.pushed_etas = {}              # DID로 마지막에 보낸 {order_uuid: eta_at}
+
+        # 픽업 용량 (sensor 모드)
+        self.pickup_forecast = None        # pickup_service /getPickupForecast 결과 + fetched_at
+        self.pickup_hold = False           # 픽업대가 가득 차 새 컵 배출을 보류 중
         
         # Coffee Rinse Logic
         self.coffeemachine_used = False
@@ -623,6 +997,25 @@ class TaskScheduler:
         self.order_manager = None
         self.planner = None
         self.session = requests.Session()
+        self.prefetch_lock = threading.Lock()  # 선예약 결과 기록 vs 취소 (slot_prefetch_cancelled)
+
+    def _load_lanes(self) -> List['RobotLane']:
+        """config.json robot 맵의 robot_* 항목마다 레인 생성 (없으면 robot_1 단일 로봇)"""
+        lanes = [RobotLane(key, val) for key, val in sorted(ROBOT_CONFIG.items())
+                 if key.startswith('robot_') and isinstance(val, dict)]
+        if not lanes:
+            lanes = [RobotLane('robot_1', {})]
+
+        if len(lanes) > 1:
+            needed = set(CMD_STATION.values()) - {'handover'}
+            if not any(needed <= lane.stations for lane in lanes) and not (CMD_HANDOVER_PLACE and CMD_HANDOVER_PICK):
+                print("[Scheduler][WARN] No robot reaches every station and robot.handover is not configured")
+        print(f"[Scheduler] Robots: {', '.join(f'{l.robot_id}({len(l.stations)} stations)' for l in lanes)}")
+        return lanes
+
+    @property
+    def robot_busy(self) -> bool:
+        return any(lane.busy for lane in self.lanes)
 
     def set_fail_safe_callback(self, callback):
         self.fail_safe_callback = callback
@@ -679,9 +1072,108 @@ class TaskScheduler:
         self.next_pickup_slot = 1
         print("[Scheduler] Pickup slot counter reset to 1")
 
+    def _reserve_pickup_slot(self, order_no=0):
+        """
+        픽업 슬롯 예약. sensor 모드는 pickup_service 리스 예약, rotate 모드는 순환 할당.
+        반환: (slot, token, seq) - 빈 슬롯이 없으면 slot 0, seq는 픽업대 상태 번호 (변경 대기용)
+        """
+        if PICKUP_MODE != "sensor":
+            return self._get_next_pickup_slot_rotate(), None, None
+        try:
+            res = self.session.get(f"{PICKUP_SERVICE_URL}/reserveSlot/1/{PICKUP_LEASE_SECONDS}",
+                               params={'order_no': order_no}, timeout=2.0)
+            if res.status_code == 200:
+                data = res.json()
+                return data.get('slot', 0), data.get('token'), data.get('seq')
+        except Exception as e:
+            print(f"[Scheduler] Failed to reserve pickup slot: {e}")
+        return 0, None, None
+
+    def _wait_pickup_change(self, seq, timeout=PICKUP_RETRY_SECONDS):
+        """픽업대 슬롯 상태가 바뀔 때까지 대기 (pickup_service 롱폴링, 실패 시 timeout만큼 sleep)"""
+        if seq is not None:
+            try:
+                res = requests.get(f"{PICKUP_SERVICE_URL}/waitSlotChange/{seq}/{timeout}", timeout=timeout + 2.0)
+                if res.status_code == 200:
+                    return res.json().get('seq')
+            except Exception:
+                pass
+        time.sleep(timeout)
+        return None
+
+    def _release_pickup_slot(self, task: Task):
+        """서빙하지 못한 예약 해제"""
+        token, task.slot_token = task.slot_token, None
+        self._release_pickup_token(token)
+
+    def _release_pickup_token(self, token):
+        if not token:
+            return
+        try:
+            self.session.get(f"{PICKUP_SERVICE_URL}/releaseSlot/{token}", timeout=2.0)
+        except Exception as e:
+            print(f"[Scheduler] Failed to release pickup slot: {e}")
+
+    def _cancel_slot_prefetch(self, tasks):
+        """선예약 중단 표시 (이후 선예약 스레드는 결과를 쓰지 않고 받은 예약을 해제)"""
+        with self.prefetch_lock:
+            for t in tasks:
+                t.slot_prefetch_cancelled = True
+
+    def _prefetch_pickup_slot(self, place_task: Task, robot: RobotInterface):
+        """
+        CMD_PICKUP_MOVE 동작 중에 서빙 태스크의 슬롯을 예약하고 REG_PICKUP_IDX에 미리 기록합니다.
+        (120 시작 시에도 params로 다시 기록 - 로봇이 명령 완료 후 인자 레지스터를 초기화하므로)
+        서빙 시작(_acquire_pickup_slot), 주문 취소, 비상 정지로 태스크가 빠지면 결과를 쓰지 않습니다.
+        """
+        def _active():
+            return self.running and not place_task.slot_prefetch_cancelled and place_task in self.tasks
+
+        def _run():
+            while _active():
+                slot, token, seq = self._reserve_pickup_slot(place_task.order_no)
+                if slot > 0:
+                    with self.prefetch_lock:
+                        if not _active():
+                            print(f"[Scheduler] Pickup prefetch cancelled, releasing slot {slot}")
+                            self._release_pickup_token(token)
+                            return
+                        place_task.assigned_slot = slot
+                        place_task.slot_token = token
+                        place_task.params[REG_F_PICK_IDX] = slot
+                    robot.write_register(REG_PICKUP_IDX, slot)
+                    logger.info(f"PCK|RSV|{place_task.task_id}|{slot}")
+                    return
+                print("[Scheduler] Pickup is FULL. Waiting for reservation...")
+                self._wait_pickup_change(seq)
+
+        place_task.slot_prefetch_cancelled = False
+        place_task.slot_prefetch_thread = threading.Thread(target=_run, daemon=True)
+        place_task.slot_prefetch_thread.start()
+
+    def _acquire_pickup_slot(self, task: Task) -> int:
+        """서빙 태스크의 슬롯 확정 (선예약 결과 사용, 없으면 빈 슬롯이 생길 때까지 예약 재시도)"""
+        if task.slot_prefetch_thread:
+            # 선예약 중단 후 스레드 종료까지 대기 (종료 뒤에는 assigned_slot/slot_token을 바꾸지 않음)
+            self._cancel_slot_prefetch([task])
+            task.slot_prefetch_thread.join()
+            task.slot_prefetch_thread = None
+        while task.assigned_slot == 0:
+            slot, token, seq = self._reserve_pickup_slot(task.order_no)
+            if slot > 0:
+                task.assigned_slot, task.slot_token = slot, token
+                break
+            print("[Scheduler] Pickup is FULL. Waiting...")
+            self._wait_pickup_change(seq)
+            if not self.running:
+                return 0
+        task.params[REG_F_PICK_IDX] = task.assigned_slot
+        return task.assigned_slot
+
     def cancel_tasks(self, order_uuid: str):
         """Cancel PENDING tasks for a specific order UUID"""
         original_count = len(self.tasks)
+        self._cancel_slot_prefetch([t for t in self.tasks if t.order_uuid == order_uuid])
         self.tasks = [t for t in self.tasks if t.order_uuid != order_uuid]
         removed_count = original_count - len(self.tasks)
         print(f"[Scheduler] Removed {removed_count} tasks for Order {order_uuid}")
@@ -690,38 +1182,46 @@ class TaskScheduler:
         self.running = True
         self.thread = threading.Thread(target=self._loop, daemon=True)
         self.thread.start()
+        if PICKUP_MODE == "sensor":
+            threading.Thread(target=self._pickup_forecast_loop, daemon=True).start()
         print("[Scheduler] Started")
 
     def stop_all(self):
         """Emergency Stop"""
         print("\[Scheduler] EMERGENCY STOP TRIGGERED")
 
-        # Stop Robot Program using the correct API call
-        try:
-            print("\[Scheduler] Stopping robot program via API...")
-            # 'set_system_mode'에서 사용하는 것과 동일한 API를 호출합니다.
-            requests.get(f"{ROBOT_SERVICE_URL}/command/robot_1/1", timeout=5) # cmd 1 = stop_program
-            logger.info("SYS|ROBOT_PROGRAM_STOP")
-        except Exception as e:
-            logger.error(f"SYS|ROBOT_PROGRAM_STOP_FAIL|{e}")
-            print(f"\[Scheduler] Failed to stop robot program via API: {e}")
+        for lane in self.lanes:
+            # Stop Robot Program using the correct API call
+            try:
+                print(f"\[Scheduler] Stopping robot program via API ({lane.robot_id})...")
+                # 'set_system_mode'에서 사용하는 것과 동일한 API를 호출합니다.
+                requests.get(f"{ROBOT_SERVICE_URL}/command/{lane.robot_id}/1", timeout=5) # cmd 1 = stop_program
+                logger.info("SYS|ROBOT_PROGRAM_STOP")
+            except Exception as e:
+                logger.error(f"SYS|ROBOT_PROGRAM_STOP_FAIL|{e}")
+                print(f"\[Scheduler] Failed to stop robot program via API: {e}")
 
-        # Stop Robot Motion as a secondary safety measure
-        try:
-            print("\[Scheduler] Stopping robot motion via register...")
-            self.robot.write_register(REG_CMD, 6)  # Stop Motion
-        except Exception as e:
-            print(f"\[Scheduler] Failed to stop robot motion: {e}")
+            # Stop Robot Motion as a secondary safety measure
+            try:
+                print(f"\[Scheduler] Stopping robot motion via register ({lane.robot_id})...")
+                lane.robot.write_register(REG_CMD, 6)  # Stop Motion
+            except Exception as e:
+                print(f"\[Scheduler] Failed to stop robot motion: {e}")
             
         # Clear Tasks
+        self._cancel_slot_prefetch(self.tasks)
         self.tasks.clear()
 
         # Stop Devices
         self.devices.stop_all_devices()
 
         # Reset Flags
-        self.robot_busy = False
-        self.robot_chained_task = None
+        for lane in self.lanes:
+            lane.busy = False
+            lane.chained_task = None
+            lane.current_task = None
+        self.station_owner.clear()
+        self.order_robot.clear()
         self.parallel_mode = False
         self.parallel_completed = False
         self.paused_coffee_task = None
@@ -729,8 +1229,276 @@ class TaskScheduler:
         self.paused_coffee_order = None
 
     def add_tasks(self, new_tasks: List[Task]):
+        if len(self.lanes) > 1:
+            new_tasks = self._assign_handover(new_tasks)
         self.tasks.extend(new_tasks)
         print(f"[Scheduler] Added {len(new_tasks)} tasks. Total: {len(self.tasks)}")
+        self.refresh_etas()
+
+    def _assign_handover(self, tasks: List[Task]) -> List[Task]:
+        """
+        다중 로봇: 주문 1건을 한 로봇이 처리할 수 없으면(스테이션 미도달) 구간별로 로봇을 지정하고
+        구간 사이에 전달대 내려놓기/집기 태스크를 넣습니다. 한 로봇으로 충분하면 그대로 둡니다(동적 배정).
+        """
+        needed = {CMD_STATION[t.cmd_code] for t in tasks if t.cmd_code in CMD_STATION}
+        if not tasks or any(needed <= lane.stations for lane in self.lanes):
+            return tasks
+        if not (CMD_HANDOVER_PLACE and CMD_HANDOVER_PICK and self.planner):
+            print(f"[Scheduler][ERR] No robot can serve stations {sorted(needed)} and handover is not configured")
+            return tasks
+
+        def run_length(lane, start):
+            n = 0
+            for t in tasks[start:]:
+                if not lane.can_reach(t):
+                    break
+                n += 1
+            return n
+
+        result = []
+        lane = None
+        for i, t in enumerate(tasks):
+            if lane is None or not lane.can_reach(t):
+                candidates = [l for l in self.lanes if l.can_reach(t) and 'handover' in l.stations]
+                if not candidates:
+                    print(f"[Scheduler][ERR] No robot reaches station for CMD {t.cmd_code}")
+                    return tasks
+                next_lane = max(candidates, key=lambda l: run_length(l, i))
+                if lane is not None:
+                    # 이전 로봇: 전달대에 컵 내려놓기 → 다음 로봇: 전달대에서 컵 집기
+                    t_place = Task(self.planner._new_id(), CMD_HANDOVER_PLACE, {}, dependencies=list(t.dependencies), order_uuid=t.order_uuid)
+                    t_pick = Task(self.planner._new_id(), CMD_HANDOVER_PICK, {}, dependencies=[t_place.task_id], order_uuid=t.order_uuid)
+                    t_place.robot_id, t_pick.robot_id = lane.robot_id, next_lane.robot_id
+                    for h in (t_place, t_pick):
+                        h.menu_name, h.order_no = t.menu_name, t.order_no
+                    t.dependencies = [t_pick.task_id]
+                    result += [t_place, t_pick]
+                    print(f"[Scheduler] Handover {lane.robot_id} -> {next_lane.robot_id} before {t.task_id} (CMD {t.cmd_code})")
+                lane = next_lane
+            t.robot_id = lane.robot_id
+            result.append(t)
+        return result
+
+    def _pick_task(self, lane: RobotLane) -> Optional[Task]:
+        """빈 로봇이 지금 실행할 수 있는 첫 번째 태스크 (체인 / 주문 담당 로봇 / 스테이션 점유 확인)"""
+        other_chains = {l.chained_task for l in self.lanes if l is not lane and l.chained_task}
+        cup_held = False  # 앞 주문의 컵 배출이 보류되면 뒤 주문도 보류 (접수 순서 유지)
+        for task in self.tasks:
+            if task.status != TaskStatus.PENDING:
+                continue
+            if lane.chained_task and task.task_id != lane.chained_task:
+                continue
+            if task.task_id in other_chains:
+                continue
+            if not self._check_dependencies(task):
+                continue
+            owner = task.robot_id or self.order_robot.get(task.order_uuid)
+            if owner and owner != lane.robot_id:
+                continue
+            if not lane.can_reach(task):
+                continue
+            station = CMD_STATION.get(task.cmd_code)
+            if station and self.station_owner.get(station, lane.robot_id) != lane.robot_id:
+                continue
+            if task.cmd_code == CMD_HANDOVER_PLACE and self._handover_occupied():
+                continue
+            if task.cmd_code == CMD_CUP_MOVE:
+                if cup_held or not self._pickup_capacity_ok(task.order_uuid):
+                    cup_held = True
+                    continue
+            return task
+        return None
+
+    def _handover_occupied(self) -> bool:
+        """전달대에 아직 집어 가지 않은 컵이 있는지 (내려놓기는 끝났고 집기는 안 끝난 전달)"""
+        for t in self.tasks:
+            if t.cmd_code == CMD_HANDOVER_PICK and t.status in (TaskStatus.PENDING, TaskStatus.RUNNING) \
+                    and self._check_dependencies(t):
+                return True
+        return False
+
+    # =========================================================
+    # 픽업 용량
+    # =========================================================
+    def _pickup_forecast_loop(self):
+        """예측 조회 후 슬롯 상태 변경(또는 최대 PICKUP_FORECAST_INTERVAL)까지 대기"""
+        while self.running:
+            seq = None
+            try:
+                res = requests.get(f"{PICKUP_SERVICE_URL}/getPickupForecast/1", timeout=1.0)
+                if res.status_code == 200:
+                    self.pickup_forecast = dict(res.json(), fetched_at=time.time())
+                    seq = self.pickup_forecast.get('seq')
+            except:
+                pass
+            self._wait_pickup_change(seq, PICKUP_FORECAST_INTERVAL)
+
+    def _pickup_capacity_ok(self, order_uuid) -> bool:
+        """
+        새 주문의 컵을 배출해도 픽업대에서 막히지 않는지 판단합니다.
+        이 음료가 픽업대에 도착할 예상 시각까지 비어 있거나 비워질 슬롯 수가
+        이미 제조 중인 음료(컵 배출 ~ 서빙 전) 수보다 많아야 합니다.
+        (예측이 없거나 오래되면 보류하지 않음 - 서빙 시 빈 슬롯 대기 로직이 최종 안전장치)
+        """
+        if PICKUP_MODE != "sensor":
+            return True
+        forecast = self.pickup_forecast
+        if not forecast or time.time() - forecast['fetched_at'] > PICKUP_FORECAST_STALE_SECONDS:
+            return True
+
+        started, placing, remaining = set(), set(), 0.0
+        for t in self.tasks:
+            if t.order_uuid == order_uuid:
+                if t.status == TaskStatus.PENDING:
+                    remaining += self.eta_model.task_time(t)
+                continue
+            if t.status != TaskStatus.PENDING:
+                started.add(t.order_uuid)
+            if t.cmd_code == CMD_PICKUP_PLACE and t.status in (TaskStatus.PENDING, TaskStatus.RUNNING):
+                placing.add(t.order_uuid)
+        in_flight = len(started & placing)
+
+        # pickup_service 시계 기준으로 도착 시각 환산
+        arrival = forecast.get('now', forecast['fetched_at']) + (time.time() - forecast['fetched_at']) + remaining
+        capacity = sum(1 for slot in forecast.get('slots', [])
+                       if not slot['occupied'] or (slot['expected_free_at'] is not None and slot['expected_free_at'] <= arrival))
+
+        ok = in_flight < capacity
+        if ok == self.pickup_hold:
+            self.pickup_hold = not ok
+            if self.pickup_hold:
+                logger.info(f"PCK|HOLD|{in_flight}|{capacity}")
+                print(f"[Scheduler] Pickup full (in flight {in_flight}, capacity {capacity}). Holding new cups...")
+                self._on_pickup_hold()
+            else:
+                logger.info(f"PCK|RESUME|{in_flight}|{capacity}")
+            notify_clients('pickup_hold', {'hold': self.pickup_hold})
+        return ok
+
+    def _on_pickup_hold(self):
+        """컵 배출 보류 동안 슬롯이 필요 없는 작업 (오래 쉰 커피머신 린스)"""
+        if time.time() - self.last_coffee_time < PICKUP_HOLD_RINSE_IDLE_SECONDS:
+            return
+        print("[Scheduler] Coffee machine idle during pickup hold. Executing rinse...")
+        self.last_coffee_time = time.time()
+        self.coffeemachine_used = False
+        self.devices.execute_rinse()
+
+    def _release_stations(self, lane: RobotLane):
+        for station, owner in list(self.station_owner.items()):
+            if owner == lane.robot_id:
+                del self.station_owner[station]
+
+    # =========================================================
+    # 주문 ETA
+    # =========================================================
+    def refresh_etas(self):
+        """
+        현재 스케줄 기준으로 대기/처리 중 주문의 예상 완료(서빙) 시각을 다시 계산합니다.
+        실행 중 태스크 → 대기 태스크(목록 순서) → 아직 태스크가 없는 대기 주문(접수 순서) 순으로
+        로봇별 예상 종료 시각에 누적합니다. (지정 로봇 → 주문 담당 로봇 → 가장 먼저 비는 로봇)
+        (병렬 처리 중인 비커피 주문은 레시피 기준 예상 시간으로 근사)
+        """
+        if not self.order_manager:
+            return
+        now = time.time()
+        model = self.eta_model
+        free_at = {lane.robot_id: now for lane in self.lanes}
+        running_lane = {lane.current_task.task_id: lane.robot_id for lane in self.lanes if lane.current_task}
+        holder = dict(self.order_robot)
+        done_at = {}
+
+        def earliest_lane(task=None):
+            lanes = [l for l in self.lanes if task is None or l.can_reach(task)] or self.lanes
+            return min(lanes, key=lambda l: free_at[l.robot_id]).robot_id
+
+        active = [t for t in list(self.tasks) if t.status in (TaskStatus.RUNNING, TaskStatus.PENDING)]
+        active.sort(key=lambda t: t.status != TaskStatus.RUNNING)
+        for i, t in enumerate(active):
+            # HOME은 뒤에 작업이 남아 있으면 건너뜀 (_execute_task_wrapper 와 동일)
+            if t.skippable and i < len(active) - 1:
+                continue
+            robot_id = running_lane.get(t.task_id) or t.robot_id or holder.get(t.order_uuid) or earliest_lane(t)
+            if robot_id not in free_at:
+                robot_id = earliest_lane(t)
+            estimate = model.task_time(t)
+            if t.status == TaskStatus.RUNNING and t.started_at:
+                estimate = max(0.0, estimate - (now - t.started_at))
+            free_at[robot_id] += estimate
+            if t.order_uuid:
+                holder[t.order_uuid] = robot_id
+                if not t.skippable:
+                    done_at[t.order_uuid] = max(done_at.get(t.order_uuid, 0), free_at[robot_id])
+
+        orders = [o for o in list(self.order_manager.active_orders.values())
+                  if o['status'] in (ORDER_WAITING, ORDER_PROCESSING)]
+        orders.sort(key=lambda o: o.get('created_at', 0))
+        for o in orders:
+            if o['uuid'] in done_at:
+                continue
+            menu_seconds = self.planner.menu_time(o.get('menu_code'), model) if self.planner else None
+            robot_id = earliest_lane()
+            free_at[robot_id] += menu_seconds if menu_seconds is not None else ETA_DEFAULT_CMD_SECONDS
+            done_at[o['uuid']] = free_at[robot_id]
+        cursor = min(free_at.values())  # 새 주문을 시작할 수 있는 가장 빠른 시각
+
+        ranked = sorted(done_at.items(), key=lambda item: item[1])
+        with self.eta_lock:
+            self.order_etas = {uuid: {'eta_at': at, 'position': i + 1} for i, (uuid, at) in enumerate(ranked)}
+            self.queue_free_at = cursor
+            self.eta_updated_at = now
+        self._push_did_etas(orders)
+
+    def get_order_etas(self):
+        """order_uuid -> {'eta_at', 'eta_seconds', 'position'} (오래된 계산이면 먼저 갱신)"""
+        if time.time() - self.eta_updated_at > ETA_PUSH_MIN_CHANGE_SECONDS:
+            self.refresh_etas()
+        now = time.time()
+        with self.eta_lock:
+            return {
+                uuid: dict(eta, eta_seconds=round(max(0.0, eta['eta_at'] - now), 1))
+                for uuid, eta in self.order_etas.items()
+            }
+
+    def get_queue_eta(self, menu_code=None):
+        """지금 주문이 들어오면 완료까지 걸릴 예상 시간 (키오스크 접수 제한 판단용)"""
+        if time.time() - self.eta_updated_at > ETA_PUSH_MIN_CHANGE_SECONDS:
+            self.refresh_etas()
+        with self.eta_lock:
+            queue_seconds = max(0.0, self.queue_free_at - time.time())
+            order_count = len(self.order_etas)
+        result = {'queue_seconds': round(queue_seconds, 1), 'active_orders': order_count}
+        if menu_code is not None:
+            menu_seconds = self.planner.menu_time(menu_code, self.eta_model) if self.planner else None
+            if menu_seconds is not None:
+                result['menu_seconds'] = round(menu_seconds, 1)
+                result['eta_seconds'] = round(queue_seconds + menu_seconds, 1)
+        return result
+
+    def _push_did_etas(self, orders):
+        """대기 주문 ETA를 픽업 서비스(DID)에 전송 (주문 구성이 바뀌거나 ETA가 크게 바뀐 경우만)"""
+        with self.eta_lock:
+            etas = {uuid: eta['eta_at'] for uuid, eta in self.order_etas.items()}
+            changed = etas.keys() != self.pushed_etas.keys() or any(
+                abs(at - self.pushed_etas[uuid]) >= ETA_PUSH_MIN_CHANGE_SECONDS for uuid, at in etas.items()
+            )
+            if not changed:
+                return
+            self.pushed_etas = etas
+
+        payload = {'orders': [
+            {'order_no': o.get('order_no', 0), 'menu_code': o.get('menu_code', 0), 'eta_at': round(etas[o['uuid']], 1)}
+            for o in sorted(orders, key=lambda o: etas.get(o['uuid'], 0)) if o['uuid'] in etas
+        ]}
+
+        def _send():
+            try:
+                requests.post(f"{PICKUP_SERVICE_URL}/updateWaitingETA", json=payload, timeout=1.0)
+            except:
+                pass
+
+        threading.Thread(target=_send, daemon=True).start()
+        notify_clients('eta_updated')
 
     def _check_parallel_opportunity(self, current_order_uuid) -> Optional[str]:
         if not self.order_manager or not self.planner:
@@ -751,6 +1519,8 @@ class TaskScheduler:
                 
             menu_code = order.get('menu_code')
             if not self.planner.is_coffee_menu(menu_code):
+                if not self._pickup_capacity_ok(order['uuid']):
+                    return None
                 # 병렬 처리 대상 선택 → 상태 변경 및 기존 태스크 취소
                 order['status'] = ORDER_PROCESSING
                 self.cancel_tasks(order['uuid'])  # OrderManager가 생성한 태스크 취소
@@ -761,19 +1531,25 @@ class TaskScheduler:
         while self.running:
             # 자동 린스 로직 제거 - CMD_COFFEE_DONE(114), CMD_COFFEE_PICK(116) 완료 후에만 린스 실행
             
-            pending_tasks = [t for t in self.tasks if t.status == TaskStatus.PENDING]
-            
-            for task in pending_tasks:
-                if self.robot_chained_task and task.task_id != self.robot_chained_task:
-                    continue
-                
-                if self.robot_busy:
-                    continue
-                if not self._check_dependencies(task):
-                        continue 
-                
-                threading.Thread(target=self._execute_task_wrapper, args=(task,)).start()
-                break 
+            with self.dispatch_lock:
+                for lane in self.lanes:
+                    if lane.busy:
+                        continue
+                    task = self._pick_task(lane)
+                    if not task:
+                        continue
+
+                    # 다른 로봇이 같은 태스크/스테이션을 잡지 않도록 여기서 점유
+                    lane.busy = True
+                    lane.current_task = task
+                    task.status = TaskStatus.RUNNING
+                    station = CMD_STATION.get(task.cmd_code)
+                    if station:
+                        self.station_owner[station] = lane.robot_id
+                    if task.order_uuid:
+                        self.order_robot[task.order_uuid] = lane.robot_id
+
+                    threading.Thread(target=self._execute_task_wrapper, args=(task, lane)).start()
 
             time.sleep(0.1)
 
@@ -784,12 +1560,12 @@ class TaskScheduler:
                 return False
         return True
 
-    def _execute_task_wrapper(self, task: Task):
-        self.robot_busy = True
+    def _execute_task_wrapper(self, task: Task, lane: RobotLane):
         notify_clients('robot_updated')
         
         try:
             task.status = TaskStatus.RUNNING
+            task.started_at = time.time()
             
             if task.order_uuid and self.status_callback:
                 self.status_callback(task.order_uuid, ORDER_PROCESSING)
@@ -799,30 +1575,33 @@ class TaskScheduler:
                 if self.skip_callback and self.skip_callback():
                     should_skip = True
                 else:
-                    pending_count = len([t for t in self.tasks if t.status == TaskStatus.PENDING])
+                    # 이 로봇이 처리할 수 있는 대기 태스크가 있으면 HOME 생략
+                    pending_count = len([t for t in self.tasks if t.status == TaskStatus.PENDING
+                                         and lane.can_reach(t) and t.robot_id in (None, lane.robot_id)])
                     if pending_count > 0:
                          should_skip = True
 
             if should_skip:
                 print(f"[Scheduler] Skipping task {task.task_id}")
-                self.robot_chained_task = None
+                lane.chained_task = None
             else:
-                self._execute_task(task)
+                self._execute_task(task, lane)
                 
                 if self.parallel_completed:
-                    self.robot_chained_task = None
+                    lane.chained_task = None
                     self.parallel_completed = False
                     print(f"[Scheduler] Parallel mode completed. Chain reset.")
                 elif task.chained_next_task_id:
-                    self.robot_chained_task = task.chained_next_task_id
+                    lane.chained_task = task.chained_next_task_id
                 else:
-                    self.robot_chained_task = None
+                    lane.chained_task = None
             
             task.status = TaskStatus.COMPLETED
             
             if task.order_uuid and self.status_callback:
                 remaining = [t for t in self.tasks if t.order_uuid == task.order_uuid and t.status != TaskStatus.COMPLETED]
                 if not remaining:
+                    self.order_robot.pop(task.order_uuid, None)
                     self.status_callback(task.order_uuid, ORDER_COMPLETED)
             
         except Exception as e:
@@ -830,7 +1609,9 @@ class TaskScheduler:
             print(msg)
             logger.error(msg)
             task.status = TaskStatus.FAILED
-            self.robot_chained_task = None
+            lane.chained_task = None
+            if task.cmd_code == CMD_PICKUP_PLACE:
+                self._release_pickup_slot(task)
             
             if "Cup Dispense Failed" in str(e) or "Timeout" in str(e):
                 print(f"[Scheduler] Critical Error. Initiating Fail Safe...")
@@ -838,11 +1619,18 @@ class TaskScheduler:
                     self.fail_safe_callback()
             
         finally:
-            self.robot_busy = False
+            with self.dispatch_lock:
+                # 체인(이동→완료)이 끝나면 스테이션 반납
+                if not lane.chained_task:
+                    self._release_stations(lane)
+                lane.current_task = None
+                lane.busy = False
             notify_clients('robot_updated')
+            self.refresh_etas()
 
-    def _execute_task(self, task: Task):
-        robot = self.robot
+    def _execute_task(self, task: Task, lane: RobotLane = None):
+        lane = lane or self.lanes[0]
+        robot = lane.robot
         
         # ═══════════════════════════════════════════════════════════════
         # 실행할 명령 코드 결정 (113 vs 115)
@@ -850,7 +1638,8 @@ class TaskScheduler:
         actual_cmd = task.cmd_code  # 기본값: 태스크에 지정된 명령
         parallel_uuid = None
         
-        if task.parallel_check_point and self.order_manager and self.planner:
+        # 병렬 처리(115/116)는 단일 로봇 전용 - 다중 로봇은 다른 로봇이 대기 주문을 처리
+        if task.parallel_check_point and len(self.lanes) == 1 and self.order_manager and self.planner:
             parallel_uuid = self._check_parallel_opportunity(task.order_uuid)
             
             if parallel_uuid:
@@ -875,7 +1664,8 @@ class TaskScheduler:
             action = task.pre_device_action
             
             # 써모플랜 보일러 온도 보상 로직
-            # 커피 대기 태스크이고, 5분 이상 커피머신 미사용 시 추가 대기 시간 적용
+            # 커피 대기 태스크이고, 5분 이상 커피머신 미사용 시 최대 대기 시간을 늘림
+            # (완료 이벤트가 오면 그 전에 끝나므로 실제로 느릴 때만 더 기다림)
             if task.is_coffee_wait and COFFEE_BRAND == "thermoplan":
                 time_since_last = time.time() - self.last_coffee_time
                 if self.last_coffee_time > 0 and time_since_last > IDLE_TIME_THRESHOLD_SECONDS:
@@ -884,9 +1674,9 @@ class TaskScheduler:
                     new_time = original_time + extra_time
                     action = {
                         'type': action.get('type'),
-                        'params': {'time': new_time}
+                        'params': dict(action.get('params', {}), time=new_time)
                     }
-                    print(f"[Thermoplan] Idle time ({time_since_last:.0f}s) exceeded threshold. Adding {extra_time}s to duration. ({original_time}s -> {new_time}s)")
+                    print(f"[Thermoplan] Idle time ({time_since_last:.0f}s) exceeded threshold. Raising wait limit by {extra_time}s. ({original_time}s -> {new_time}s)")
             
             self._execute_device_action(action)
 
@@ -894,29 +1684,19 @@ class TaskScheduler:
         # Pickup Slot Assignment (모드에 따라: sensor 또는 rotate)
         # ═══════════════════════════════════════════════════════════════
         if task.cmd_code == CMD_PICKUP_PLACE:
-            if PICKUP_MODE == "sensor":
-                # 센서 모드: 빈 슬롯 나올 때까지 대기
-                while True:
-                    slot = self.get_pickup_slot()
-                    if slot > 0:
-                        break
-                    print("[Scheduler] Pickup is FULL. Waiting...")
-                    time.sleep(2.0)
-                    if not self.running:
-                        return
-            else:
-                # 순환 모드: 대기 없이 바로 할당
-                slot = self.get_pickup_slot()
-            
-            task.assigned_slot = slot
-            task.params[REG_F_PICK_IDX] = slot
+            # 보통 앞선 CMD_PICKUP_MOVE 동작 중에 예약이 끝나 있음 (sensor: 빈 슬롯 나올 때까지 대기)
+            slot = self._acquire_pickup_slot(task)
+            if slot == 0:
+                return
             print(f"[Scheduler] Assigned Pickup Slot: {slot} (mode: {PICKUP_MODE})")
 
         # ═══════════════════════════════════════════════════════════════
         # 로봇 명령 실행
         # ═══════════════════════════════════════════════════════════════
         cmd_name = CMD_DESC.get(actual_cmd, "UNK")
-        logger.info(f"TSK|STR|{task.task_id}|{actual_cmd}|{cmd_name}|{task.order_no}|{task.menu_name}")
+        robot_tag = f"|{lane.robot_id}" if len(self.lanes) > 1 else ""
+        logger.info(f"TSK|STR|{task.task_id}|{actual_cmd}|{cmd_name}|{task.order_no}|{task.menu_name}{robot_tag}")
+        motion_start = time.time()
         
         current_init = robot.read_register(REG_INIT)
         if current_init != 0:
@@ -929,6 +1709,9 @@ class TaskScheduler:
             
         # Send Command
         robot.send_command(actual_cmd)
+        if task.pickup_place_task:
+            # 픽업 이동 중에 다음 서빙 태스크의 슬롯을 미리 예약
+            self._prefetch_pickup_slot(task.pickup_place_task, robot)
         time.sleep(0.5)
         
         expected_init = actual_cmd + 500
@@ -1046,6 +1829,9 @@ class TaskScheduler:
                 raise Exception("Robot Init Timeout")
             robot.write_register(REG_INIT, 0)
 
+        # 동작 시간 관측 (STR ~ post 장비 동작 시작, motion_profile.json 과 같은 기준)
+        self.eta_model.observe_cmd(actual_cmd, time.time() - motion_start)
+
         # ═══════════════════════════════════════════════════════════════
         # 병렬 처리 모드 (615 확인 후)
         # ═══════════════════════════════════════════════════════════════
@@ -1173,6 +1959,7 @@ class TaskScheduler:
                     self.status_callback(current_parallel_uuid, ORDER_PROCESSING)
                 
                 try:
+                    pt.started_at = time.time()
                     self._execute_task(pt)
                     pt.status = TaskStatus.COMPLETED
                 except Exception as e:
@@ -1216,14 +2003,18 @@ class TaskScheduler:
         print(f"[Parallel] Total parallel orders processed: {parallel_count}")
         
         # ─────────────────────────────────────────────────────────────
-        # 4. 커피 추출 완료 대기
+        # 4. 커피 추출 완료 대기 (완료 이벤트, 남은 레시피 시간이 최대 대기)
         # ─────────────────────────────────────────────────────────────
         elapsed = time.time() - coffee_start_time
         remaining = coffee_duration - elapsed
         
         if remaining > 0:
-            print(f"[Parallel] Waiting for coffee: {remaining:.1f}s remaining")
-            time.sleep(remaining)
+            print(f"[Parallel] Waiting for coffee: up to {remaining:.1f}s remaining")
+            coffee_ref = None
+            for act in (coffee_task.pre_device_action, coffee_task.post_device_action):
+                if act and act.get('type') == 'coffee':
+                    coffee_ref = act.get('params', {}).get('ref')
+            self._wait_coffee_done(coffee_ref, remaining)
         
         print(f"[Parallel] Coffee ready. Picking up...")
         
@@ -1248,7 +2039,7 @@ class TaskScheduler:
         
         # CMD 116 완료 후 린스 강제 실행
         print("[Parallel] Executing rinse after coffee pick...")
-        threading.Thread(target=self.devices.execute_rinse, daemon=True).start()
+        self.devices.execute_rinse()
         
         # ─────────────────────────────────────────────────────────────
         # 6. CMD_COFFEE_DONE(114) 태스크 건너뛰기 처리
@@ -1307,23 +2098,72 @@ class TaskScheduler:
         
         threading.Thread(target=_clear, daemon=True).start()
 
+    def _wait_ice_done(self, fallback_time):
+        """
+        제빙기 토출 종료까지 대기. 제빙기가 알려준 예상 종료 시각 기준이며,
+        토출 작업 정보가 없으면 레시피 시간(fallback_time)만큼 sleep 합니다.
+        """
+        job, self.ice_job = self.ice_job, None
+        if not job:
+            print(f"[DeviceAction] No ice job. Sleeping for {fallback_time}s...")
+            time.sleep(fallback_time)
+            return
+
+        remaining = max(0.0, job.get('estimated_done_at', time.time()) - time.time())
+        start = time.time()
+        done = self.devices.wait_ice_done(job['id'], remaining + ICE_WAIT_MARGIN_SECONDS)
+        waited = time.time() - start
+        if done is None:
+            # device_service 응답 없음 → 예상 종료 시각까지 대기
+            if remaining - waited > 0:
+                time.sleep(remaining - waited)
+        elif not done:
+            print(f"[DeviceAction][WARN] Ice dispense not finished within {remaining + ICE_WAIT_MARGIN_SECONDS:.1f}s")
+        logger.info(f"DEV|ice_wait|{done}|{waited:.1f}")
+
+    def _wait_coffee_done(self, ref, limit):
+        """
+        커피머신 완료 이벤트까지 대기. limit(레시피 시간)은 최대 대기 시간이며,
+        이벤트를 지원하지 않거나 device_service와 통신할 수 없으면 남은 시간만큼 sleep 합니다.
+        """
+        start = time.time()
+        state = self.devices.wait_coffee_done(ref, limit) if ref else None
+        waited = time.time() - start
+
+        if state == 'finished':
+            print(f"[DeviceAction] Coffee finished after {waited:.1f}s (limit {limit:.1f}s)")
+        elif state == 'failed':
+            logger.warning(f"DEV|coffee_failed|{ref}")
+            print(f"[DeviceAction][WARN] Coffee machine reported failure (ref={ref})")
+        elif state == 'pending':
+            print(f"[DeviceAction] Coffee wait limit reached ({limit:.1f}s) without finish event")
+        else:
+            remaining = limit - waited
+            if remaining > 0:
+                print(f"[DeviceAction] No coffee events ({state}). Sleeping for {remaining:.1f}s...")
+                time.sleep(remaining)
+        logger.info(f"DEV|coffee_wait|{state}|{waited:.1f}")
+
     def _execute_device_action(self, action):
         act_type = action.get('type')
         p = action.get('params', {})
         logger.info(f"DEV|{act_type}")
+        action_start = time.time()
         
         success = False
         
         if act_type == 'coffee':
-            success = self.devices.make_coffee(p.get('id'), p.get('time'))
+            success = self.devices.make_coffee(p.get('id'), p.get('time'), p.get('ref'))
             if success:
                 self.coffeemachine_used = True
                 # last_coffee_time은 커피 추출 완료(린스) 후에만 업데이트
                 # 여기서 업데이트하면 보일러 보상 로직이 작동하지 않음     
         elif act_type == 'ice_water':
-            success = self.devices.dispense_ice_water(p.get('ice'), p.get('water')) 
+            self.ice_job = self.devices.dispense_ice_water(p.get('ice'), p.get('water'))
+            success = self.ice_job is not None
         elif act_type == 'ice_water_sparkling':
-            success = self.devices.dispense_ice_water(p.get('ice'), p.get('water'))
+            self.ice_job = self.devices.dispense_ice_water(p.get('ice'), p.get('water'))
+            success = self.ice_job is not None
             if success and p.get('sparkling', 0) > 0:
                 success = self.devices.dispense_sparkling(p.get('sparkling'))  
         elif act_type == 'hot_water':
@@ -1343,10 +2183,27 @@ class TaskScheduler:
             except Exception as e:
                 print(f"[DeviceAction] Sleep Error: {e}")
                 success = False
+        elif act_type == 'ice_wait':
+            try:
+                self._wait_ice_done(float(p.get('time', 0)))
+                success = True
+            except Exception as e:
+                print(f"[DeviceAction] Ice Wait Error: {e}")
+                success = False
+        elif act_type == 'coffee_wait':
+            try:
+                limit = float(p.get('time', 0))
+                if SIMULATION_MODE:
+                    limit = SIM_COFFEE_WAIT_SECONDS
+                self._wait_coffee_done(p.get('ref'), limit)
+                success = True
+            except Exception as e:
+                print(f"[DeviceAction] Coffee Wait Error: {e}")
+                success = False
         elif act_type == 'rinse':
             # 커피 추출 완료 후 린스 강제 실행 (비동기)
             print("[DeviceAction] Executing rinse after coffee done...")
-            threading.Thread(target=self.devices.execute_rinse, daemon=True).start()
+            self.devices.execute_rinse()
             self.coffeemachine_used = False  # 린스 실행했으므로 플래그 리셋
             self.last_coffee_time = time.time()  # 린스도 커피머신 사용이므로 시간 기록
             success = True
@@ -1354,6 +2211,9 @@ class TaskScheduler:
         if not success:
             raise Exception(f"Device Action {act_type} Failed")
 
+        planned = float(p.get('time', 0) or 0) if act_type in ETA_TIMED_ACTIONS else 0
+        self.eta_model.observe_device(act_type, planned, time.time() - action_start)
+
 
 # ---------------------------------------------------------
 # Order Management
@@ -1386,6 +2246,7 @@ class OrderManager:
         print(f"[OrderManager] Order Added: {order_uuid} ({order.get('menu_name', '')})")
         logger.info(f"ORD|ADD|{order['order_no']}|{order['menu_code']}|{order.get('menu_name','')}|{order_uuid}")
         
+        self.scheduler.refresh_etas()
         notify_clients('order_updated')
         return order_uuid
 
@@ -1409,6 +2270,7 @@ class OrderManager:
         if order_uuid in self.active_orders:
             self.active_orders[order_uuid]['status'] = ORDER_CANCELLED
             self.scheduler.cancel_tasks(order_uuid)
+            self.scheduler.refresh_etas()
             notify_clients('order_updated')
             return True
         return False
@@ -1468,11 +2330,12 @@ def set_system_mode(mode):
     if mode == MODE_MANUAL and old_mode == MODE_AUTO:
         scheduler.stop_all()
         # 로봇 프로그램 정지
-        try:
-            requests.get(f"{ROBOT_SERVICE_URL}/command/robot_1/1", timeout=5)  # cmd 1 = stop_program
-            logger.info("SYS|ROBOT_PROGRAM_STOP")
-        except Exception as e:
-            logger.error(f"SYS|ROBOT_PROGRAM_STOP_FAIL|{e}")
+        for lane in scheduler.lanes:
+            try:
+                requests.get(f"{ROBOT_SERVICE_URL}/command/{lane.robot_id}/1", timeout=5)  # cmd 1 = stop_program
+                logger.info("SYS|ROBOT_PROGRAM_STOP")
+            except Exception as e:
+                logger.error(f"SYS|ROBOT_PROGRAM_STOP_FAIL|{e}")
         try:
             requests.get(f"{PICKUP_SERVICE_URL}/resetAll", timeout=5)
         except:
@@ -1481,11 +2344,12 @@ def set_system_mode(mode):
     # 자동 모드 시작 시 로봇 프로그램 1번 실행 + 픽업 슬롯 초기화
     if mode == MODE_AUTO and old_mode == MODE_MANUAL:
         scheduler.reset_pickup_slot()
-        try:
-            requests.get(f"{ROBOT_SERVICE_URL}/runProgram/robot_1/1", timeout=5)
-            logger.info("SYS|ROBOT_PROGRAM_START|1")
-        except Exception as e:
-            logger.error(f"SYS|ROBOT_PROGRAM_START_FAIL|{e}")
+        for lane in scheduler.lanes:
+            try:
+                requests.get(f"{ROBOT_SERVICE_URL}/runProgram/{lane.robot_id}/1", timeout=5)
+                logger.info("SYS|ROBOT_PROGRAM_START|1")
+            except Exception as e:
+                logger.error(f"SYS|ROBOT_PROGRAM_START_FAIL|{e}")
     
     logger.info(f"SYS|MODE|{old_mode}|->|{mode}")
     notify_clients('system_mode_changed', {'mode': mode})
@@ -1523,10 +2387,24 @@ def get_orders():
 
 @app.route('/getActiveOrders', methods=['GET'])
 def get_active_orders():
-    active = {o['uuid']: o for o in order_manager.active_orders.values() 
-              if o['status'] in [ORDER_WAITING, ORDER_PROCESSING]}
+    etas = scheduler.get_order_etas()
+    active = {}
+    for o in list(order_manager.active_orders.values()):
+        if o['status'] in [ORDER_WAITING, ORDER_PROCESSING]:
+            eta = etas.get(o['uuid'], {})
+            active[o['uuid']] = dict(o, eta_seconds=eta.get('eta_seconds'), eta_position=eta.get('position'))
     return jsonify({'orders': active})
 
+@app.route('/getQueueETA', methods=['GET'])
+@app.route('/getQueueETA/<int:menu_code>', methods=['GET'])
+def get_queue_eta(menu_code=None):
+    """현재 대기열 소진 예상 시간 (+ 메뉴 지정 시 지금 주문하면 완료까지 예상 시간)"""
+    return jsonify(scheduler.get_queue_eta(menu_code))
+
+@app.route('/getMotionModel', methods=['GET'])
+def get_motion_model():
+    return jsonify(scheduler.eta_model.snapshot())
+
 @app.route('/cancelOrder/<string:order_uuid>', methods=['GET', 'POST'])
 def cancel_order(order_uuid):
     success = order_manager.cancel_order(order_uuid)
@@ -1540,7 +2418,10 @@ def get_scheduler_status():
         'pending_tasks': pending,
         'running_tasks': running,
         'robot_busy': scheduler.robot_busy,
-        'parallel_mode': scheduler.parallel_mode
+        'parallel_mode': scheduler.parallel_mode,
+        'pickup_hold': scheduler.pickup_hold,
+        'robots': {lane.robot_id: lane.status() for lane in scheduler.lanes},
+        'station_owner': dict(scheduler.station_owner)
     })
 
 @app.route('/emergencyStop', methods=['GET', 'POST'])
@@ -1581,9 +2462,21 @@ def initialize():
     
     order_manager = OrderManager(planner, scheduler)
     
-    print("[System] Order Service Initialized (Single Robot Mode)")
+    print(f"[System] Order Service Initialized ({len(scheduler.lanes)} robot(s))")
+
+
+def shutdown():
+    """서버 종료 시: 새 주문/태스크 배정을 멈추고 스케줄러 스레드 종료 (실행 중인 로봇 명령은 끝까지 진행)"""
+    if order_manager:
+        order_manager.running = False
+    if scheduler:
+        scheduler.running = False
+        if scheduler.thread:
+            scheduler.thread.join(timeout=5)
+    print("[System] Order Service stopped")
 
 
 if __name__ == '__main__':
+    from http_server import serve
     initialize()
-    app.run(host='0.0.0.0', port=8100, debug=False, threaded=True)
+    serve(app, 'order_service', 8100, on_shutdown=shutdown)
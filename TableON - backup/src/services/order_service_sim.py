@@ -1021,5 +1021,6 @@ if __name__ == '__main__':
     print("")
     print("=" * 55)
     
-    app.run(host='0.0.0.0', port=8100, debug=False, threaded=True)
+    from http_server import serve
+    serve(app, 'order_service', 8100)
 
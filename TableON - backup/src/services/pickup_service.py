@@ -1,13 +1,16 @@
 """
 Pickup Service - 고객 픽업대 관리
 ================================
-- 픽업대 1개 (Zone 1) - Arduino
+- 픽업대 N개 (config.json zones, 구역마다 슬롯 M개) - 구역별 Arduino
 - DID 화면 연동 (REST API Polling 방식)
+- 슬롯 상태 머신 (io_service 센서 변경 이벤트 + 보정 폴링)
 """
 
 from flask import Flask, request, jsonify, render_template
-import threading, time, requests, json, os
+import threading, time, requests, json, os, uuid
+from array import array
 from flask_cors import CORS
+from recipe_client import RecipeClient
 
 app = Flask(__name__, template_folder='../../web/templates', static_folder='../../web/static')
 CORS(app, resources={r"/*": {"origins": "*"}})
@@ -34,18 +37,39 @@ CONFIG_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'config', 'con
 RECIPE_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'config', 'recipe.json')
 SIMULATION_MODE = True
 RECIPE_MAP = {}
+REMOVAL_DEBOUNCE_SECONDS = 1.0  # 센서가 비어 있음을 이 시간 동안 유지해야 픽업 완료로 확정
+ZONE_CONFIG = {}  # config.json 'zones' (구역 이름 -> {capacity, arduino, ...})
+zones = {}        # zone_id -> PickupZone (load_zones() 이후 채워짐)
+stop_event = threading.Event()  # 서버 종료 시 폴링/레시피 감시 스레드 종료
+
+def build_recipe_map(data):
+    recipe_map = {}
+    if isinstance(data, list):
+        for item in data:
+            recipe_map[item['menu_code']] = item.get('menu_name', f"Menu {item['menu_code']}")
+    elif isinstance(data, dict):
+        for code, item in data.items():
+            recipe_map[int(code)] = item.get('menu_name', f"Menu {code}")
+    return recipe_map
+
+def on_recipes(recipes, version):
+    """recipe_service 버전이 바뀌면 메뉴 이름 갱신 후 화면에 알림"""
+    global RECIPE_MAP
+    RECIPE_MAP = build_recipe_map(recipes)
+    print(f"[Pickup] {len(RECIPE_MAP)} recipes (version {version})")
+    for z in zones.values():
+        notify_clients('pickup_updated', {'zone': z.zone_id})
+
+recipe_client = RecipeClient(on_recipes, 'Pickup', stop_event=stop_event)
 
 def load_recipes():
+    """recipe_service에서 로드 (응답이 없으면 recipe.json)"""
     global RECIPE_MAP
+    if recipe_client.sync():
+        return
     try:
         with open(RECIPE_PATH, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            if isinstance(data, list):
-                for item in data:
-                    RECIPE_MAP[item['menu_code']] = item.get('menu_name', f"Menu {item['menu_code']}")
-            elif isinstance(data, dict):
-                for code, item in data.items():
-                    RECIPE_MAP[int(code)] = item.get('menu_name', f"Menu {code}")
+            RECIPE_MAP = build_recipe_map(json.load(f))
             
             print(f"[Pickup] Loaded {len(RECIPE_MAP)} recipes.")
     except Exception as e:
@@ -55,22 +79,101 @@ try:
     with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
         config = json.load(f)
         SIMULATION_MODE = config.get('simulation_mode', True)
+        REMOVAL_DEBOUNCE_SECONDS = float(config.get('pickup_debounce_seconds', REMOVAL_DEBOUNCE_SECONDS))
+        ZONE_CONFIG = config.get('zones', {})
         print(f"[Pickup] Simulation Mode: {SIMULATION_MODE}")
 except Exception as e:
     print(f"[Pickup] Failed to load config: {e}. Defaulting to Simulation Mode.")
 
 load_recipes()
 
-# ==== 픽업대 상태 (1개) ====
-DIDArr = [[0, 0, 0, 0],  # 주문번호 (4 slots)
-          [0, 0, 0, 0]]  # 메뉴코드
-pickupStatus = [0, 0, 0, 0]
-sensorValues = [0, 0, 0, 0]
-ledControl = [0, 0, 0, 0]
-sensorOffTime = [0, 0, 0, 0]
+# ==== 슬롯 상태 머신 ====
+# EMPTY → RESERVED(예약) → OCCUPIED(서빙/컵 감지) → REMOVAL_PENDING(센서 비어 있음, 디바운스) → EMPTY
+# 전이는 즉시 발행 (stateSeq 증가 + 롱폴링 대기자 깨움 + Node-RED 알림)
+SLOT_EMPTY, SLOT_RESERVED, SLOT_OCCUPIED, SLOT_REMOVAL_PENDING = 0, 1, 2, 3
+SLOT_STATE_NAMES = ['empty', 'reserved', 'occupied', 'removal_pending']
+stateSeq = 0
+stateCond = threading.Condition()
+
+# 상태 바이트 → 0/1 변환표 (bytearray.translate 로 슬롯 전체를 한 번에 변환)
+OCCUPIED_MAP = bytes(1 if s in (SLOT_OCCUPIED, SLOT_REMOVAL_PENDING) else 0 for s in range(256))
+RESERVED_MAP = bytes(1 if s == SLOT_RESERVED else 0 for s in range(256))
+
+class PickupZone:
+    """
+    픽업대 1개의 슬롯 상태. 슬롯별 값은 bytearray/array에 저장 (index = 슬롯 번호 - 1)
+    빈 슬롯 탐색/점유 목록은 bytearray.find/translate로 처리
+    """
+    def __init__(self, zone_id, name, slots, reader_id=None):
+        self.zone_id = zone_id
+        self.name = name
+        self.slots = slots
+        self.reader_id = reader_id                     # io_service Arduino ID (None: 센서 없음)
+
+        self.state = bytearray(slots)                  # SLOT_* 상태
+        self.status = bytearray(slots)                 # 1: 서빙된 음료가 놓여 있음 (DID 표시 중)
+        self.sensors = bytearray(b'\x01' * slots)      # 1: 비어 있음, 0: 컵 있음
+        self.led = bytearray(slots)
+        self.order_no = array('l', [0] * slots)        # DID 주문번호
+        self.menu_code = array('l', [0] * slots)       # DID 메뉴코드
+        self.off_time = array('d', [0.0] * slots)      # 센서가 비어 있음으로 바뀐 시각
+        self.removal_deadline = array('d', [0.0] * slots)  # REMOVAL_PENDING → EMPTY 확정 시각
+        self.served_at = array('d', [0.0] * slots)     # 서빙 시각 (0: 서빙 기록 없음)
+        self.reservations = [None] * slots             # {'token', 'order_no', 'expires_at'}
+        self.last_did_json = None
+
+    def find(self, state, start=0):
+        """state인 첫 슬롯 index (없으면 -1)"""
+        return self.state.find(state, start)
+
+    def occupied(self):
+        return list(self.state.translate(OCCUPIED_MAP))
+
+    def reserved(self):
+        return list(self.state.translate(RESERVED_MAP))
+
+    def state_names(self):
+        return [SLOT_STATE_NAMES[s] for s in self.state]
+
+    def did_json(self):
+        ret = {'zone': self.zone_id, 'slots': self.slots}
+        for i in range(self.slots):
+            n = f"{i + 1:02d}"
+            ret['billNum' + n] = self.order_no[i]
+            ret['menuCode' + n] = self.menu_code[i]
+            ret['menuName' + n] = get_menu_name(self.menu_code[i]) if self.menu_code[i] > 0 else ""
+        ret['voice_flag'] = voice_flag
+        return ret
+
+def load_zones():
+    """config.json zones 순서대로 Zone 1..N 생성 (arduino: io_service 리더 키, 기본 pickup_<zone>)"""
+    result = {}
+    for i, (name, conf) in enumerate((ZONE_CONFIG or {'customer_pickup': {'capacity': 4}}).items(), start=1):
+        reader = conf.get('arduino', f'pickup_{i}')
+        suffix = str(reader).rsplit('_', 1)[-1] if reader else ''
+        reader_id = int(suffix) if suffix.isdigit() else None
+        if reader and reader_id is None:
+            # io_service load_config 와 같은 규칙 (pickup_<숫자>), 아니면 센서 없는 존으로 동작
+            print(f"[Pickup][WARN] Zone {i} ({name}): invalid arduino key '{reader}', sensor disabled")
+        result[i] = PickupZone(i, name, int(conf.get('capacity', 4)), reader_id)
+        print(f"[Pickup] Zone {i} ({name}): {result[i].slots} slots, arduino={reader}")
+    return result
 
 voice_flag = 0
 
+# ==== 픽업대 상태 ====
+zones = load_zones()
+DEFAULT_ZONE = min(zones)
+reservationIndex = {}  # token -> (zone_id, slot index) : 예약 해제 O(1)
+
+# ==== 픽업 예측 (서빙 후 고객이 가져가기까지 걸리는 시간) ====
+DWELL_DEFAULT_SECONDS = 90.0   # 관측값이 없을 때 가정하는 대기 시간
+DWELL_EWMA_ALPHA = 0.2
+dwellAvg = DWELL_DEFAULT_SECONDS
+
+# ==== 제조 대기 주문 ETA (order_service가 전송) ====
+waitingETA = []  # [{'order_no', 'menu_code', 'eta_at'}] - 예상 완료 순
+
 # ==== IO 서버 연동 설정 ====
 IO_URL = "http://localhost:8400"
 session = requests.Session()
@@ -79,70 +182,133 @@ session = requests.Session()
 def get_menu_name(code):
     return RECIPE_MAP.get(code, f"메뉴 {code}")
 
+def get_zone(zone_id):
+    """구역 조회 (0: 기본 구역 - 하위 호환)"""
+    return zones.get(zone_id or DEFAULT_ZONE)
+
+def zone_not_found(zone_id):
+    return jsonify({'error': f'Zone {zone_id} not found'}), 404
+
 def build_did_json(zone_id=1):
-    return {
-        'zone': zone_id,
-        'billNum01': DIDArr[0][0],
-        'billNum02': DIDArr[0][1],
-        'billNum03': DIDArr[0][2],
-        'billNum04': DIDArr[0][3],
-        'menuCode01': DIDArr[1][0],
-        'menuCode02': DIDArr[1][1],
-        'menuCode03': DIDArr[1][2],
-        'menuCode04': DIDArr[1][3],
-        'menuName01': get_menu_name(DIDArr[1][0]) if DIDArr[1][0] > 0 else "",
-        'menuName02': get_menu_name(DIDArr[1][1]) if DIDArr[1][1] > 0 else "",
-        'menuName03': get_menu_name(DIDArr[1][2]) if DIDArr[1][2] > 0 else "",
-        'menuName04': get_menu_name(DIDArr[1][3]) if DIDArr[1][3] > 0 else "",
-        'voice_flag': voice_flag
-    }
+    zone = get_zone(zone_id)
+    return zone.did_json() if zone else {'zone': zone_id, 'slots': 0, 'voice_flag': voice_flag}
 
 # ---- IO 호출 헬퍼 (Arduino) ----
-def io_read_arduino(pickup_id=1):
+def io_read_arduino(pickup_id=1, slots=4):
     try:
         url = f"{IO_URL}/arduino/sensor/{pickup_id}"
         r = session.get(url, timeout=10.0)
         if r.status_code == 200:
             data = r.json()
-            if isinstance(data, list) and len(data) >= 4:
-                return data[:4]
+            if isinstance(data, list) and len(data) >= slots:
+                return data[:slots]
     except Exception as e:
         pass
     return None
 
 # ---- DID 갱신 로직 ----
-last_did_json = None
-
 def update_did_logic(zone_id, index, order_num, menu_code):
-    global last_did_json
-    
-    # zone_id는 하위 호환성을 위해 받지만, 항상 픽업대 1개로 처리
-    max_idx = 4
+    zone = get_zone(zone_id)
+    if not zone:
+        return
 
-    if 1 <= index <= max_idx:
-        DIDArr[0][index-1] = order_num
-        DIDArr[1][index-1] = menu_code
+    if 1 <= index <= zone.slots:
+        i = index - 1
+        zone.order_no[i] = order_num
+        zone.menu_code[i] = menu_code
 
         if order_num != 0:
-            pickupStatus[index-1] = 1
-            ledControl[index-1] = 1
-            sensorValues[index-1] = 1
+            zone.status[i] = 1
+            zone.led[i] = 1
+            zone.sensors[i] = 1
+            zone.served_at[i] = time.time()
+            with stateCond:
+                release_reservation(zone, i)  # 예약 소진
+                set_slot_state(zone, i, SLOT_OCCUPIED, f'served #{order_num}')
         else:
-            pickupStatus[index-1] = 0
-            ledControl[index-1] = 0
-
-    current_json = build_did_json()
-    
-    if last_did_json != current_json:
-        last_did_json = current_json
-        notify_clients('pickup_updated', {'zone': 1})
+            zone.served_at[i] = 0
+            zone.status[i] = 0
+            zone.led[i] = 0
+            with stateCond:
+                set_slot_state(zone, i, SLOT_EMPTY, 'cleared')
+
+    current_json = zone.did_json()
+
+    if zone.last_did_json != current_json:
+        zone.last_did_json = current_json
+        notify_clients('pickup_updated', {'zone': zone.zone_id})
+
+# ---- 슬롯 상태 머신 ----
+def set_slot_state(zone, i, state, reason=''):
+    """슬롯 상태 전이 + 즉시 발행 (stateCond 보유 상태에서 호출)"""
+    global stateSeq
+    prev = zone.state[i]
+    if prev == state:
+        return
+    zone.state[i] = state
+    stateSeq += 1
+    stateCond.notify_all()
+    print(f"[Pickup] Zone {zone.zone_id} Slot {i + 1}: {SLOT_STATE_NAMES[prev]} -> {SLOT_STATE_NAMES[state]} ({reason})")
+    notify_clients('pickup_slot_changed', {'zone': zone.zone_id, 'slot': i + 1, 'state': SLOT_STATE_NAMES[state],
+                                           'prev': SLOT_STATE_NAMES[prev], 'seq': stateSeq})
+
+def release_reservation(zone, i):
+    """예약 기록 삭제 (stateCond 보유 상태에서 호출)"""
+    r = zone.reservations[i]
+    if r:
+        reservationIndex.pop(r['token'], None)
+        zone.reservations[i] = None
+
+def apply_sensors(zone, sensors):
+    """센서 값 반영 (1=비어 있음, 0=컵 있음). 이벤트/폴링 모두 현재 값 전체를 전달"""
+    now = time.time()
+    with stateCond:
+        for i in range(min(len(sensors), zone.slots)):
+            zone.sensors[i] = sensors[i]
+            if sensors[i] == 0:  # Cup Present
+                zone.off_time[i] = 0
+                if zone.state[i] != SLOT_OCCUPIED:
+                    set_slot_state(zone, i, SLOT_OCCUPIED, 'sensor')
+            elif zone.state[i] == SLOT_OCCUPIED:  # 컵이 치워짐 → 디바운스 시작
+                zone.off_time[i] = now
+                zone.removal_deadline[i] = now + REMOVAL_DEBOUNCE_SECONDS
+                set_slot_state(zone, i, SLOT_REMOVAL_PENDING, 'sensor')
+    advance_slots()
+
+def advance_slots():
+    """디바운스/예약 리스 만료 처리 (전체 구역)"""
+    now = time.time()
+    removed = []
+    with stateCond:
+        for zone in zones.values():
+            i = zone.find(SLOT_REMOVAL_PENDING)
+            while i >= 0:
+                if now >= zone.removal_deadline[i]:
+                    set_slot_state(zone, i, SLOT_EMPTY, 'removed')
+                    removed.append((zone, i))
+                i = zone.find(SLOT_REMOVAL_PENDING, i + 1)
+            for i, r in enumerate(zone.reservations):
+                if r and r['expires_at'] <= now:
+                    release_reservation(zone, i)
+                    if zone.state[i] == SLOT_RESERVED:
+                        set_slot_state(zone, i, SLOT_EMPTY, 'lease expired')
+    for zone, i in removed:
+        # Cup removed -> Clear DID
+        if zone.status[i] == 1:
+            observe_dwell(zone, i)
+            update_did_logic(zone.zone_id, i+1, 0, 0)
+
+def slot_states(zone):
+    with stateCond:
+        return zone.state_names(), stateSeq
 
 # ---- Flask 라우팅 ----
 
 @app.route('/did')
-def did_screen():
-    """DID Screen (픽업대 1개)"""
-    return render_template('DID.html', zone='pickup', zone_id=1)
+@app.route('/did/<int:zone>')
+def did_screen(zone=1):
+    """DID Screen (구역별)"""
+    return render_template('DID.html', zone='pickup', zone_id=zone)
 
 @app.route('/updateDID/<int:zone>/<int:index>/<int:order_num>/<int:menu_code>', methods=['GET'])
 def update_did(zone, index, order_num, menu_code):
@@ -153,43 +319,142 @@ def update_did(zone, index, order_num, menu_code):
 @app.route('/getDIDData', methods=['GET'])
 def getDIDData(zone=1):
     retJson = build_did_json(zone)
+    retJson['waiting'] = build_waiting_json()
     return jsonify(retJson)
 
+def build_waiting_json():
+    """대기 주문 목록 + 남은 예상 시간(초). 시간은 조회 시점 기준으로 계산"""
+    now = time.time()
+    return [{
+        'order_no': o.get('order_no', 0),
+        'menu_code': o.get('menu_code', 0),
+        'menu_name': get_menu_name(o.get('menu_code', 0)),
+        'eta_seconds': max(0, int(round(o.get('eta_at', now) - now)))
+    } for o in waitingETA]
+
+@app.route('/updateWaitingETA', methods=['POST'])
+def update_waiting_eta():
+    """order_service에서 대기 주문 ETA 목록 수신"""
+    global waitingETA
+    data = request.get_json(silent=True) or {}
+    waitingETA = data.get('orders', [])
+    notify_clients('did_waiting_updated', {'zone': DEFAULT_ZONE})
+    return jsonify({'count': len(waitingETA)})
+
+@app.route('/getZones', methods=['GET'])
+def get_zones():
+    """구역 목록 (구역 ID, 이름, 슬롯 수, 빈 슬롯 수)"""
+    return jsonify([{
+        'zone': z.zone_id, 'name': z.name, 'slots': z.slots,
+        'empty': z.state.count(SLOT_EMPTY), 'arduino': z.reader_id
+    } for z in zones.values()])
+
 @app.route('/getPickupStatus/<int:zone>', methods=['GET'])
 @app.route('/getPickupStatus', methods=['GET'])
 def getPickupStatus(zone=1):
     """Return occupancy status for scheduler (1=Occupied, 0=Empty)"""
-    status = []
-    for i in range(len(pickupStatus)):
-        # 1이 비어있는 상태이므로, 0일 때를 Occupied로 판단해야 함
-        is_occupied = 1 if (pickupStatus[i] == 1 or sensorValues[i] == 0) else 0
-        status.append(is_occupied)
-        
-    return jsonify({'zone': 1, 'status': status})
+    z = get_zone(zone)
+    if not z:
+        return zone_not_found(zone)
+    with stateCond:
+        return jsonify({'zone': z.zone_id, 'status': z.occupied(), 'reserved': z.reserved(),
+                        'state': z.state_names(), 'seq': stateSeq})
+
+@app.route('/sensorEvent/<int:zone>/<path:values>', methods=['GET', 'POST'])
+def sensor_event(zone, values):
+    """io_service 센서 변경 이벤트 (폴링 주기를 기다리지 않고 즉시 반영), values: 1/0/1/1..."""
+    z = next((z for z in zones.values() if z.reader_id == zone), None)
+    if not z:
+        return zone_not_found(zone)
+    apply_sensors(z, [int(v) for v in values.split('/') if v != ''])
+    states, seq = slot_states(z)
+    return jsonify({'state': states, 'seq': seq})
+
+@app.route('/waitSlotChange/<int:seq>/<float:timeout>', methods=['GET'])
+@app.route('/waitSlotChange/<int:seq>/<int:timeout>', methods=['GET'])
+def wait_slot_change(seq, timeout):
+    """슬롯 상태 롱폴링 (전체 구역): stateSeq가 주어진 값보다 커지면 즉시 응답"""
+    deadline = time.time() + min(float(timeout), 30.0)
+    with stateCond:
+        while stateSeq <= seq:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            stateCond.wait(remaining)
+        return jsonify({
+            'state': {z.zone_id: z.state_names() for z in zones.values()},
+            'seq': stateSeq,
+            'changed': stateSeq > seq
+        })
+
+@app.route('/reserveSlot/<int:zone>/<int:lease>', methods=['GET', 'POST'])
+def reserve_slot(zone, lease):
+    """
+    비어 있고 예약되지 않은 첫 슬롯을 lease초 동안 예약합니다.
+    반환: {'slot', 'token', 'expires_at'} (빈 슬롯이 없으면 slot 0)
+    """
+    z = get_zone(zone)
+    if not z:
+        return zone_not_found(zone)
+    order_no = request.args.get('order_no', 0, type=int)
+    advance_slots()
+    now = time.time()
+    with stateCond:
+        i = z.find(SLOT_EMPTY)
+        if i < 0:
+            return jsonify({'slot': 0, 'token': None, 'seq': stateSeq})
+        token = uuid.uuid4().hex[:12]
+        z.reservations[i] = {'token': token, 'order_no': order_no, 'expires_at': now + lease}
+        reservationIndex[token] = (z.zone_id, i)
+        set_slot_state(z, i, SLOT_RESERVED, f'order #{order_no}, {lease}s')
+        return jsonify({'slot': i + 1, 'token': token, 'expires_at': now + lease, 'seq': stateSeq})
+
+@app.route('/releaseSlot/<string:token>', methods=['GET', 'POST'])
+def release_slot(token):
+    """예약 취소 (서빙 실패/주문 취소 시)"""
+    with stateCond:
+        found = reservationIndex.get(token)
+        if not found:
+            return jsonify({'slot': 0})
+        zone, i = zones[found[0]], found[1]
+        release_reservation(zone, i)
+        if zone.state[i] == SLOT_RESERVED:
+            set_slot_state(zone, i, SLOT_EMPTY, 'released')
+        return jsonify({'zone': zone.zone_id, 'slot': i + 1})
 
 @app.route('/resetAll', methods=['POST', 'GET'])
 def reset_all_status():
-    """픽업대 논리 상태 초기화 (수동 모드 전환 시 호출)"""
-    global DIDArr, pickupStatus, ledControl
-    
-    DIDArr = [[0, 0, 0, 0], [0, 0, 0, 0]]
-    pickupStatus = [0, 0, 0, 0]
-    ledControl = [0, 0, 0, 0]
-    
-    notify_clients('pickup_updated', {'zone': 1})
-    
+    """픽업대 논리 상태 초기화 (수동 모드 전환 시 호출, 전체 구역)"""
+    global waitingETA
+
+    waitingETA = []
+    with stateCond:
+        reservationIndex.clear()
+        for z in zones.values():
+            for i in range(z.slots):
+                z.order_no[i] = z.menu_code[i] = 0
+                z.status[i] = z.led[i] = 0
+                z.served_at[i] = 0
+                z.reservations[i] = None
+                # 컵이 남아 있는 슬롯은 센서 기준으로 다시 점유 처리
+                set_slot_state(z, i, SLOT_OCCUPIED if z.sensors[i] == 0 else SLOT_EMPTY, 'reset')
+
+    for z in zones.values():
+        notify_clients('pickup_updated', {'zone': z.zone_id})
+
     return jsonify({'message': 'Pickup status reset completed'})
 
 @app.route('/getAllPickupStatus', methods=['GET'])
 def get_all_pickup_status():
-    """픽업대 상태 조회"""
-    return jsonify({
-        'pickup': {
-            'status': pickupStatus,
-            'sensors': sensorValues,
-            'did': DIDArr
-        }
-    })
+    """픽업대 상태 조회 (pickup: 기본 구역, zones: 전체 구역)"""
+    result = {
+        z.zone_id: {
+            'status': list(z.status),
+            'sensors': list(z.sensors),
+            'did': [list(z.order_no), list(z.menu_code)]
+        } for z in zones.values()
+    }
+    return jsonify({'pickup': result[DEFAULT_ZONE], 'zones': result})
 
 @app.route('/clearSlot/<int:zone>/<int:slot>', methods=['GET', 'POST'])
 @app.route('/clearSlot/<int:slot>', methods=['GET', 'POST'])
@@ -197,49 +462,85 @@ def clear_slot(zone=1, slot=None):
     """특정 슬롯 강제 클리어"""
     if slot is None:
         slot = zone
-        zone = 1
+        zone = DEFAULT_ZONE
     update_did_logic(zone, slot, 0, 0)
     return jsonify({'message': f'Slot {slot} cleared'})
 
+# ---- 픽업 예측 ----
+def observe_dwell(zone, i):
+    """센서로 컵이 치워진 것을 확인했을 때 서빙~픽업 시간 반영 (강제 클리어는 제외)"""
+    global dwellAvg
+    if zone.served_at[i] > 0:
+        dwell = zone.off_time[i] - zone.served_at[i]
+        if dwell > 0:
+            dwellAvg += DWELL_EWMA_ALPHA * (dwell - dwellAvg)
+
+def build_forecast(zone):
+    """
+    슬롯별 점유/예약 상태와 비워질 예상 시각.
+    expected_free_at: 비어 있으면 지금, 서빙된 컵은 서빙 시각 + 평균 대기 시간, 알 수 없는 컵은 None
+    """
+    now = time.time()
+    with stateCond:
+        occupied, reserved, seq = zone.occupied(), zone.reserved(), stateSeq
+    slots = []
+    for i in range(zone.slots):
+        if not occupied[i]:
+            free_at = now
+        elif zone.served_at[i] > 0:
+            free_at = max(now, zone.served_at[i] + dwellAvg)
+        else:
+            free_at = None
+        slots.append({'slot': i + 1, 'occupied': occupied[i], 'reserved': reserved[i], 'expected_free_at': free_at})
+    return {'zone': zone.zone_id, 'slots': slots, 'dwell_avg': round(dwellAvg, 1), 'now': now, 'seq': seq}
+
+@app.route('/getPickupForecast/<int:zone>', methods=['GET'])
+@app.route('/getPickupForecast', methods=['GET'])
+def get_pickup_forecast(zone=1):
+    """order_service의 픽업 용량 판단용 예측"""
+    z = get_zone(zone)
+    if not z:
+        return zone_not_found(zone)
+    return jsonify(build_forecast(z))
+
 # ---- 폴링 쓰레드 ----
+# 센서 변경은 io_service가 /sensorEvent로 즉시 전달하고, 폴링은 놓친 이벤트 보정용
 POLL_INTERVAL = 2  # 폴링 주기 (초) - RS485 버퍼 오버플로우 방지
+SLOT_TICK = 0.1    # 디바운스/리스 만료 확인 주기
+
 
 def poll_loop():
-    while True:
+    last_poll = 0
+    while not stop_event.is_set():
         try:
-            # 픽업대 Arduino 폴링
-            val = io_read_arduino(1)
-            if val is not None:
-                check_sensor_logic(val)
-            
-            print(f"[Pickup][DEBUG] Sensors:{val}")
-            
-            time.sleep(POLL_INTERVAL)
+            advance_slots()
+            if time.time() - last_poll >= POLL_INTERVAL:
+                last_poll = time.time()
+                # 구역별 Arduino 폴링
+                for z in zones.values():
+                    if z.reader_id is None:
+                        continue
+                    val = io_read_arduino(z.reader_id, z.slots)
+                    if val is not None:
+                        apply_sensors(z, val)
+
+                    print(f"[Pickup][DEBUG] Zone {z.zone_id} Sensors:{val}")
         except Exception as e:
             print("Polling error:", e)
-            time.sleep(POLL_INTERVAL)
-
-def check_sensor_logic(sensors):
-    count = len(sensors)
-    for i in range(count):
-        current_val = sensors[i]
-
-        # Update Global Sensor Value
-        sensorValues[i] = current_val
-        
-        if current_val == 1:  # Empty (사용자 확인 결과 1이 비어있음)
-            if sensorOffTime[i] == 0:
-                sensorOffTime[i] = time.time()
-            elif time.time() - sensorOffTime[i] > 1.0:  # Debounce 1s
-                # Cup removed -> Clear DID
-                if pickupStatus[i] == 1:
-                    update_did_logic(1, i+1, 0, 0)
-        else:  # Cup Present (0)
-            sensorOffTime[i] = 0
+        stop_event.wait(SLOT_TICK)
+
+def shutdown():
+    """서버 종료 시: 폴링/레시피 감시 스레드 종료"""
+    stop_event.set()
+    poll_thread.join(timeout=5)
+    print("[PickupService] Stopped")
 
 # 폴링 시작
-threading.Thread(target=poll_loop, daemon=True).start()
+poll_thread = threading.Thread(target=poll_loop, daemon=True)
+poll_thread.start()
+recipe_client.watch()
 
 if __name__ == '__main__':
-    print("[PickupService] Starting (Polling Mode) on port 8600...")
-    app.run(host='0.0.0.0', port=8600, debug=False, threaded=True)
+    print("[PickupService] Starting (Event + Polling Mode) on port 8600...")
+    from http_server import serve
+    serve(app, 'pickup_service', 8600, on_shutdown=shutdown)
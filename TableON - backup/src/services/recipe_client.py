@@ -0,0 +1,61 @@
+import threading
+
+import requests
+
+# recipe_service 버전 클라이언트 (order_service, pickup_service, 키오스크 리더 공용)
+# 캐시 버전과 다를 때만 /getRecipes/<version> 으로 다시 받고, /waitVersion 롱폴링으로 변경을 기다립니다.
+# 사용:
+#   client = RecipeClient(on_change, 'Planner')   # on_change(recipes, version): 바뀐 레시피 목록
+#   if not client.sync(): ...파일에서 로드...
+#   client.watch()                                # 백그라운드 감시 시작 (client.stop()으로 종료)
+
+RECIPE_SERVICE_URL = "http://localhost:8200"
+SYNC_TIMEOUT = 2.0      # /getRecipes 요청 타임아웃 (초)
+WATCH_TIMEOUT = 30      # /waitVersion 롱폴링 대기 시간 (초)
+RETRY_SECONDS = 5.0     # recipe_service 미응답 시 재연결 대기 (초)
+
+class RecipeClient:
+    def __init__(self, on_change, name='Recipe', base_url=RECIPE_SERVICE_URL, stop_event=None):
+        self.on_change = on_change
+        self.name = name
+        self.base_url = base_url
+        self.version = 0   # 마지막으로 받은 recipe_service 버전 (0: 아직 받지 못함)
+        self.stop_event = stop_event or threading.Event()
+        self.thread = None
+
+    def sync(self):
+        """캐시 버전과 다를 때만 다시 받아 on_change 호출. recipe_service 응답이 없으면 False"""
+        try:
+            res = requests.get(f"{self.base_url}/getRecipes/{self.version}", timeout=SYNC_TIMEOUT)
+            if res.status_code != 200:
+                return False
+            data = res.json()
+        except Exception:
+            return False
+        old, self.version = self.version, data['version']
+        if data.get('changed'):
+            print(f"[{self.name}] Recipe version {old} -> {self.version}")
+            self.on_change(data.get('recipes', []), self.version)
+        return True
+
+    def watch(self):
+        """버전 변경 감시 스레드 시작"""
+        self.thread = threading.Thread(target=self._watch_loop, daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _watch_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                res = requests.get(f"{self.base_url}/waitVersion/{self.version}/{WATCH_TIMEOUT}",
+                                   timeout=WATCH_TIMEOUT + 5)
+                if res.status_code == 200:
+                    if res.json().get('changed'):
+                        self.sync()
+                    continue
+            except Exception:
+                pass
+            self.stop_event.wait(RETRY_SECONDS)
@@ -1,51 +1,183 @@
 # 05.recipeServer.py  (v1 스타일, v2 방식 파일 저장/로드)
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-import json, os, threading
+import json, os, threading, time, atexit
+from collections import deque
+import requests
 
 app = Flask(__name__)
 CORS(app, resources={r"*": {"origins": "*"}})
 
 RECIPE_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'config', 'recipe.json')
 
-recipes = []                 # [{menu_code:int, cup_num:int, ...}]
-recipes_lock = threading.Lock()
+recipes = {}                 # menu_code(int) -> {menu_code:int, cup_num:int, ...} (파일 순서 유지)
+recipes_lock = threading.RLock()
+
+# ---------- 저장 ----------
+# 변경 후 SAVE_DELAY_SECONDS 동안 추가 변경이 없으면 한 번만 저장 (임시 파일에 쓰고 rename → 중간에 꺼져도 기존 파일 유지)
+SAVE_DELAY_SECONDS = 1.0
+save_lock = threading.Lock()
+save_timer = None
+
+# ---------- 변경 이력 ----------
+# (version, menu_code, 'upsert'|'delete') - /getChanges 로 버전 이후 변경분만 조회
+CHANGE_LOG_SIZE = 1000
+change_log = deque(maxlen=CHANGE_LOG_SIZE)
+change_log_base = 0          # 이 버전 이후의 변경만 이력에 있음 (이전 버전은 전체 재조회)
+
+# ---------- 버전 ----------
+# 레시피가 바뀔 때마다 증가 (재시작 후에도 겹치지 않도록 ms 시각 이상으로 설정)
+# 소비자(order/pickup/키오스크 리더)는 /waitVersion 롱폴링으로 변경을 받아 그때만 다시 로드
+recipe_version = 0
+version_cond = threading.Condition()
+
+NODERED_URL = "http://localhost:1880/notify"
+
+def notify_clients(event_name, data=None):
+    """Helper to send HTTP Trigger to Node-RED"""
+    payload = {'event': event_name}
+    if data:
+        payload.update(data)
+
+    def _send():
+        try:
+            requests.post(NODERED_URL, json=payload, timeout=0.5)
+        except:
+            pass
+
+    threading.Thread(target=_send, daemon=True).start()
+
+def bump_version():
+    global recipe_version
+    with version_cond:
+        recipe_version = max(recipe_version + 1, int(time.time() * 1000))
+        version_cond.notify_all()
+        version = recipe_version
+    print(f"[INFO] 레시피 버전 = {version}")
+    notify_clients('recipe_updated', {'version': version})
+    return version
 
 # ---------- 유틸 ----------
 def load_from_file():
-    global recipes
+    global change_log_base
+    loaded = {}
     if os.path.exists(RECIPE_FILE):
         try:
             with open(RECIPE_FILE, 'r', encoding='utf-8') as f:
                 data = json.load(f)
-                with recipes_lock:
-                    recipes[:] = data if type(data) == list else []
-            print(f"[INFO] 레시피 로드 완료, 항목수 = {len(recipes)}")
+            for r in (data if type(data) == list else []):
+                loaded[to_int(r.get('menu_code'))] = r
+            print(f"[INFO] 레시피 로드 완료, 항목수 = {len(loaded)}")
         except Exception as e:
             print(f"[ERROR] {RECIPE_FILE} 읽기 실패: {e}")
-            recipes[:] = []
     else:
         print(f"[WARN] {RECIPE_FILE} 파일이 없습니다. 빈 리스트로 시작합니다.")
-        recipes[:] = []
+    with recipes_lock:
+        recipes.clear()
+        recipes.update(loaded)
+        # 파일에서 다시 읽으면 이력으로 변경분을 알 수 없음 → 소비자는 전체 재조회
+        change_log.clear()
+        change_log_base = bump_version()
 
 def save_to_file():
+    """현재 레시피를 임시 파일에 쓰고 원자적으로 교체"""
     try:
-        with recipes_lock:
+        with save_lock:
+            with recipes_lock:
+                snapshot = list(recipes.values())  # 레시피 dict는 교체만 하므로 참조 복사로 충분
             # config 디렉토리가 없으면 생성
             os.makedirs(os.path.dirname(RECIPE_FILE), exist_ok=True)
-            with open(RECIPE_FILE, 'w', encoding='utf-8') as f:
-                json.dump(recipes, f, ensure_ascii=False, indent=2)
-        print(f"[INFO] 레시피 저장 완료, 항목수 = {len(recipes)}")
+            tmp_path = RECIPE_FILE + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, RECIPE_FILE)
+        print(f"[INFO] 레시피 저장 완료, 항목수 = {len(snapshot)}")
         return True
     except Exception as e:
         print(f"[ERROR] {RECIPE_FILE} 저장 실패: {e}")
         return False
 
-def find_index_by_menu_code(menu_code):
-    for i, r in enumerate(recipes):
-        if str(r.get('menu_code')) == str(menu_code):
-            return i
-    return -1
+def schedule_save():
+    """연속 변경은 마지막 변경 후 SAVE_DELAY_SECONDS 뒤에 한 번만 저장"""
+    global save_timer
+    with recipes_lock:
+        if save_timer:
+            save_timer.cancel()
+        save_timer = threading.Timer(SAVE_DELAY_SECONDS, save_to_file)
+        save_timer.daemon = True
+        save_timer.start()
+
+def flush_pending_save(force=False):
+    """예약된 저장이 있으면 즉시 실행 (종료 시), force=True 이면 예약이 없어도 저장"""
+    global save_timer
+    with recipes_lock:
+        timer, save_timer = save_timer, None
+    if timer:
+        timer.cancel()
+    elif not force:
+        return True
+    return save_to_file()
+
+atexit.register(flush_pending_save)
+
+def build_recipe(data):
+    """입력 데이터 -> 레시피 구조 (없는 필드는 기본값)"""
+    return {
+        'menu_code':            to_int(data.get('menu_code')),
+        'menu_name':            data.get('menu_name', ''),
+        'cup_num':              to_int(data.get('cup_num')),
+        'sparkling_ext_time':   to_float(data.get('sparkling_ext_time')),
+        'water_ext_time':       to_float(data.get('water_ext_time')),
+        'ice_ext_time':         to_float(data.get('ice_ext_time')),
+        'hotwater_ext_time':    to_float(data.get('hotwater_ext_time')),
+        'icecream_ext_time':    to_float(data.get('icecream_ext_time')),
+        'coffee_product_id':    to_int(data.get('coffee_product_id')),
+        'coffee_ext_time':      to_float(data.get('coffee_ext_time')),
+        'syrups':               data.get('syrups', []), # List of {id, time}
+        'milk_boolean':         to_bool(data.get('milk_boolean')),
+    }
+
+def apply_changes(items, delete_codes=()):
+    """
+    레시피 여러 개를 한 번에 반영 (버전 1회 증가, 저장 1회 예약).
+    items: 입력 데이터 목록, delete_codes: 삭제할 menu_code 목록
+    반환: (version, 추가 수, 수정 수, 삭제 수)
+    """
+    global change_log_base
+    added = updated_count = deleted = 0
+    with recipes_lock:
+        touched = []
+        for data in items:
+            updated = build_recipe(data)
+            mc = updated['menu_code']
+            cur = recipes.get(mc)
+            if cur is not None:
+                # 기존 레시피의 추가 필드는 보존, dict는 새로 만들어 교체 (저장 스냅샷과 공유하지 않도록)
+                merged = dict(cur)
+                merged.update(updated)
+                recipes[mc] = merged
+                updated_count += 1
+            else:
+                if not updated['menu_name']:
+                    updated['menu_name'] = str(mc)
+                recipes[mc] = updated
+                added += 1
+            touched.append((mc, 'upsert'))
+        for mc in delete_codes:
+            if recipes.pop(mc, None) is not None:
+                deleted += 1
+                touched.append((mc, 'delete'))
+        if not touched:
+            return recipe_version, 0, 0, 0
+        version = bump_version()
+        for mc, action in touched:
+            if len(change_log) == CHANGE_LOG_SIZE:
+                change_log_base = change_log[0][0]  # 밀려나는 이력의 버전 이전은 변경분 조회 불가
+            change_log.append((version, mc, action))
+    schedule_save()
+    return version, added, updated_count, deleted
 
 def to_int(v, default=0):
     try:
@@ -76,16 +208,57 @@ def to_bool(v, default=False):
 @app.route('/getAllRecipes', methods=['GET'])
 def get_all_recipes():
     with recipes_lock:
-        return jsonify(recipes)
+        res = jsonify(list(recipes.values()))
+        res.headers['X-Recipe-Version'] = str(recipe_version)
+        return res
+
+@app.route('/getVersion', methods=['GET'])
+def get_version():
+    return jsonify({'version': recipe_version})
+
+@app.route('/getRecipes/<int:version>', methods=['GET'])
+def get_recipes_since(version):
+    """캐시 버전과 다를 때만 전체 레시피 반환 (같으면 changed=False)"""
+    with recipes_lock:
+        if version == recipe_version:
+            return jsonify({'version': recipe_version, 'changed': False})
+        return jsonify({'version': recipe_version, 'changed': True, 'recipes': list(recipes.values())})
+
+@app.route('/getChanges/<int:version>', methods=['GET'])
+def get_changes_since(version):
+    """
+    주어진 버전 이후 변경분 (upserts: 최신 레시피, deleted: 삭제된 menu_code).
+    이력 범위를 벗어난 버전이면 full=True 와 전체 레시피를 반환
+    """
+    with recipes_lock:
+        if version == recipe_version:
+            return jsonify({'version': recipe_version, 'changed': False})
+        if version < change_log_base or version > recipe_version:
+            return jsonify({'version': recipe_version, 'changed': True, 'full': True, 'recipes': list(recipes.values())})
+        last_action = {}
+        for v, mc, action in change_log:
+            if v > version:
+                last_action[mc] = action
+        upserts = [recipes[mc] for mc, action in last_action.items() if action == 'upsert' and mc in recipes]
+        deleted = [mc for mc, action in last_action.items() if action == 'delete']
+        return jsonify({'version': recipe_version, 'changed': True, 'full': False, 'upserts': upserts, 'deleted': deleted})
+
+@app.route('/waitVersion/<int:version>/<float:timeout>', methods=['GET'])
+@app.route('/waitVersion/<int:version>/<int:timeout>', methods=['GET'])
+def wait_version(version, timeout):
+    """버전 변경 롱폴링: 현재 버전이 주어진 값과 다르면 즉시 응답"""
+    deadline = time.time() + min(float(timeout), 60.0)
+    with version_cond:
+        while recipe_version == version:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            version_cond.wait(remaining)
+        return jsonify({'version': recipe_version, 'changed': recipe_version != version})
 
 @app.route('/getRecipe/<int:menu_code>', methods=['GET'])
 def get_recipe(menu_code):
-    menu_code = request.args.get('menu_code', '')
-    with recipes_lock:
-        idx = find_index_by_menu_code(menu_code)
-        if idx >= 0:
-            return jsonify(recipes[idx])
-    return jsonify({})
+    return jsonify(recipes.get(menu_code, {}))
 
 @app.route('/updateRecipe', methods=['POST'])
 def update_recipe():
@@ -98,61 +271,56 @@ def update_recipe():
         if mc is None:
             return jsonify({'error': 'menu_code is required'}), 400
 
-        with recipes_lock:
-            idx = find_index_by_menu_code(mc)
-            
-            # 필드 매핑 (입력 데이터 -> 레시피 구조)
-            # 없는 필드는 기존 값 유지 또는 기본값
-            updated = {
-                'menu_code':            to_int(data.get('menu_code')),
-                'menu_name':            data.get('menu_name', ''),
-                'cup_num':              to_int(data.get('cup_num')),
-                'sparkling_ext_time':   to_float(data.get('sparkling_ext_time')),
-                'water_ext_time':       to_float(data.get('water_ext_time')),
-                'ice_ext_time':         to_float(data.get('ice_ext_time')),
-                'hotwater_ext_time':    to_float(data.get('hotwater_ext_time')),
-                'icecream_ext_time':    to_float(data.get('icecream_ext_time')),
-                'coffee_product_id':    to_int(data.get('coffee_product_id')),
-                'coffee_ext_time':      to_float(data.get('coffee_ext_time')),
-                'syrups':               data.get('syrups', []), # List of {id, time}
-                'milk_boolean':         to_bool(data.get('milk_boolean')),
-            }
-
-            if idx >= 0:
-                # Update existing
-                cur = recipes[idx]
-                # Merge: Only update fields present in request if needed, 
-                # but for full update usually we overwrite. 
-                # Let's overwrite with the prepared 'updated' dict but preserve any extra fields if any.
-                cur.update(updated)
-                recipes[idx] = cur
-                action = "수정"
-            else:
-                # Add new
-                if not updated['menu_name']:
-                    updated['menu_name'] = str(updated['menu_code'])
-                recipes.append(updated)
-                action = "추가"
-
-            print(f"[INFO] updateRecipe -> {action}: {updated.get('menu_code')}")
-
-        ok = save_to_file()
-        return jsonify({'message': 'OK', 'action': action}) if ok else (jsonify({'error': 'SAVE_FAIL'}), 500)
+        version, added, _, _ = apply_changes([data])
+        action = "추가" if added else "수정"
+        print(f"[INFO] updateRecipe -> {action}: {mc}")
+        return jsonify({'message': 'OK', 'action': action, 'version': version})
         
     except Exception as e:
         print(f"[ERROR] updateRecipe failed: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/updateRecipes', methods=['POST'])
+def update_recipes():
+    """
+    일괄 수정/가져오기: [레시피, ...] 또는 {"recipes": [...], "replace": true}
+    replace=true 이면 목록에 없는 기존 레시피는 삭제 (전체 가져오기). 버전은 1회만 증가
+    """
+    try:
+        data = request.get_json()
+        if isinstance(data, dict):
+            items, replace = data.get('recipes'), to_bool(data.get('replace'))
+        else:
+            items, replace = data, False
+        if not isinstance(items, list):
+            return jsonify({'error': 'recipes list is required'}), 400
+
+        missing = [i for i, r in enumerate(items) if not isinstance(r, dict) or r.get('menu_code') is None]
+        if missing:
+            # 일부만 반영되지 않도록 전체 거부
+            return jsonify({'error': 'menu_code is required', 'index': missing}), 400
+
+        delete_codes = []
+        if replace:
+            keep = {to_int(r.get('menu_code')) for r in items}
+            with recipes_lock:
+                delete_codes = [mc for mc in recipes if mc not in keep]
+
+        version, added, updated, deleted = apply_changes(items, delete_codes)
+        print(f"[INFO] updateRecipes -> 추가 {added}, 수정 {updated}, 삭제 {deleted}")
+        return jsonify({'message': 'OK', 'version': version, 'added': added, 'updated': updated, 'deleted': deleted})
+
+    except Exception as e:
+        print(f"[ERROR] updateRecipes failed: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/deleteRecipe', methods=['GET'])
 def delete_recipe():
-    mc = request.args.get('menu_code', '')
-    with recipes_lock:
-        idx = find_index_by_menu_code(mc)
-        if idx >= 0:
-            removed = recipes.pop(idx)
-            save_to_file()
-            print("[INFO] deleteRecipe -> 삭제:", removed.get('menu_code'))
-            return "OK"
+    mc = to_int(request.args.get('menu_code', ''), None)
+    _, _, _, deleted = apply_changes([], [mc])
+    if deleted:
+        print("[INFO] deleteRecipe -> 삭제:", mc)
+        return "OK"
     return "NOT_FOUND", 404
 
 @app.route('/reload', methods=['GET'])
@@ -164,11 +332,12 @@ def reload_recipes():
 @app.route('/save', methods=['GET'])
 def save_recipes():
     
-    ok = save_to_file()
+    ok = flush_pending_save(force=True)
     return "OK" if ok else ("SAVE_FAIL", 500)
 
 # ---------- 부팅 ----------
 if __name__ == '__main__':
     load_from_file()
     # 포트 충돌 시 바꿔 사용 가능
-    app.run(host='0.0.0.0', port=8200, debug=False)
+    from http_server import serve
+    serve(app, 'recipe_service', 8200, on_shutdown=flush_pending_save)
@@ -42,6 +42,46 @@ NODERED_URL = "http://localhost:1880/notify" # Node-RED Notify URL
 controllers = {} # key: robot_id (e.g., 'robot_1'), value: RobotController instance
 SIMULATION_MODE = False
 
+# --- Status Sampler ---
+STATUS_POLL_MOVING = 0.2 # 동작 중 샘플링 주기 (초)
+STATUS_POLL_IDLE = 2.0 # 대기 중 샘플링 주기 (초)
+STATUS_FAST_HOLD_SEC = 3.0 # 명령 기록/정지 후에도 이 시간 동안은 빠른 주기 유지
+STATUS_STALE_SEC = 5.0 # 스냅샷이 이보다 오래되면 /status에서 직접 읽음
+STATUS_CHANGE_KEYS = ('is_moving', 'is_program_running', 'is_error', 'is_collided', 'program_name')
+REG_CMD = 600
+
+# --- Simulation Motion Profile ---
+# 명령별 동작 시간 분포 (scripts/extract_motion_profile.py 로 운영 로그에서 추출)
+MOTION_PROFILE_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'config', 'motion_profile.json')
+MOTION_PROFILE = {} # key: cmd(int), value: {'mean', 'std', 'min', 'max', ...}
+DEFAULT_MOTION_SEC = 2.0 # 프로파일에 없는 명령의 기본 동작 시간
+SIM_TIME_SCALE = 1.0 # 시뮬레이션 배속 (10 → 실제보다 10배 빠르게)
+
+def load_motion_profile():
+    global MOTION_PROFILE
+    try:
+        with open(MOTION_PROFILE_PATH, 'r', encoding='utf-8') as f:
+            commands = json.load(f).get('commands', {})
+        MOTION_PROFILE = {int(cmd): stat for cmd, stat in commands.items()}
+        print(f"[MOCK] Motion profile loaded: {len(MOTION_PROFILE)} commands (scale x{SIM_TIME_SCALE})")
+    except FileNotFoundError:
+        print(f"[MOCK] No motion profile, using {DEFAULT_MOTION_SEC}s per command (scale x{SIM_TIME_SCALE})")
+    except Exception as e:
+        print(f"[MOCK][WARN] Motion profile load failed: {e}")
+
+def sim_sleep(seconds):
+    """시뮬레이션 배속을 적용한 sleep"""
+    time.sleep(seconds / SIM_TIME_SCALE)
+
+def sample_motion_time(cmd):
+    """명령의 동작 시간을 분포(평균/표준편차, 최소~최대 범위)에서 샘플링하고 배속을 적용"""
+    stat = MOTION_PROFILE.get(cmd)
+    if not stat:
+        return DEFAULT_MOTION_SEC / SIM_TIME_SCALE
+    duration = random.gauss(stat['mean'], stat.get('std', 0.0))
+    duration = min(max(duration, stat.get('min', 0.0)), stat.get('max', duration))
+    return duration / SIM_TIME_SCALE
+
 def notify_clients(event_name, data=None):
     """Helper to send HTTP Trigger to Node-RED"""
     payload = {'event': event_name}
@@ -73,6 +113,7 @@ class MockIndyDCP3:
         self.op_state = getattr(OpState, 'IDLE', 1)
         self.prog_state = getattr(ProgramState, 'STOPPED', getattr(ProgramState, 'IDLE', 1))
         self.last_cmd_time = 0
+        self.cmd_duration = 0
         self.current_cmd = 0
         
         # Background thread to simulate command execution
@@ -88,17 +129,18 @@ class MockIndyDCP3:
             if cmd > 0 and self.current_cmd != cmd:
                 self.current_cmd = cmd
                 self.last_cmd_time = time.time()
+                self.cmd_duration = sample_motion_time(cmd)
                 self.op_state = OpState.MOVING
                 
                 # 시뮬레이션: Ack(REG_INIT) 초기화 (0=Busy/Start)
                 self.set_int_variable_mock(700, 0)
                 
-                print(f"[MOCK] Processing CMD {cmd}...")
+                print(f"[MOCK] Processing CMD {cmd}... ({self.cmd_duration:.2f}s)")
                 notify_clients('robot_updated') # Notify Start
             
             if self.op_state == OpState.MOVING:
-                # Simulate movement time (e.g., 2 seconds)
-                if time.time() - self.last_cmd_time > 2.0:
+                # Simulate movement time (명령별 프로파일에서 샘플링한 시간)
+                if time.time() - self.last_cmd_time > self.cmd_duration:
                     self.op_state = OpState.IDLE
                     
                     # [Simulation] Virtual Sensor Update Logic (단일 로봇 - 고객 픽업대만)
@@ -132,7 +174,7 @@ class MockIndyDCP3:
                         
                         # 2. 0.5초 후 컵 추출 성공 신호
                         def set_cup_res():
-                            time.sleep(0.5)
+                            sim_sleep(0.5)
                             self.set_int_variable_mock(102, 1)  # CUP_RES = 1
                             print(f"[MOCK] CUP_RES (102) = 1 (추출 성공)")
                         threading.Thread(target=set_cup_res, daemon=True).start()
@@ -141,7 +183,7 @@ class MockIndyDCP3:
                     if self.current_cmd == 115:
                         # 커피머신에 컵 거치 완료 신호
                         def set_cup_set():
-                            time.sleep(0.3)
+                            sim_sleep(0.3)
                             self.set_int_variable_mock(103, 1)  # CUP_SET = 1
                             print(f"[MOCK] CUP_SET (103) = 1 (컵 거치 완료)")
                         threading.Thread(target=set_cup_set, daemon=True).start()
@@ -160,7 +202,8 @@ class MockIndyDCP3:
                     
                     notify_clients('robot_updated') # Notify End
 
-            time.sleep(0.1)
+            # 배속이 커지면 폴링 주기도 줄임 (최소 10ms)
+            time.sleep(max(0.01, 0.1 / SIM_TIME_SCALE))
 
     def get_control_data(self):
         return {'op_state': self.op_state}
@@ -179,7 +222,7 @@ class MockIndyDCP3:
     def move_home(self):
         print(f"[MOCK] Move Home")
         self.op_state = OpState.MOVING
-        time.sleep(1)
+        sim_sleep(1)
         self.op_state = OpState.IDLE
 
     def stop_motion(self):
@@ -227,46 +270,72 @@ class RobotController:
         self.role = config.get('role', 'unknown')
         self.client = None
         self.lock = threading.Lock()
-        self.last_status = {} # Cache for notify optimization
+
+        # Status snapshot (샘플러 스레드만 컨트롤러에 상태를 요청하고, /status는 스냅샷으로 응답)
+        self.snapshot = None
+        self.snapshot_seq = 0
+        self.snapshot_cond = threading.Condition()
+        self.controller_reads = 0     # 상태 샘플 수
+        self.controller_calls = 0     # 실제 컨트롤러 호출 수 (get_control_data + get_program_data)
+        self.prog_data = None         # 마지막 get_program_data 결과 (빠른 주기에서는 재사용)
+        self.prog_read_at = 0.0
+        self.last_op_state = None
+        self.last_status_error = None # 마지막 get_status 오류 (같은 오류는 한 번만 출력)
+        self.wake_event = threading.Event() # 명령 기록 시 샘플러를 즉시 깨움
         
         if not self.ip:
             print(f"[ERROR][{self.robot_id}] IP not configured.")
         else:
             self.connect()
             
-        # Start Status Monitor Thread
+        # Start Status Sampler Thread
         self.running = True
         threading.Thread(target=self._monitor_loop, daemon=True).start()
 
     def _monitor_loop(self):
-        """Monitor robot status and notify on change"""
+        """Sample robot status at an adaptive rate and notify on change"""
+        last_status = {}
+        fast_until = 0
+        woke = False
         while self.running:
-            time.sleep(1)
-            if not self.client: continue
-            
-            try:
-                current_status = self.get_status(internal=True) # internal flag to avoid loop
-                if not current_status: continue
-                
+            if not self.client:
+                time.sleep(STATUS_POLL_IDLE)
+                continue
+
+            # 빠른 주기에서는 get_control_data만 호출, 프로그램 상태는 대기 주기/명령 직후/op_state 변경 시 갱신
+            refresh_program = woke or time.time() - self.prog_read_at >= STATUS_POLL_IDLE
+            woke = False
+            current_status = self._read_status(refresh_program)
+            if current_status:
                 # Check if key fields changed (is_moving, is_error, program_state, etc.)
-                # Simple comparison for now
-                is_changed = False
-                if not self.last_status:
-                    is_changed = True
-                else:
-                    for key in ['is_moving', 'is_program_running', 'is_error', 'is_collided', 'program_name']:
-                        if self.last_status.get(key) != current_status.get(key):
-                            is_changed = True
-                            break
-                
+                is_changed = not last_status or any(
+                    last_status.get(key) != current_status.get(key) for key in STATUS_CHANGE_KEYS
+                )
+
+                with self.snapshot_cond:
+                    if is_changed:
+                        self.snapshot_seq += 1
+                    current_status['seq'] = self.snapshot_seq
+                    current_status['timestamp'] = time.time()
+                    self.snapshot = current_status
+                    self.snapshot_cond.notify_all()
+
                 if is_changed:
-                    self.last_status = current_status
-                    # print(f"[{self.robot_id}] Status Changed -> Notify")
-                    notify_clients('robot_updated', {'robot_id': self.robot_id})
-                    
-            except Exception as e:
-                # print(f"[{self.robot_id}] Monitor Error: {e}")
-                pass
+                    last_status = current_status
+                    notify_clients('robot_updated', {
+                        'robot_id': self.robot_id,
+                        'status': {key: current_status.get(key) for key in STATUS_CHANGE_KEYS},
+                        'seq': current_status['seq']
+                    })
+
+            # 동작 중(또는 명령 직후 잠시)은 빠르게, 대기 중에는 느리게 샘플링
+            if current_status and current_status.get('is_moving'):
+                fast_until = time.time() + STATUS_FAST_HOLD_SEC
+            interval = STATUS_POLL_MOVING if time.time() < fast_until else STATUS_POLL_IDLE
+            if self.wake_event.wait(interval):
+                self.wake_event.clear()
+                woke = True
+                fast_until = time.time() + STATUS_FAST_HOLD_SEC
 
     def connect(self):
         print(f"[SYSTEM] Initializing {self.robot_id} ({self.name}) at {self.ip}...")
@@ -282,16 +351,52 @@ class RobotController:
                 self.client = None
 
     def get_status(self, internal=False):
+        """최근 스냅샷 반환 (샘플러가 멈춰 스냅샷이 오래되면 직접 읽음)"""
+        with self.snapshot_cond:
+            snapshot = self.snapshot
+        if snapshot and time.time() - snapshot['timestamp'] <= STATUS_STALE_SEC:
+            status = dict(snapshot)
+            status['age'] = round(time.time() - snapshot['timestamp'], 3)
+            return status
+
+        status = self._read_status()
+        if status:
+            status['timestamp'] = time.time()
+            status['age'] = 0.0
+        return status
+
+    def wait_status_change(self, seq, timeout):
+        """스냅샷 seq가 주어진 값보다 커질 때까지 대기 (롱폴링용)"""
+        deadline = time.time() + timeout
+        with self.snapshot_cond:
+            while self.snapshot is None or self.snapshot['seq'] <= seq:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.snapshot_cond.wait(remaining)
+            return dict(self.snapshot) if self.snapshot else None
+
+    def _read_status(self, refresh_program=True):
+        """
+        컨트롤러 상태 읽기. refresh_program=False 이면 get_control_data만 호출하고
+        프로그램 상태는 캐시를 사용 (op_state가 바뀌면 함께 갱신)
+        """
         if not self.client: return None
         try:
-            # Avoid lock contention if called from monitor loop which might be less critical?
-            # But we need thread safety.
             with self.lock:
                 # Use get_control_data and get_program_data for IndyDCP3
                 control_data = self.client.get_control_data()
-                prog_data = self.client.get_program_data()
+                self.controller_calls += 1
+                op_state = control_data.get('op_state')
+                if refresh_program or self.prog_data is None or op_state != self.last_op_state:
+                    self.prog_data = self.client.get_program_data()
+                    self.prog_read_at = time.time()
+                    self.controller_calls += 1
+                self.last_op_state = op_state
+                prog_data = self.prog_data
+            self.controller_reads += 1
+            self.last_status_error = None
             
-            op_state = control_data.get('op_state')
             prog_state = prog_data.get('program_state')
             
             # Status Mapping using enums
@@ -314,7 +419,9 @@ class RobotController:
                 'is_home': 0
             }
         except Exception as e:
-            print(f"[ERROR][{self.robot_id}] get_status failed: {e}")
+            if str(e) != self.last_status_error:
+                print(f"[ERROR][{self.robot_id}] get_status failed: {e}")
+                self.last_status_error = str(e)
             return None
 
     def play_program(self, prog_num):
@@ -386,6 +493,9 @@ class RobotController:
             self.client.set_do([{'address': index, 'state': state_enum}])
 
     def set_int_variable(self, addr, value):
+        if addr == REG_CMD and value:
+            self.wake_event.set() # 명령 시작 → 빠른 샘플링으로 전환
+
         if SIMULATION_MODE and isinstance(self.client, MockIndyDCP3):
             self.client.set_int_variable_mock(addr, value)
             return
@@ -419,13 +529,16 @@ class RobotController:
             return self.client.get_di()
 
 def initialize_clients():
-    global controllers, SIMULATION_MODE
+    global controllers, SIMULATION_MODE, SIM_TIME_SCALE
     try:
         with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
             config = json.load(f)
         
         SIMULATION_MODE = config.get('simulation_mode', False)
         print(f"[SYSTEM] Simulation Mode: {SIMULATION_MODE}")
+        if SIMULATION_MODE:
+            SIM_TIME_SCALE = max(float(config.get('simulation_time_scale', 1.0)), 0.01)
+            load_motion_profile()
 
         robot_config = config.get('robot', {})
         for key, val in robot_config.items():
@@ -460,6 +573,31 @@ def get_status(robot_id):
         }), 500
     return jsonify(status)
 
+@app.route('/status/<string:robot_id>/wait/<int:seq>/<float:timeout>', methods=['GET'])
+@app.route('/status/<string:robot_id>/wait/<int:seq>/<int:timeout>', methods=['GET'])
+def wait_status(robot_id, seq, timeout):
+    """상태 변경 롱폴링: 스냅샷 seq가 주어진 값보다 커지면 즉시 응답"""
+    ctrl = controllers.get(robot_id)
+    if not ctrl: return jsonify({'error': 'Robot not found'}), 404
+
+    status = ctrl.wait_status_change(seq, min(float(timeout), 30.0))
+    if status is None:
+        return jsonify({'error': 'no_snapshot'}), 503
+    status['changed'] = status['seq'] > seq
+    return jsonify(status)
+
+@app.route('/statusStats', methods=['GET'])
+def status_stats():
+    """로봇별 상태 샘플 수 / 컨트롤러 호출 수 / 스냅샷 정보"""
+    return jsonify({
+        robot_id: {
+            'controller_reads': ctrl.controller_reads,
+            'controller_calls': ctrl.controller_calls,
+            'seq': ctrl.snapshot_seq,
+            'snapshot_age': round(time.time() - ctrl.snapshot['timestamp'], 3) if ctrl.snapshot else None
+        } for robot_id, ctrl in controllers.items()
+    })
+
 @app.route('/runProgram/<string:robot_id>/<int:prog_num>', methods=['GET'])
 def run_program(robot_id, prog_num):
     ctrl = controllers.get(robot_id)
@@ -586,4 +724,5 @@ def list_robots():
 
 if __name__ == '__main__':
     initialize_clients()
-    app.run(host='0.0.0.0', port=8300, debug=False)
+    from http_server import serve
+    serve(app, 'robot_service', 8300, on_shutdown=cleanup_clients)
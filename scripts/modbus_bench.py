@@ -0,0 +1,180 @@
+import argparse
+import os
+import select
+import statistics
+import sys
+import threading
+import time
+import tty
+import logging
+
+# src/device_controller.py 의 DeviceController 를 로컬 pty Modbus RTU 슬레이브에 붙여 지연/전송 횟수를 측정합니다.
+# 실제 장비 없이 pymodbus 클라이언트 경로 전체(시리얼 → RTU 프레임 → 응답)를 확인할 수 있습니다.
+# 사용: python scripts/modbus_bench.py [-n 반복 수] [--baudrate 9600] [--emulate-baud]
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(BASE_DIR, 'src'))
+
+from device_controller import DeviceController
+
+UNIT_IO, UNIT_SYRUP, UNIT_SENSOR = 5, 6, 3
+DO_ICE_BTN, DO_SYRUP_BASE, DI_CUP_SENSOR = 3200, 3300, 6
+
+def crc16(data):
+    crc = 0xFFFF
+    for b in data:
+        crc ^= b
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return bytes([crc & 0xFF, crc >> 8])
+
+class PtyModbusSlave:
+    """
+    pty 위에서 동작하는 최소 Modbus RTU 슬레이브 (FC1, FC2, FC5, FC15)
+    코일 변경 시각을 기록해서 펄스 OFF 시각 오차를 확인할 수 있게 함
+    """
+    def __init__(self, baudrate=9600, emulate_baud=False):
+        self.master_fd, slave_fd = os.openpty()
+        tty.setraw(slave_fd)
+        self.port = os.ttyname(slave_fd)
+        self.slave_fd = slave_fd  # 닫으면 pty가 끊기므로 유지
+        self.byte_time = 10.0 / baudrate if emulate_baud else 0.0
+        self.coils = {}
+        self.inputs = {}
+        self.frames = {}          # fc -> 수신 프레임 수
+        self.coil_events = []     # (시각, unit, addr, value)
+        self.buf = b''
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def _read(self, n):
+        while len(self.buf) < n:
+            select.select([self.master_fd], [], [])
+            self.buf += os.read(self.master_fd, 256)
+        data, self.buf = self.buf[:n], self.buf[n:]
+        return data
+
+    def _reply(self, pdu):
+        frame = pdu + crc16(pdu)
+        if self.byte_time:
+            time.sleep(self.byte_time * len(frame))
+        os.write(self.master_fd, frame)
+
+    def _loop(self):
+        while True:
+            head = self._read(2)
+            unit, fc = head[0], head[1]
+            if fc == 15:
+                body = self._read(5)
+                body += self._read(body[4] + 2)
+            else:
+                body = self._read(6)
+            frame = head + body
+            if crc16(frame[:-2]) != frame[-2:]:
+                self.buf = b''
+                continue
+            if self.byte_time:
+                time.sleep(self.byte_time * len(frame))
+            self.frames[fc] = self.frames.get(fc, 0) + 1
+            addr = int.from_bytes(body[0:2], 'big')
+            now = time.time()
+            if fc in (1, 2):
+                count = int.from_bytes(body[2:4], 'big')
+                table = self.coils if fc == 1 else self.inputs
+                bits = [table.get((unit, addr + i), False) for i in range(count)]
+                data = bytes(sum(1 << j for j, v in enumerate(bits[i:i + 8]) if v) for i in range(0, count, 8))
+                self._reply(bytes([unit, fc, len(data)]) + data)
+            elif fc == 5:
+                value = body[2:4] == b'\xff\x00'
+                self.coils[(unit, addr)] = value
+                self.coil_events.append((now, unit, addr, value))
+                self._reply(frame[:-2])
+            elif fc == 15:
+                count = int.from_bytes(body[2:4], 'big')
+                data = body[5:5 + body[4]]
+                for i in range(count):
+                    value = bool(data[i // 8] >> (i % 8) & 1)
+                    self.coils[(unit, addr + i)] = value
+                    self.coil_events.append((now, unit, addr + i, value))
+                self._reply(frame[:6])
+            else:
+                self._reply(bytes([unit, fc | 0x80, 1]))
+
+def timed(fn, n):
+    samples = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    return samples
+
+def report(name, samples, frames=None):
+    samples = sorted(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    extra = f" frames={frames}" if frames is not None else ""
+    print(f"  {name:34s} n={len(samples):4d} mean={statistics.mean(samples):7.2f}ms p50={samples[len(samples) // 2]:7.2f}ms p99={p99:7.2f}ms{extra}")
+
+def frame_delta(slave, before):
+    return sum(slave.frames.values()) - before
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=200)
+    parser.add_argument('--baudrate', type=int, default=9600)
+    parser.add_argument('--emulate-baud', action='store_true', help='슬레이브가 전송 시간을 baudrate 기준으로 지연')
+    args = parser.parse_args()
+    logging.getLogger("RobotServer").setLevel(logging.WARNING)
+
+    slave = PtyModbusSlave(args.baudrate, args.emulate_baud)
+    slave.inputs[(UNIT_SENSOR, DI_CUP_SENSOR)] = True
+    device = DeviceController(slave.port, args.baudrate)
+    if not device.connect():
+        print("[Bench] DeviceController could not connect (pymodbus installed?)")
+        sys.exit(1)
+    print(f"[Bench] pty slave {slave.port}, baudrate {args.baudrate}, emulate_baud={args.emulate_baud}")
+
+    # 1. 단일 코일 쓰기 (FC5)
+    toggle = [False]
+    def write_one():
+        toggle[0] = not toggle[0]
+        device.write_coil(UNIT_IO, DO_ICE_BTN, toggle[0])
+    before = sum(slave.frames.values())
+    report("write_coil (FC5)", timed(write_one, args.n), frame_delta(slave, before))
+
+    # 2. 시럽 뱅크 8개: 코일별 FC5 vs FC15 1회
+    n_bank = max(1, args.n // 8)
+    def bank_single():
+        for i in range(8):
+            device.write_coil(UNIT_SYRUP, DO_SYRUP_BASE + i, i % 2 == 0)
+    def bank_multi():
+        device.write_coils(UNIT_SYRUP, DO_SYRUP_BASE, [i % 2 == 0 for i in range(8)])
+    before = sum(slave.frames.values())
+    report("syrup bank x8 write_coil", timed(bank_single, n_bank), frame_delta(slave, before))
+    before = sum(slave.frames.values())
+    report("syrup bank write_coils (FC15)", timed(bank_multi, n_bank), frame_delta(slave, before))
+
+    # 3. 컵 센서 읽기: 매번 조회 vs 캐시
+    before = sum(slave.frames.values())
+    report("read_input uncached (FC2)", timed(lambda: device.read_input(UNIT_SENSOR, DI_CUP_SENSOR, max_age=0), args.n),
+           frame_delta(slave, before))
+    before = sum(slave.frames.values())
+    report("read_input cached", timed(lambda: device.read_input(UNIT_SENSOR, DI_CUP_SENSOR), args.n),
+           frame_delta(slave, before))
+
+    # 4. 펄스: 호출 반환 시간 + OFF 시각 오차
+    pulse_sec = 0.2
+    slave.coil_events.clear()
+    returns = []
+    for _ in range(min(20, args.n)):
+        t0 = time.perf_counter()
+        device.pulse_coil(UNIT_IO, DO_ICE_BTN, pulse_sec)
+        returns.append((time.perf_counter() - t0) * 1000.0)
+        time.sleep(pulse_sec + 0.05)
+    report("pulse_coil return (non-blocking)", returns)
+    ons = [t for t, u, a, v in slave.coil_events if (u, a) == (UNIT_IO, DO_ICE_BTN) and v]
+    offs = [t for t, u, a, v in slave.coil_events if (u, a) == (UNIT_IO, DO_ICE_BTN) and not v]
+    errors = [abs((off - on) - pulse_sec) * 1000.0 for on, off in zip(ons, offs)]
+    if errors:
+        report(f"pulse width error ({pulse_sec}s)", errors)
+
+if __name__ == "__main__":
+    main()
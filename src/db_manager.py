@@ -37,12 +37,21 @@ class DBManager:
                     CREATE TABLE IF NOT EXISTS order_logs (
                         id INT AUTO_INCREMENT PRIMARY KEY,
                         order_id VARCHAR(50),
+                        menu_code INT,
                         menu_name VARCHAR(100),
                         status VARCHAR(50),
                         details TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        KEY idx_status (status, id)
                     )
                 ''')
+                # 이전 버전 테이블 보완 (menu_code 컬럼, 상태 인덱스)
+                cursor.execute("SHOW COLUMNS FROM order_logs LIKE 'menu_code'")
+                if not cursor.fetchone():
+                    cursor.execute("ALTER TABLE order_logs ADD COLUMN menu_code INT AFTER order_id")
+                cursor.execute("SHOW INDEX FROM order_logs WHERE Key_name = 'idx_status'")
+                if not cursor.fetchone():
+                    cursor.execute("ALTER TABLE order_logs ADD KEY idx_status (status, id)")
                 # 2. 픽업 슬롯 상태 테이블
                 cursor.execute('''
                     CREATE TABLE IF NOT EXISTS pickup_slots (
@@ -119,4 +128,45 @@ class DBManager:
                 cursor.execute("SELECT MAX(id) as last_id FROM order_logs")
                 return cursor.fetchone()['last_id']
         finally:
-            conn.close()
\ No newline at end of file
+            conn.close()
+
+    def update_order_status(self, order_ids, status, details=None):
+        """여러 주문의 상태를 한 번에 변경 (예: PROCESSING, DONE, FAILED)"""
+        if not order_ids: return True
+        conn = self.get_connection()
+        if not conn: return False
+        try:
+            with conn.cursor() as cursor:
+                marks = ", ".join(["%s"] * len(order_ids))
+                if details is None:
+                    sql = f"UPDATE order_logs SET status = %s WHERE id IN ({marks})"
+                    cursor.execute(sql, (status, *order_ids))
+                else:
+                    sql = f"UPDATE order_logs SET status = %s, details = %s WHERE id IN ({marks})"
+                    cursor.execute(sql, (status, details, *order_ids))
+            return True
+        except Exception as e:
+            logger.error(f"[DB] Update Order Status Error: {e}")
+            return False
+        finally:
+            conn.close()
+
+    def load_waiting_orders(self, interrupted_status=None):
+        """
+        WAITING 주문을 접수 순서대로 반환 (쿼리 1회).
+        interrupted_status 가 있으면 PROCESSING 으로 남은 주문(재시작 전 제조 중)을 그 상태로 먼저 변경
+        """
+        conn = self.get_connection()
+        if not conn: return None
+        try:
+            with conn.cursor() as cursor:
+                if interrupted_status:
+                    cursor.execute("UPDATE order_logs SET status = %s, details = 'interrupted' WHERE status = 'PROCESSING'",
+                                   (interrupted_status,))
+                cursor.execute("SELECT id, menu_code, menu_name FROM order_logs WHERE status = 'WAITING' ORDER BY id")
+                return cursor.fetchall()
+        except Exception as e:
+            logger.error(f"[DB] Load Waiting Orders Error: {e}")
+            return None
+        finally:
+            conn.close()
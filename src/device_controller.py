@@ -0,0 +1,284 @@
+import heapq
+import queue
+import threading
+import time
+import logging
+
+logger = logging.getLogger("RobotServer")
+
+class DeviceController:
+    """
+    범용 IO 제어 클래스 (Modbus RTU)
+    - 특정 장비(컵, 얼음)에 종속되지 않고 write, read, pulse 기능만 제공
+    - 클라이언트는 한 번 연결 후 유지, 모든 버스 통신은 전용 스레드 1개에서 순서대로 처리
+    - 연속된 주소의 코일은 한 번의 다중 코일 쓰기(FC15)로 묶어서 전송
+    - pulse_coil 은 ON 전송 후 바로 반환, OFF 는 버스 스레드가 시각에 맞춰 전송 (실패 시 성공할 때까지 재시도)
+    - pymodbus 가 없거나 연결에 실패하면 가상 모드 (로그만 출력)
+    """
+    READ_CACHE_SEC = 0.1   # 입력(DI) 읽기 캐시 유효 시간
+    PULSE_OFF_RETRY_SEC = 0.5  # 펄스 OFF 전송 실패 시 재시도 간격 (성공할 때까지)
+
+    def __init__(self, port='/dev/ttyUSB485', baudrate=9600, timeout=0.3):
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.client = None
+        self.connected = False
+        self.virtual = True
+
+        self.jobs = queue.Queue()
+        self.pulses = []          # (off_at, seq, unit, addr) 힙
+        self.pulse_deadline = {}  # (unit, addr) -> off_at (다시 펄스하면 이전 OFF 예약 무시)
+        self.pulse_seq = 0
+        self.pulse_lock = threading.Lock()
+        self.coils = {}           # (unit, addr) -> 마지막으로 쓴 값
+        self.input_cache = {}     # (unit, addr) -> (value, 읽은 시각)
+        self.bus_thread = None
+        logger.info(f"IO Controller initialized on {port}")
+
+    def connect(self):
+        try:
+            try:
+                from pymodbus.client.sync import ModbusSerialClient
+            except ImportError:
+                raise Exception("pymodbus not installed")
+            self.client = ModbusSerialClient(method='rtu', port=self.port, baudrate=self.baudrate, timeout=self.timeout)
+            if not self.client.connect():
+                raise Exception(f"Cannot open {self.port}")
+            self.connected = True
+            self.virtual = False
+            logger.info(f"[Device] Connected: {self.port} ({self.baudrate}bps)")
+            return True
+        except Exception as e:
+            logger.error(f"[Device] Connection Failed: {e}")
+            self.client = None
+            self.connected = True   # 가상 모드로 계속 동작
+            self.virtual = True
+            return False
+        finally:
+            self._ensure_bus_thread()
+
+    def close(self):
+        """예약된 펄스 OFF 를 바로 전송한 뒤 연결 종료 (서버 종료 시 코일이 ON 으로 남지 않도록)"""
+        if not (self.bus_thread and self.bus_thread.is_alive()):
+            return
+        with self.pulse_lock:
+            due = {}
+            for (unit, addr) in self.pulse_deadline:
+                due.setdefault(unit, {})[addr] = False
+            self.pulse_deadline.clear()
+            self.pulses.clear()
+
+        def _close():
+            for unit, changes in due.items():
+                try:
+                    self._write_bits(unit, changes)
+                except Exception as e:
+                    logger.error(f"[IO] Pulse OFF Error on close (unit {unit}, {sorted(changes)}): {e}")
+            if self.client:
+                self.client.close()
+
+        self._submit(_close)
+        logger.info("[Device] Closed")
+
+    # =============================================
+    # --- 버스 트랜잭션 스레드 ---
+    # =============================================
+
+    def _ensure_bus_thread(self):
+        if not (self.bus_thread and self.bus_thread.is_alive()):
+            self.bus_thread = threading.Thread(target=self._bus_loop, daemon=True)
+            self.bus_thread.start()
+
+    def _bus_loop(self):
+        while True:
+            with self.pulse_lock:
+                wait = self.pulses[0][0] - time.time() if self.pulses else None
+            try:
+                job = self.jobs.get(timeout=max(0.0, wait) if wait is not None else None)
+            except queue.Empty:
+                job = None
+            if job:
+                fn, result = job
+                try:
+                    result['value'] = fn()
+                except Exception as e:
+                    result['error'] = e
+                result['done'].set()
+            self._expire_pulses()
+
+    def _submit(self, fn, wait=True):
+        """버스 스레드에서 fn 실행 (wait=True 이면 결과 반환, 예외는 그대로 전달)"""
+        self._ensure_bus_thread()
+        result = {'done': threading.Event()}
+        self.jobs.put((fn, result))
+        if not wait:
+            return None
+        result['done'].wait()
+        if 'error' in result:
+            raise result['error']
+        return result.get('value')
+
+    def _call(self, method, *args, unit):
+        """클라이언트 호출 (오류 시 재연결 후 1회 재시도) - 버스 스레드 전용"""
+        for attempt in range(2):
+            try:
+                if not self.client.is_socket_open():
+                    self.client.connect()
+                res = getattr(self.client, method)(*args, unit=unit)
+                if res is None or res.isError():
+                    raise Exception(f"{method} failed: {res}")
+                return res
+            except Exception:
+                self.client.close()
+                if attempt == 1:
+                    raise
+
+    def _write_bits(self, unit, changes):
+        """
+        {addr: bool} 를 연속 주소 단위로 묶어 전송 - 버스 스레드 전용
+        1개면 FC5 (write_coil), 2개 이상 연속이면 FC15 (write_coils)
+        """
+        addrs = sorted(changes)
+        runs, start = [], 0
+        for i in range(1, len(addrs) + 1):
+            if i == len(addrs) or addrs[i] != addrs[i - 1] + 1:
+                runs.append(addrs[start:i])
+                start = i
+        for run in runs:
+            values = [bool(changes[a]) for a in run]
+            if self.virtual:
+                logger.info(f"[IO] Unit {unit} : Write {run[0]}~{run[-1]} -> {['ON' if v else 'OFF' for v in values]}")
+            elif len(run) == 1:
+                self._call('write_coil', run[0], values[0], unit=unit)
+            else:
+                self._call('write_coils', run[0], values, unit=unit)
+            for a, v in zip(run, values):
+                self.coils[(unit, a)] = v
+
+    def _schedule_off(self, unit, addr, off_at):
+        """펄스 OFF 예약 (pulse_lock 안에서 호출)"""
+        self.pulse_seq += 1
+        self.pulse_deadline[(unit, addr)] = off_at
+        heapq.heappush(self.pulses, (off_at, self.pulse_seq, unit, addr))
+
+    def _expire_pulses(self):
+        """
+        시각이 된 펄스 OFF 를 유닛별로 모아서 전송.
+        전송에 실패하면 OFF 를 다시 예약해서 코일이 ON 으로 남지 않게 함
+        (그 사이 직접 쓰거나 다시 펄스한 코일은 pulse_deadline 이 바뀌므로 재시도하지 않음)
+        """
+        now = time.time()
+        due = {}
+        with self.pulse_lock:
+            while self.pulses and self.pulses[0][0] <= now:
+                off_at, _, unit, addr = heapq.heappop(self.pulses)
+                if self.pulse_deadline.get((unit, addr)) == off_at:
+                    due.setdefault(unit, {})[addr] = off_at
+        for unit, deadlines in due.items():
+            try:
+                self._write_bits(unit, {addr: False for addr in deadlines})
+                ok = True
+            except Exception as e:
+                logger.error(f"[IO] Pulse OFF Error (unit {unit}, {sorted(deadlines)}), retry in {self.PULSE_OFF_RETRY_SEC}s: {e}")
+                ok = False
+            retry_at = time.time() + self.PULSE_OFF_RETRY_SEC
+            with self.pulse_lock:
+                for addr, off_at in deadlines.items():
+                    if self.pulse_deadline.get((unit, addr)) != off_at:
+                        continue
+                    if ok:
+                        del self.pulse_deadline[(unit, addr)]
+                    else:
+                        self._schedule_off(unit, addr, retry_at)
+
+    # =============================================
+    # --- 공개 API ---
+    # =============================================
+
+    def write_coil(self, unit, addr, val):
+        """범용 출력 제어 (ON/OFF)"""
+        return self.write_coils(unit, addr, [val])
+
+    def write_coils(self, unit, addr, values):
+        """연속 출력 일괄 제어 (예: 시럽 뱅크 DO_SYRUP_BASE ~ +7) - 한 번의 FC15 전송"""
+        if not self.connected:
+            logger.warning("[Device] Not connected")
+            return False
+        changes = {addr + i: bool(v) for i, v in enumerate(values)}
+        with self.pulse_lock:
+            # 직접 쓴 코일은 예약된 펄스 OFF 대상에서 제외
+            for a in changes:
+                self.pulse_deadline.pop((unit, a), None)
+        try:
+            self._submit(lambda: self._write_bits(unit, changes))
+            if not self.virtual:
+                logger.info(f"[IO] Unit {unit} : Write {addr}~{addr + len(values) - 1} -> {[int(bool(v)) for v in values]}")
+            return True
+        except Exception as e:
+            logger.error(f"[IO] Write Error: {e}")
+            return False
+
+    def read_input(self, unit, addr, max_age=None):
+        """범용 입력 읽기 (DI) - max_age초 이내에 읽은 값이 있으면 재사용"""
+        if not self.connected: return 0
+        if max_age is None:
+            max_age = self.READ_CACHE_SEC
+        cached = self.input_cache.get((unit, addr))
+        if cached and time.time() - cached[1] <= max_age:
+            return cached[0]
+        try:
+            if self.virtual:
+                value = 1 # 가상 값 (1: 센서 감지됨)
+            else:
+                res = self._submit(lambda: self._call('read_discrete_inputs', addr, 1, unit=unit))
+                value = int(res.bits[0])
+            self.input_cache[(unit, addr)] = (value, time.time())
+            return value
+        except Exception as e:
+            logger.error(f"[IO] Read Error: {e}")
+            return -1
+
+    def read_coil(self, unit, addr, count=1):
+        """범용 출력 상태 읽기 (DO)"""
+        if not self.connected: return 0
+        try:
+            if self.virtual:
+                return 1 # 가상 값
+            res = self._submit(lambda: self._call('read_coils', addr, count, unit=unit))
+            return int(res.bits[0]) if count == 1 else [int(b) for b in res.bits[:count]]
+        except Exception as e:
+            logger.error(f"[IO] Read Coil Error: {e}")
+            return -1
+
+    def pulse_coils(self, unit, durations):
+        """
+        여러 코일 동시 펄스 {addr: 초}. 연속 주소는 한 번에 ON, OFF 는 시각별로 묶어서 전송.
+        ON 전송이 끝나면 바로 반환 (호출 스레드는 대기하지 않음)
+        """
+        logger.info(f"[IO] Pulse Unit {unit} {durations}")
+        if not self.connected:
+            logger.warning("[Device] Not connected")
+            return False
+        changes = {addr: True for addr in durations}
+
+        def start():
+            now = time.time()  # OFF 도 같은 전송 지연을 겪으므로 ON 전송 시작 시각 기준
+            # OFF 를 먼저 예약: ON 전송 도중 실패해도 이미 켜진 코일은 예정 시각에 꺼짐
+            with self.pulse_lock:
+                for addr, sec in durations.items():
+                    self._schedule_off(unit, addr, now + max(0.0, float(sec)))
+            self._write_bits(unit, changes)
+
+        try:
+            self._submit(start)
+            return True
+        except Exception as e:
+            logger.error(f"[IO] Pulse Error: {e}")
+            return False
+
+    def pulse_coil(self, unit, addr, duration):
+        """
+        범용 펄스 제어 (ON -> duration 후 OFF)
+        """
+        return self.pulse_coils(unit, {addr: duration})
@@ -3,12 +3,15 @@ import json
 import time
 import queue
 import threading
+import signal
 import logging
+from collections import deque
 from logging.handlers import RotatingFileHandler
 from flask import Flask, jsonify, request
 from flask_cors import CORS
 from neuromeka import IndyDCP3
 from db_manager import DBManager
+from device_controller import DeviceController
 
 # ==========================================
 # [Logger Setup]
@@ -17,6 +20,7 @@ from db_manager import DBManager
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.dirname(BASE_DIR)
 RECIPE_PATH = os.path.join(PROJECT_ROOT, "config", "recipe.json")
+CONFIG_PATH = os.path.join(PROJECT_ROOT, "config", "config.json")
 LOG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'logs')
 if not os.path.exists(LOG_DIR):
     os.makedirs(LOG_DIR)
@@ -43,8 +47,6 @@ logger.addHandler(console_handler)
 app = Flask(__name__)
 CORS(app)
 
-order_queue = queue.Queue()
-
 current_processing_order = None
 completed_orders_list = []
 
@@ -91,107 +93,106 @@ DO_SYRUP_BASE = 3300 # 3300 ~ 3307
 DI_CUP_SENSOR = 6
 
 
-class DeviceController:
-    """
-    범용 IO 제어 클래스 (Modbus RTU)
-    - 특정 장비(컵, 얼음)에 종속되지 않고 write, read, pulse 기능만 제공
-    """
-    def __init__(self, port='/dev/ttyUSB485', baudrate=9600):
-        self.port = port
-        self.baudrate = baudrate
-        self.client = None
-        self.connected = False
-        logger.info(f"IO Controller initialized on {port}")
-
-    def connect(self):
-        try:
-            # 실제 연결 코드 (나중에 주석 해제)
-            # from pymodbus.client.sync import ModbusSerialClient
-            # self.client = ModbusSerialClient(method='rtu', port=self.port, baudrate=self.baudrate, timeout=1)
-            # self.connected = self.client.connect()
-            
-            # [가상 연결 성공]
-            self.connected = True
-            logger.info("[Device] Connected (Virtual)")
-            return True
-        except Exception as e:
-            logger.error(f"[Device] Connection Failed: {e}")
-            self.connected = False
-            return False
-
-    def write_coil(self, unit, addr, val):
-        """범용 출력 제어 (ON/OFF)"""
-        if not self.connected:
-            logger.warning("[Device] Not connected")
-            return False
-            
-        try:
-            # 실제 코드: self.client.write_coil(addr, val, unit=unit)
-            state = "ON" if val else "OFF"
-            logger.info(f"[IO] Unit {unit} : Write {addr} -> {state}")
-            return True
-        except Exception as e:
-            logger.error(f"[IO] Write Error: {e}")
-            return False
-
-    def read_input(self, unit, addr):
-        """범용 입력 읽기 (DI)"""
-        if not self.connected: return 0
-        try:
-            # 실제 코드: res = self.client.read_discrete_inputs(addr, 1, unit=unit)
-            # return res.bits[0]
-            return 1 # 가상 값 (1: 센서 감지됨)
-        except Exception as e:
-            logger.error(f"[IO] Read Error: {e}")
-            return -1
-            
-    def read_coil(self, unit, addr, count=1):
-        """범용 출력 상태 읽기 (DO)"""
-        if not self.connected: return 0
-        try:
-            # 실제 코드: res = self.client.read_coils(addr, count, unit=unit)
-            # return res.bits[0] if count == 1 else res.bits
-            return 1 # 가상 값
-        except Exception as e:
-            logger.error(f"[IO] Read Coil Error: {e}")
-            return -1
-
-    def pulse_coil(self, unit, addr, duration):
-        """
-        범용 펄스 제어 (ON -> 대기 -> OFF)
-        """
-        logger.info(f"[IO] Pulse Unit {unit} Addr {addr} ({duration}s)")
-        if self.write_coil(unit, addr, True):
-            time.sleep(duration)
-            self.write_coil(unit, addr, False)
-            return True
-        return False
-
 class RobotController:
+  """
+  로봇 컨트롤러 연결 + 레지스터/상태 스냅샷
+  - 폴링 스레드 1개가 정수 변수 전체를 한 번에 읽어 스냅샷으로 보관 (모든 스레드가 공유)
+  - 정수 변수는 값을 기다리는 스레드가 있을 때만 SNAPSHOT_FAST 주기로 조회
+  - 로봇 상태는 SNAPSHOT_IDLE 주기로 조회 (모니터/상태 API는 스냅샷 사용)
+  - 컨트롤러 호출은 io_lock 으로 직렬화
+  """
+  SNAPSHOT_FAST = 0.08   # 대기 중인 스레드가 있을 때 조회 주기 (ACK 감지 지연)
+  SNAPSHOT_IDLE = 1.0    # 평소 조회 주기 (상태 모니터 주기와 동일)
+  SNAPSHOT_STALE = 0.5   # 이보다 오래된 스냅샷이면 read_register 가 직접 조회
+
   def __init__(self, ip):
      self.ip = ip
      self.client = None
      self.is_running = False
+     self.io_lock = threading.Lock()
+     self.snapshot_cond = threading.Condition()
+     self.int_vars = {}          # addr -> value
+     self.snapshot_at = 0.0      # 스냅샷 조회 시작 시각
+     self.written = {}           # addr -> (value, 쓴 시각): 쓰기 전에 시작된 조회 결과로 덮어쓰지 않도록
+     self.robot_data = None
+     self.robot_data_at = 0.0
+     self.waiters = 0
+     self.poll_thread = None
+     self.polling = False
      
   def connect(self):
     try:
       self.client = IndyDCP3(self.ip)
       logger.info(f"[Robot] Connected: {self.ip}")
+      self._ensure_poller()
       return True
     except Exception as e:
       logger.error(f"[Robot] Connection Failed: {e}")
       self.client = None
       return False
     
+  def _ensure_poller(self):
+    if self.client is not None and not (self.poll_thread and self.poll_thread.is_alive()):
+      self.polling = True
+      self.poll_thread = threading.Thread(target=self._poll_loop, daemon=True)
+      self.poll_thread.start()
+
+  def _fetch_int_vars(self):
+    started = time.time()
+    with self.io_lock:
+      response = self.client.get_int_variable()
+    values = {int(v['addr']): int(v['value']) for v in response.get('variables', [])}
+    with self.snapshot_cond:
+      for addr, (value, written_at) in self.written.items():
+        if written_at >= started:
+          values[addr] = value
+      self.int_vars = values
+      self.snapshot_at = started
+      self.snapshot_cond.notify_all()
+
+  def _fetch_robot_data(self):
+    with self.io_lock:
+      data = self.client.get_robot_data()
+    with self.snapshot_cond:
+      self.robot_data = data
+      self.robot_data_at = time.time()
+
+  def close(self):
+    """스냅샷 스레드 종료 후 연결 해제 (서버 종료 시)"""
+    self.polling = False
+    with self.snapshot_cond:
+      self.snapshot_cond.notify_all()
+    if self.poll_thread:
+      self.poll_thread.join(timeout=2)
+    self.client = None
+    logger.info("[Robot] Disconnected")
+
+  def _poll_loop(self):
+    last_error = None
+    while self.polling:
+      try:
+        if self.waiters:
+          self._fetch_int_vars()
+        if time.time() - self.robot_data_at >= self.SNAPSHOT_IDLE:
+          self._fetch_robot_data()
+        last_error = None
+      except Exception as e:
+        if str(e) != last_error:
+          logger.error(f"[Robot] Snapshot Error: {e}")
+          last_error = str(e)
+      with self.snapshot_cond:
+        if self.waiters == 0 and self.polling:
+          # 대기자가 생기면 wait_for_value 가 notify → 바로 빠른 주기로 전환
+          self.snapshot_cond.wait(self.SNAPSHOT_IDLE)
+      if self.waiters:
+        time.sleep(self.SNAPSHOT_FAST)
+
   def read_register(self, address):
     try:
       if self.client is None: return -1
-      response = self.client.get_int_variable()
-      variables = response.get('variables', [])
-      for v in variables:
-        if v['addr'] == address:
-          return int(v['value'])
-      return -1
+      if time.time() - self.snapshot_at > self.SNAPSHOT_STALE:
+        self._fetch_int_vars()
+      return self.int_vars.get(address, -1)
     except Exception as e:
       logger.error(f"[Robot] Read Error: {e}")
       return -1
@@ -200,12 +201,41 @@ class RobotController:
     try:
       if self.client is None: return False
       data = [{'addr': address, 'value': value}]
-      self.client.set_int_variable(int_variables=data)
+      with self.io_lock:
+        self.client.set_int_variable(int_variables=data)
+      with self.snapshot_cond:
+        self.written[address] = (value, time.time())
+        self.int_vars[address] = value
       return True
     except Exception as e:
       logger.error(f"[Robot] Write Error: {e}")
       return False
-    
+
+  def wait_for_value(self, address, match, timeout):
+    """
+    스냅샷에서 address 값이 match(value)를 만족할 때까지 대기 후 값 반환 (시간 초과: None)
+    호출 이후에 조회된 스냅샷만 확인 (이전 주기의 값으로 잘못 판단하지 않도록)
+    """
+    if self.client is None: return None
+    self._ensure_poller()
+    since = time.time()
+    deadline = since + timeout
+    with self.snapshot_cond:
+      self.waiters += 1
+      self.snapshot_cond.notify_all()
+      try:
+        while True:
+          if self.snapshot_at >= since:
+            value = self.int_vars.get(address)
+            if value is not None and match(value):
+              return value
+          remaining = deadline - time.time()
+          if remaining <= 0:
+            return None
+          self.snapshot_cond.wait(remaining)
+      finally:
+        self.waiters -= 1
+
   def send_command(self, cmd_code):
     try:
       if self.write_register(REG_CMD, cmd_code):
@@ -218,15 +248,11 @@ class RobotController:
       return False
     
   def wait_for_init(self, init_code, timeout=60):
-    start_time = time.time()
     try:
-      while time.time() - start_time < timeout:
-        current_val = self.read_register(REG_INIT)
-        if current_val == init_code:
-          logger.info(f"[Robot] Init code {init_code} received")
-          self.write_register(REG_INIT, 0)
-          return True
-        time.sleep(0.5)
+      if self.wait_for_value(REG_INIT, lambda v: v == init_code, timeout) is not None:
+        logger.info(f"[Robot] Init code {init_code} received")
+        self.write_register(REG_INIT, 0)
+        return True
       raise Exception(f"Timeout waiting for init code {init_code}")
     except Exception as e:
       logger.error(f"[Robot] Wait Init Error: {e}")
@@ -234,26 +260,26 @@ class RobotController:
       return False
       
   def wait_for_register(self, address, target_value, timeout=10, auto_reset=True):
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        val = self.read_register(address)
-        
-        if val != 0:
-          logger.info(f"[Robot] Register {address} received response: {val}")
-          if auto_reset:
-              self.write_register(address, 0)
-              logger.info(f"[Robot] Register {address} reset to 0")
-          return val
-          
-        time.sleep(0.5)
+    val = self.wait_for_value(address, lambda v: v != 0, timeout)
+    if val is not None:
+      logger.info(f"[Robot] Register {address} received response: {val}")
+      if auto_reset:
+          self.write_register(address, 0)
+          logger.info(f"[Robot] Register {address} reset to 0")
+      return val
         
     logger.error(f"[Robot] Timeout waiting for Register {address} -> {target_value}")
     return 0
     
-  def get_robot_status(self):
+  def get_robot_status(self, max_age=None):
+      """로봇 상태 (스냅샷이 max_age초 이내면 재사용, 기본 SNAPSHOT_IDLE의 2배)"""
       if self.client is None: return None
       try:
-        status_data = self.client.get_robot_data()
+        if max_age is None:
+          max_age = self.SNAPSHOT_IDLE * 2
+        if self.robot_data is None or time.time() - self.robot_data_at > max_age:
+          self._fetch_robot_data()
+        status_data = self.robot_data
         op_state = status_data.get('op_state')
         if op_state == 0:   return "OFFLINE"
         if op_state in [2, 15]: return "ERROR_VIOLATION"
@@ -270,12 +296,13 @@ class RobotController:
       
   def start_program(self):
     try:
-      current_status = self.get_robot_status()
+      current_status = self.get_robot_status(max_age=0)
       if current_status != "READY":
         logger.warning(f"[Robot] Start Failed: Not at Home or Station ({current_status})")
         return False
       if self.client:
-        self.client.play_program(prog_idx=1)
+        with self.io_lock:
+          self.client.play_program(prog_idx=1)
       self.is_running = True
       logger.info("[System] Program Started (Auto Mode ON)")
       return True
@@ -286,7 +313,8 @@ class RobotController:
   def stop_program(self):
     try:
       if self.client:
-        self.client.stop_program()
+        with self.io_lock:
+          self.client.stop_program()
       self.is_running = False
       logger.info("[System] Program Stopped (Auto Mode OFF)")
       return True
@@ -296,37 +324,253 @@ class RobotController:
     
   def move_home(self):
     try:
-      current_status = self.get_robot_status()
+      current_status = self.get_robot_status(max_age=0)
       UNSAFE_STATES = ["ERROR_VIOLATION", "COLLIDED", "EMERGENCY_STOP", "RECOVERING", "TEACHING_MODE"]
       if current_status in UNSAFE_STATES:
         logger.warning(f"[Robot] Move Home Failed: Unsafe State ({current_status})")
         return False
       if self.client:
-        self.client.move_home()
+        with self.io_lock:
+          self.client.move_home()
         logger.info("[Robot] Moving to Home...")
         return True
     except Exception as e:
       logger.error(f"[Robot] Move Home Error: {e}")
       return False
 
+class PickupSlotManager:
+    """
+    픽업 슬롯 상태 관리 (스레드 안전)
+    - reserve(): 빈 슬롯을 예약 (없으면 release 신호가 올 때까지 대기) → 같은 슬롯을 두 워커가 잡을 수 없음
+    - occupy(): 서빙 완료 후 사용중 표시, release(): 픽업 완료 후 비움 (대기 중인 워커 즉시 깨움)
+    - DB 반영은 별도 스레드에서 순서대로 처리 (요청/로봇 흐름을 막지 않음)
+    """
+    EMPTY, RESERVED, OCCUPIED = "EMPTY", "RESERVED", "OCCUPIED"
+
+    def __init__(self, db, initial):
+        self.db = db
+        self.slots = {slot: (self.OCCUPIED if occupied else self.EMPTY) for slot, occupied in sorted(initial.items())}
+        self.cond = threading.Condition()
+        self.db_queue = queue.Queue()
+        threading.Thread(target=self._db_worker, daemon=True).start()
+
+    def _db_worker(self):
+        while True:
+            slot, occupied = self.db_queue.get()
+            try:
+                self.db.update_slot_status(slot, occupied)
+            except Exception as e:
+                logger.error(f"[Pickup] DB Update Error (slot {slot}): {e}")
+
+    def reserve(self, should_wait=lambda: True, check_interval=1.0):
+        """빈 슬롯 예약 후 번호 반환. should_wait()가 False가 되면 None"""
+        with self.cond:
+            warned = False
+            while True:
+                for slot, state in self.slots.items():
+                    if state == self.EMPTY:
+                        self.slots[slot] = self.RESERVED
+                        return slot
+                if not warned:
+                    logger.warning("[Pickup] No available pickup slot")
+                    warned = True
+                # release()가 notify → 즉시 깨어남 (check_interval은 정지 여부 확인용)
+                self.cond.wait(check_interval)
+                if not should_wait():
+                    return None
+
+    def occupy(self, slot):
+        with self.cond:
+            self.slots[slot] = self.OCCUPIED
+        self.db_queue.put((slot, True))
+
+    def release(self, slot):
+        """슬롯 비움 (예약 취소 포함). 없는 슬롯이면 False"""
+        with self.cond:
+            if slot not in self.slots:
+                return False
+            was_occupied = self.slots[slot] == self.OCCUPIED
+            self.slots[slot] = self.EMPTY
+            self.cond.notify_all()
+        if was_occupied:
+            self.db_queue.put((slot, False))
+        return True
+
+    def snapshot(self):
+        with self.cond:
+            return dict(self.slots)
+
 # 전역 객체 생성
 robot = RobotController("192.168.0.7")
 device = DeviceController("/dev/ttyUSB485") 
+slot_manager = PickupSlotManager(db, pickup_slots)
     
 '''
     utility function area
 ''' 
-def load_recipe():
+class RecipeCache:
+  """
+  recipe.json 캐시 (menu_code -> recipe)
+  - 파일의 mtime/크기가 바뀐 경우에만 다시 읽고, 새 dict를 만든 뒤 통째로 교체
+  - 읽기 실패 시 마지막으로 정상 로드한 레시피를 계속 사용 (다음 확인 때 재시도)
+  """
+  CHECK_INTERVAL = 1.0  # 파일 변경 확인 주기 (초)
+
+  def __init__(self, path):
+    self.path = path
+    self.recipes = None     # 아직 한 번도 로드 못 함
+    self.signature = None   # (mtime_ns, size)
+    self.checked_at = 0.0
+    self.lock = threading.Lock()
+
+  def _stat(self):
+    st = os.stat(self.path)
+    return (st.st_mtime_ns, st.st_size)
+
+  def refresh(self, force=False):
+    now = time.time()
+    if not force and self.recipes is not None and now - self.checked_at < self.CHECK_INTERVAL:
+      return
+    with self.lock:
+      if not force and self.recipes is not None and now - self.checked_at < self.CHECK_INTERVAL:
+        return
+      self.checked_at = now
+      try:
+        signature = self._stat()
+        if not force and signature == self.signature:
+          return
+        with open(self.path, "r", encoding='utf-8') as f:
+          data = json.load(f)
+        recipes = {int(r['menu_code']): r for r in data}
+      except Exception as e:
+        logger.error(f"[Config] Recipe Load Error: {e}")
+        return
+      self.recipes = recipes
+      self.signature = signature
+      logger.info(f"[Config] Recipes Loaded: {len(recipes)} menus")
+
+  def get(self, menu_code):
+    self.refresh()
+    recipes = self.recipes
+    if recipes is None:
+      return None
+    return recipes.get(menu_code)
+
+  def is_loaded(self):
+    self.refresh()
+    return self.recipes is not None
+
+recipe_cache = RecipeCache(RECIPE_PATH)
+
+class OrderQueue:
+  """
+  주문 대기열 (order_logs 상태 기반)
+  - 접수: order_logs 에 WAITING 으로 기록 후 메모리 대기열에 추가
+  - 처리 시작/완료/실패: PROCESSING / DONE / FAILED (DB 반영은 별도 스레드에서 상태별로 묶어서 UPDATE)
+  - 오류로 로봇이 멈춰도 대기 주문은 버리지 않음 (WAITING 유지 → 복구 후 이어서 처리)
+  - 재시작/복구 시 WAITING 주문을 쿼리 1회로 다시 적재
+  """
+  def __init__(self, db):
+    self.db = db
+    self.items = deque()      # {'id', 'menu_code', 'menu_name'} (id None: DB 기록 실패)
+    self.cond = threading.Condition()
+    self.status_queue = queue.Queue()
+    threading.Thread(target=self._status_worker, daemon=True).start()
+
+  def put(self, menu_code, menu_name):
+    # INSERT 와 append 를 같은 락 안에서 처리 (reload 가 그 사이에 WAITING 행을 읽어 같은 주문이 두 번 들어가지 않도록)
+    with self.cond:
+      order_id = self.db.log_order(menu_code=menu_code, menu_name=menu_name, status="WAITING")
+      if order_id is None:
+        logger.warning(f"[Queue] Order not persisted (DB unavailable): {menu_name}")
+      self.items.append({'id': order_id, 'menu_code': menu_code, 'menu_name': menu_name})
+      self.cond.notify()
+    return order_id
+
+  def get(self, timeout=None):
+    """다음 주문을 꺼내 PROCESSING 으로 표시 (timeout 동안 없으면 None)"""
+    with self.cond:
+      if not self.cond.wait_for(lambda: self.items, timeout):
+        return None
+      order = self.items.popleft()
+      self.set_status(order, "PROCESSING")
+    return order
+
+  def empty(self):
+    return not self.items
+
+  def qsize(self):
+    return len(self.items)
+
+  def set_status(self, order, status):
+    if order.get('id') is not None:
+      self.status_queue.put((order['id'], status))
+
+  def _status_worker(self):
+    while True:
+      batch = [self.status_queue.get()]
+      while True:
+        try:
+          batch.append(self.status_queue.get_nowait())
+        except queue.Empty:
+          break
+      # 같은 주문은 마지막 상태만 반영, 상태별로 한 번에 UPDATE
+      latest = {}
+      for order_id, status in batch:
+        latest[order_id] = status
+      by_status = {}
+      for order_id, status in latest.items():
+        by_status.setdefault(status, []).append(order_id)
+      for status, order_ids in by_status.items():
+        if not self.db.update_order_status(order_ids, status):
+          logger.error(f"[Queue] Status update failed: {order_ids} -> {status}")
+      for _ in batch:
+        self.status_queue.task_done()
+
+  def reload(self, startup=False):
+    """
+    DB의 WAITING 주문으로 대기열 재구성 (쿼리 1회).
+    startup=True 이면 재시작 전 제조 중(PROCESSING)이던 주문은 FAILED 로 정리
+    """
+    started = time.time()
+    with self.cond:
+      # 아직 반영 안 된 상태 변경을 먼저 반영 (꺼낸 주문이 WAITING 으로 다시 읽히지 않도록)
+      self.status_queue.join()
+      rows = self.db.load_waiting_orders(interrupted_status="FAILED" if startup else None)
+      if rows is None:
+        logger.warning("[Queue] Reload skipped (DB unavailable)")
+        return False
+      unsaved = [o for o in self.items if o['id'] is None]
+      self.items = deque([{'id': r['id'], 'menu_code': r['menu_code'], 'menu_name': r['menu_name']} for r in rows] + unsaved)
+      self.cond.notify_all()
+    logger.info(f"[Queue] Reloaded {len(rows)} WAITING orders ({(time.time() - started) * 1000:.1f}ms)")
+    return True
+
+order_queue = OrderQueue(db)
+
+# HTTP 서버 설정 (config.json 의 http_server 로 덮어씀)
+HTTP_DEFAULTS = {
+  'mode': 'waitress',        # waitress | dev (Flask 개발 서버)
+  'port': 5000,
+  'threads': 8,              # 요청 처리 스레드 수
+  'connection_limit': 100,
+  'channel_timeout': 120,    # keep-alive 유휴 연결 유지 시간 (초)
+  'backlog': 1024,
+  'shutdown_timeout': 5,     # 종료 시 작업 스레드/주문 상태 반영 최대 대기 (초)
+}
+
+def load_http_config():
+  conf = dict(HTTP_DEFAULTS)
   try:
-    with open(RECIPE_PATH, "r", encoding='utf-8') as f:
-      return json.load(f)
+    with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
+      conf.update(json.load(f).get('http_server', {}))
+  except FileNotFoundError:
+    pass
   except Exception as e:
-    logger.error(f"[Config] Load Error: {e}")
-    return []
-  
-def clear_queue(q):
-  with q.mutex:
-    q.queue.clear()
+    logger.warning(f"[System] HTTP config load failed, using defaults: {e}")
+  return conf
+
+shutdown_event = threading.Event()  # 종료 신호 (작업/모니터 스레드 종료)
      
 '''
     EndPoint Area
@@ -334,11 +578,9 @@ def clear_queue(q):
 
 @app.route('/pickup/complete/<int:slot_idx>', methods=['GET'])
 def pickup_complete(slot_idx):
-  if slot_idx in pickup_slots:
-    pickup_slots[slot_idx] = False
-    db.update_slot_status(slot_idx, False)
+  if slot_manager.release(slot_idx):
     logger.info(f"[Pickup] Slot {slot_idx} completed")
-    logger.info(f"[API] Slot {slot_idx} is now EMPTY (DB Updated)")
+    logger.info(f"[API] Slot {slot_idx} is now EMPTY")
     return jsonify({"status": "success", "message": f"Slot {slot_idx} completed"})
   else:
     return jsonify({"status": "error", "message": "Invalid slot index"}), 400
@@ -347,6 +589,7 @@ def pickup_complete(slot_idx):
 def set_robot_status(status):
     if status == 1:
       if robot.start_program():
+        order_queue.reload()
         return jsonify({"status": "success", "message": "Program started"})
       else:
         return jsonify({"status": "error", "message": "Failed to start program"}), 500
@@ -377,17 +620,25 @@ def order_api(menu_code):
   if not robot.is_running:
     return jsonify({"status": "error", "message": "Robot is stopped"}), 503
   
-  recipes = load_recipe()
-  target = next((r for r in recipes if r['menu_code'] == menu_code), None)
+  if not recipe_cache.is_loaded():
+    return jsonify({"status": "error", "message": "Recipe unavailable"}), 503
+  target = recipe_cache.get(menu_code)
   
   if target:
-    db.log_order(menu_code=menu_code, menu_name=target['menu_name'], status="WAITING")
-    order_queue.put(target)
+    order_queue.put(menu_code, target['menu_name'])
     logger.info(f"[Order] Received: {target['menu_name']}")
     return jsonify({"status": "success", "message": f"Ordered {target['menu_name']}"})
   else:
     return jsonify({"status": "error", "message": "Menu not found"}), 404
 
+@app.route('/pickup/slots', methods=['GET'])
+def pickup_slots_api():
+  return jsonify({"status": "success", "slots": slot_manager.snapshot()})
+
+@app.route('/sequence/timings', methods=['GET'])
+def sequence_timings_api():
+  return jsonify({"status": "success", "timings": list(sequence_timings)})
+
 # [추가] 범용 IO 제어 엔드포인트
 @app.route('/io/write/<int:unit>/<int:addr>/<int:val>', methods=['GET'])
 def api_io_write(unit, addr, val):
@@ -395,6 +646,15 @@ def api_io_write(unit, addr, val):
         return jsonify({"status": "success", "msg": f"Write Unit{unit} Addr{addr} -> {val}"})
     return jsonify({"status": "error", "msg": "IO Write Failed"}), 500
 
+@app.route('/io/write_bank/<int:unit>/<int:addr>/<string:bits>', methods=['GET'])
+def api_io_write_bank(unit, addr, bits):
+    """연속 코일 일괄 쓰기 (예: /io/write_bank/6/3300/10100000 → 시럽 1, 3번 ON)"""
+    if not bits or any(b not in '01' for b in bits):
+        return jsonify({"status": "error", "msg": "bits must be 0/1"}), 400
+    if device.write_coils(unit, addr, [b == '1' for b in bits]):
+        return jsonify({"status": "success", "msg": f"Write Unit{unit} Addr{addr}~{addr + len(bits) - 1} -> {bits}"})
+    return jsonify({"status": "error", "msg": "IO Write Failed"}), 500
+
 @app.route('/io/pulse/<int:unit>/<int:addr>/<float:duration>', methods=['GET'])
 def api_io_pulse(unit, addr, duration):
     if device.pulse_coil(unit, addr, duration):
@@ -408,125 +668,149 @@ def monitor_worker(robot_instance):
   logger.info("[Monitor] Started")
   ERROR_STATES = ["ERROR_VIOLATION", "COLLIDED", "EMERGENCY_STOP", "TEACHING_MODE"]
   
-  while True:
+  while not shutdown_event.is_set():
     try:
       status = robot_instance.get_robot_status()
       if robot_instance.is_running and (status in ERROR_STATES):
         logger.critical(f"[Monitor] Emergency Stop Triggered: {status}")
         robot_instance.stop_program()
-        clear_queue(order_queue)
-        logger.info("[Monitor] Queue cleared & Robot stopped")
-      time.sleep(1)
+        logger.info(f"[Monitor] Robot stopped, {order_queue.qsize()} orders kept WAITING")
+      shutdown_event.wait(1)
     except Exception as e:
       logger.error(f"[Monitor] Error: {e}")
-      time.sleep(1)
+      shutdown_event.wait(1)
+  logger.info("[Monitor] Stopped")
 
 def robot_worker(robot_instance):
   logger.info("[Worker] Started")
-  while True:
+  while not shutdown_event.is_set():
     try:
       if not robot_instance.is_running:
-        time.sleep(1)
+        shutdown_event.wait(1)
         continue
-      try:
-        recipe = order_queue.get(timeout=1)
-      except queue.Empty:
+      order = order_queue.get(timeout=1)
+      if order is None:
         continue
       
-      if recipe is None: break
+      recipe = recipe_cache.get(order['menu_code'])
+      if recipe is None:
+        logger.error(f"[Worker] Recipe not found: {order['menu_code']}")
+        order_queue.set_status(order, "FAILED")
+        continue
       
       logger.info(f"[Worker] Processing: {recipe['menu_name']}")
-      run_robot_sequence(robot_instance, recipe)
-      order_queue.task_done()
-      logger.info(f"[Worker] Completed: {recipe['menu_name']}")
+      ok = run_robot_sequence(robot_instance, recipe)
+      order_queue.set_status(order, "DONE" if ok else "FAILED")
+      logger.info(f"[Worker] {'Completed' if ok else 'Failed'}: {recipe['menu_name']}")
       
     except Exception as e:
       logger.error(f"[Worker] Error: {e}")
-      time.sleep(1)
+      shutdown_event.wait(1)
+  logger.info("[Worker] Stopped")
 
-def run_robot_sequence(robot, recipe):
+# --- [시퀀스 단계 테이블] ---
+SEQ_TIMING_HISTORY = 200  # 보관할 단계별 시간 기록 수
+sequence_timings = deque(maxlen=SEQ_TIMING_HISTORY)
+
+def build_sequence(recipe):
+    """
+    레시피 -> 단계 테이블
+    name: 단계 이름, cmd/init: 로봇 명령/완료 코드, regs: 명령 전 레지스터 설정
+    device: 완료 후 장비 동작 (펄스는 ON 전송 후 바로 반환), dwell: 장비 동작 시간 (다음 단계는 이 시간이 지난 뒤 시작)
+    result: 완료 후 확인할 결과 레지스터, slot: 픽업 슬롯 배정, skippable: 다음 주문이 있으면 생략
+    """
     wi_time = max(recipe['water_ext_time'], recipe['ice_ext_time'])
     hotwater_time = recipe['hotwater_ext_time']
     coffee_time = recipe['coffee_ext_time']
-    
-    # [Step 1] 컵 배출 및 센서 확인 시퀀스
-    robot.send_command(GET_CUP)
-    
     cup_type = 2 if recipe['cup_num'] == 2 else 1
-    robot.write_register(CUP_IDX, cup_type)
-    logger.info(f"[Seq] Cup Type Set: {cup_type}")
-    
-    if (robot.wait_for_init(CUP_INIT) and robot.wait_for_register(CUP_RES, 1)):
-      logger.info("컵 배출 성공")
-    elif robot.wait_for_init(CUP_INIT) and robot.wait_for_register(CUP_RES, 2):
-      logger.info("컵 배출 실패")
-      robot.stop_program()
-      clear_queue(order_queue)
-      logger.info("[Seq] Queue cleared & Robot stopped")
-      return False
-      
-    logger.info("[Seq] Cup Sequence Done")
 
-    # [Step 2] 물/얼음 구간
+    steps = [{'name': 'cup', 'cmd': GET_CUP, 'init': CUP_INIT, 'regs': {CUP_IDX: cup_type}, 'result': CUP_RES}]
     if wi_time > 0:
-        robot.send_command(GET_WI)
-        if robot.wait_for_init(WI_INIT):
-            logger.info(f"[Seq] Water/Ice Dispensing... ({wi_time}s)")
-            device.pulse_coil(5, DO_ICE_BTN, 0.5)
-            time.sleep(wi_time)
-            robot.send_command(WI_N)
-            robot.wait_for_init(WI_N_INIT)
-    else: pass
-            
-    # [Step 3] 뜨거운 물 구간
+        steps.append({'name': 'water_ice', 'cmd': GET_WI, 'init': WI_INIT,
+                      'device': lambda: device.pulse_coil(5, DO_ICE_BTN, 0.5), 'dwell': wi_time})
+        steps.append({'name': 'water_ice_n', 'cmd': WI_N, 'init': WI_N_INIT})
     if hotwater_time > 0:
-        robot.send_command(GET_HOTWATER)
-        if robot.wait_for_init(HOTWATER_INIT):
-            logger.info(f"[Seq] Hot Water Dispensing... ({hotwater_time}s)")
-            time.sleep(hotwater_time)
-            robot.send_command(HOTWATER_N)
-            robot.wait_for_init(HOTWATER_N_INIT)            
-    else: pass
-
-    # [Step 4] 커피 구간
+        steps.append({'name': 'hotwater', 'cmd': GET_HOTWATER, 'init': HOTWATER_INIT, 'dwell': hotwater_time})
+        steps.append({'name': 'hotwater_n', 'cmd': HOTWATER_N, 'init': HOTWATER_N_INIT})
     if coffee_time > 0:
-        robot.send_command(GET_COFFEE)
-        if robot.wait_for_init(COFFEE_INIT):
-            logger.info(f"[Seq] Coffee Dispensing... ({coffee_time}s)")
-            time.sleep(coffee_time)
-            robot.send_command(COFFEE_N)
-            robot.wait_for_init(COFFEE_N_INIT)         
-    else: pass
-    
-    robot.send_command(SERVING_N)
-    robot.wait_for_init(SERVING_N_INIT)
-    
+        steps.append({'name': 'coffee', 'cmd': GET_COFFEE, 'init': COFFEE_INIT, 'dwell': coffee_time})
+        steps.append({'name': 'coffee_n', 'cmd': COFFEE_N, 'init': COFFEE_N_INIT})
+    steps.append({'name': 'serving_n', 'cmd': SERVING_N, 'init': SERVING_N_INIT})
+    steps.append({'name': 'serving', 'cmd': GET_SERVING, 'init': SERVING_INIT, 'slot': True})
+    steps.append({'name': 'home', 'cmd': MOVE_HOME, 'init': HOME_INIT, 'skippable': True})
+    return steps
+
+def abort_sequence(robot, reason):
+    logger.error(f"[Seq] Aborted: {reason}")
+    robot.stop_program()
+    logger.info(f"[Seq] Robot stopped, {order_queue.qsize()} orders kept WAITING")
+    return False
+
+def run_robot_sequence(robot, recipe):
+    """
+    단계 테이블 실행
+    - 장비 동작은 시작만 하고 dwell 종료 시각만 기록 → 다음 명령은 남은 시간만 대기
+    - 다음 주문이 이미 대기 중이면 HOME 복귀를 생략하고 바로 다음 주문의 컵 단계로 이어감
+    """
+    ready_at = 0.0   # 앞 단계 장비 동작이 끝나는 시각
+    order_start = time.time()
     target_slot = None
-    while target_slot is None:
-      for slot_num in range(1, 5):
-        if not pickup_slots[slot_num]:
-          target_slot = slot_num
-          break
-      if target_slot is None:
-        logger.warning("[Seq] No available pickup slot")
-        time.sleep(1)
-        if not robot.is_running:
-          logger.warning("[Seq] Robot is not running")
-          return False
-      
-      robot.write_register(PICKUP_IDX, target_slot)
-      logger.info(f"[Seq] Empty Slot Found: {target_slot} Serving")
-      
-      robot.send_command(GET_SERVING)
-      if robot.wait_for_init(SERVING_INIT):
-        logger.info(f"[Seq] Serving {target_slot} Done")
-        
-        pickup_slots[target_slot] = True
-        db.update_slot_status(target_slot, True)
-        logger.info(f"[Seq] Serving Slot {target_slot} Freed")
-    
-    robot.send_command(MOVE_HOME)
-    robot.wait_for_init(HOME_INIT)
+
+    for step in build_sequence(recipe):
+        if step.get('skippable') and not order_queue.empty() and robot.is_running:
+            logger.info(f"[Seq] Skip {step['name']} (next order queued)")
+            continue
+
+        wait = ready_at - time.time()
+        if wait > 0:
+            time.sleep(wait)
+
+        if step.get('slot'):
+            target_slot = slot_manager.reserve(should_wait=lambda: robot.is_running)
+            if target_slot is None:
+                logger.warning("[Seq] Robot is not running")
+                return False
+            robot.write_register(PICKUP_IDX, target_slot)
+            logger.info(f"[Seq] Empty Slot Found: {target_slot} Serving")
+
+        for addr, value in step.get('regs', {}).items():
+            robot.write_register(addr, value)
+
+        started = time.time()
+        robot.send_command(step['cmd'])
+        if not robot.wait_for_init(step['init']):
+            if step.get('slot'):
+                slot_manager.release(target_slot)  # 서빙 실패 → 예약 취소
+            return abort_sequence(robot, f"{step['name']} init {step['init']} not received")
+        finished = time.time()
+
+        if step.get('result'):
+            # 결과 레지스터는 한 번만 확인 (1: 성공, 그 외: 실패)
+            if robot.wait_for_register(step['result'], 1) != 1:
+                return abort_sequence(robot, f"{step['name']} failed")
+            logger.info("컵 배출 성공")
+
+        if step.get('device'):
+            step['device']()
+        if step.get('dwell'):
+            ready_at = finished + step['dwell']
+            logger.info(f"[Seq] {step['name']} Dispensing... ({step['dwell']}s)")
+
+        if step.get('slot'):
+            slot_manager.occupy(target_slot)
+            logger.info(f"[Seq] Serving {target_slot} Done")
+
+        sequence_timings.append({
+            'menu_code': recipe.get('menu_code'),
+            'step': step['name'],
+            'cmd': step['cmd'],
+            'started_at': round(started, 3),
+            'motion_sec': round(finished - started, 3),
+            'dwell_sec': step.get('dwell', 0),
+        })
+        logger.info(f"[Seq] Step {step['name']} done in {finished - started:.2f}s")
+
+    logger.info(f"[Seq] {recipe['menu_name']} finished in {time.time() - order_start:.1f}s")
     return True
   
 def main():
@@ -536,14 +820,60 @@ def main():
     
   if not device.connect():
       logger.warning("[System] Failed to connect to IO Device (Virtual Mode)")
+
+  recipe_cache.refresh(force=True)
+  order_queue.reload(startup=True)
   
   worker_thread = threading.Thread(target=robot_worker, args=(robot,), daemon=True)
   worker_thread.start()
   monitor_threading = threading.Thread(target=monitor_worker, args=(robot,), daemon=True)
   monitor_threading.start()
   
-  logger.info("[System] Flask Server Starting...")
-  app.run(host='0.0.0.0', port=5000, debug=True)
+  # SIGTERM 도 Ctrl+C 와 같이 정상 종료 경로로 (주문 상태 반영 후 종료)
+  def _exit(signum, frame):
+    raise SystemExit(0)
+  signal.signal(signal.SIGTERM, _exit)
+
+  conf = load_http_config()
+  try:
+    mode = conf['mode']
+    if mode == 'waitress':
+      try:
+        from waitress import serve
+      except ImportError:
+        logger.warning("[System] waitress not installed, using Flask dev server")
+        mode = 'dev'
+    if mode == 'waitress':
+      logger.info(f"[System] HTTP Server Starting (waitress, threads={conf['threads']}, port={conf['port']})...")
+      serve(app, host='0.0.0.0', port=conf['port'], threads=conf['threads'],
+            connection_limit=conf['connection_limit'], channel_timeout=conf['channel_timeout'],
+            backlog=conf['backlog'])
+    else:
+      # 디버거/리로더는 로봇 제어 프로세스에서 사용하지 않음
+      logger.info(f"[System] HTTP Server Starting (Flask dev server, port={conf['port']})...")
+      app.run(host='0.0.0.0', port=conf['port'], debug=False, threaded=True, use_reloader=False)
+  except (SystemExit, KeyboardInterrupt):
+    pass
+  finally:
+    logger.info("[System] Shutting down...")
+    shutdown(conf['shutdown_timeout'], [worker_thread, monitor_threading])
+    logger.info("[System] Server stopped")
+
+def shutdown(timeout, threads):
+  """
+  종료 처리: 작업/모니터 스레드 종료 (진행 중인 주문은 끝까지) → 주문 상태 반영 → 장비/로봇 연결 해제
+  """
+  deadline = time.time() + timeout
+  shutdown_event.set()
+  for t in threads:
+    t.join(max(0.0, deadline - time.time()))
+    if t.is_alive():
+      logger.warning(f"[System] {t.name} still running at shutdown")
+  flush = threading.Thread(target=order_queue.status_queue.join, daemon=True)
+  flush.start()
+  flush.join(max(0.0, deadline - time.time()))
+  device.close()
+  robot.close()
      
 if __name__ == "__main__":
   main()